@@ -0,0 +1,115 @@
+"""Rate limiting and load shedding for routes that fan out to Stripe.
+
+`TokenBucketLimiter` keeps one bucket per key (client IP, checkout session)
+in an LRU-bounded OrderedDict: two floats per key, refilled lazily on
+access, so a burst from one client is rejected with a Retry-After hint
+without affecting anyone else. `ClientAddressResolver` picks the key for
+per-client limits: behind an ingress every connection comes from the proxy,
+so the client is the right-most X-Forwarded-For hop not added by a trusted
+proxy. `ConcurrencyLimiter` caps how many Stripe-bound
+requests a worker serves at once; a short bounded queue absorbs spikes and
+everything beyond it is shed immediately instead of piling up.
+"""
+import asyncio
+import ipaddress
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, last refill timestamp]
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def acquire(self, key: str, cost: float = 1.0) -> float:
+        """Take `cost` tokens; returns 0 when allowed, else seconds until enough tokens exist."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= cost:
+            bucket[0] -= cost
+            return 0.0
+        return (cost - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ClientAddressResolver:
+    def __init__(self, trusted_proxies: str = ""):
+        """`trusted_proxies` is a comma-separated list of addresses or CIDR ranges, or "*"."""
+        entries = [entry.strip() for entry in trusted_proxies.split(",") if entry.strip()]
+        self.trust_all = "*" in entries
+        self.networks = [ipaddress.ip_network(entry, strict=False) for entry in entries if entry != "*"]
+        # Without a configured proxy list there is no client address to trust
+        self.enabled = bool(entries)
+
+    def is_trusted(self, address: str) -> bool:
+        if self.trust_all:
+            return True
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.networks)
+
+    def resolve(self, request) -> Optional[str]:
+        """The client address to rate-limit on, or None when per-client limits are off."""
+        if not self.enabled:
+            return None
+        address = request.client.host if request.client else "unknown"
+        forwarded = request.headers.get("x-forwarded-for", "")
+        hops = [hop.strip() for hop in forwarded.split(",") if hop.strip()]
+        # Walk back from the peer through the proxies we trust; the first other hop is the client
+        while hops and self.is_trusted(address):
+            address = hops.pop()
+        return address
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: int, max_queue: int = 0, max_wait: float = 1.0):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = None
+
+    async def acquire(self) -> bool:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+            self.active += 1
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {"active": self.active, "waiting": self.waiting, "limit": self.limit}
+
+
+def retry_after_header(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
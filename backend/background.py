@@ -0,0 +1,38 @@
+"""Background tasks owned by the API process.
+
+Sweepers, reapers and watchers each run one long-lived coroutine started in
+the lifespan and cancelled on shutdown. `BackgroundTask` holds that task;
+`run_every` is the loop most of them run: sleep, do the work, log a failure
+and keep going.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Coroutine, Optional
+
+
+class BackgroundTask:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, coro: Coroutine):
+        self._task = asyncio.create_task(coro)
+
+    async def stop(self):
+        """Cancel the task and wait for it to unwind; a no-op if it was never started."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def run_every(interval_seconds: float, work: Callable[[], Awaitable], logger: logging.Logger, description: str):
+    """Call `work` every `interval_seconds`; a failed run is logged as `"<description> failed"`."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await work()
+        except Exception:
+            logger.exception("%s failed", description)
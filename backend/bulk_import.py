@@ -0,0 +1,155 @@
+"""Streaming bulk import of registrations from NDJSON or CSV uploads.
+
+The request body is consumed chunk by chunk, each row is validated as soon as
+its line is complete and valid rows are written with insert_many(ordered=False)
+in fixed-size batches. Progress and per-row errors are yielded as they happen,
+so memory use depends on the batch size, not on the size of the upload.
+CSV rows must not contain embedded newlines. Lines longer than
+MAX_LINE_BYTES and lines that are not UTF-8 are reported as row errors.
+"""
+import csv
+import json
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+from starlette.responses import StreamingResponse
+
+MAX_LINE_BYTES = 64 * 1024
+
+
+def decode_line(line: bytes, max_line_bytes: int = MAX_LINE_BYTES) -> Tuple[Optional[str], Optional[str]]:
+    if len(line) > max_line_bytes:
+        return None, f"line longer than {max_line_bytes} bytes"
+    try:
+        return line.decode("utf-8-sig").rstrip("\r"), None
+    except UnicodeDecodeError:
+        return None, "line is not valid UTF-8; save the file as UTF-8 (\"CSV UTF-8\" in Excel)"
+
+
+async def iter_lines(chunks: AsyncIterator[bytes],
+                     max_line_bytes: int = MAX_LINE_BYTES) -> AsyncIterator[Tuple[Optional[str], Optional[str]]]:
+    """Yield (line, error) for every line; undecodable or overlong lines come back as errors."""
+    buffer = b""
+    overlong = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if overlong:
+                # Rest of a line that was already reported
+                overlong = False
+                continue
+            yield decode_line(line, max_line_bytes)
+        if len(buffer) > max_line_bytes:
+            # Drop the partial line instead of buffering an upload without newlines
+            if not overlong:
+                yield None, f"line longer than {max_line_bytes} bytes"
+                overlong = True
+            buffer = b""
+    if buffer and not overlong:
+        yield decode_line(buffer, max_line_bytes)
+
+
+async def iter_rows(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """Yield (row_number, row, parse_error) for every non-empty line."""
+    header = None
+    row_number = 0
+    async for line, error in iter_lines(chunks):
+        if error is not None:
+            if fmt == "csv" and header is None:
+                yield 0, None, f"header: {error}"
+                return
+            row_number += 1
+            yield row_number, None, error
+            continue
+        if not line.strip():
+            continue
+        if fmt == "csv":
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            row_number += 1
+            if len(values) != len(header):
+                yield row_number, None, f"expected {len(header)} columns, got {len(values)}"
+                continue
+            # Empty CSV cells mean "not provided"
+            yield row_number, {k: v for k, v in zip(header, values) if v != ""}, None
+        else:
+            row_number += 1
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield row_number, None, f"invalid JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield row_number, None, "expected a JSON object"
+                continue
+            yield row_number, row, None
+
+
+def describe_error(error: Exception) -> List[str]:
+    if hasattr(error, "errors"):
+        return [f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors()]
+    return [str(error)]
+
+
+class RegistrationImporter:
+    def __init__(self, database, build_doc: Callable[[Dict], Dict], batch_size: int = 500):
+        self.database = database
+        self.build_doc = build_doc
+        self.batch_size = batch_size
+
+    async def run(self, chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Dict]:
+        summary = {"rows": 0, "inserted": 0, "failed": 0, "batches": 0}
+        batch: List[Tuple[int, Dict]] = []
+
+        async for row_number, row, parse_error in iter_rows(chunks, fmt):
+            summary["rows"] += 1
+            if parse_error is not None:
+                summary["failed"] += 1
+                yield {"row": row_number, "status": "error", "errors": [parse_error]}
+                continue
+            try:
+                batch.append((row_number, self.build_doc(row)))
+            except ValueError as e:
+                summary["failed"] += 1
+                yield {"row": row_number, "status": "error", "errors": describe_error(e)}
+                continue
+            if len(batch) >= self.batch_size:
+                async for event in self._flush(batch, summary):
+                    yield event
+                batch = []
+
+        if batch:
+            async for event in self._flush(batch, summary):
+                yield event
+        yield {"summary": summary}
+
+    async def _flush(self, batch: List[Tuple[int, Dict]], summary: Dict) -> AsyncIterator[Dict]:
+        summary["batches"] += 1
+        failed_rows = []
+        try:
+            result = await self.database.registrations.collection.insert_many([doc for _, doc in batch], ordered=False)
+            inserted = len(result.inserted_ids)
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            failed_rows = [(batch[err["index"]][0], err["errmsg"]) for err in e.details.get("writeErrors", [])]
+
+        summary["inserted"] += inserted
+        summary["failed"] += len(failed_rows)
+        for row_number, message in failed_rows:
+            yield {"row": row_number, "status": "error", "errors": [message]}
+        yield {"batch": summary["batches"], "inserted": inserted, "failed": len(failed_rows)}
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """StreamingResponse for handlers that keep reading the request body while responding.
+
+    The stock response listens for disconnects on `receive`, which would race
+    request.stream() for body chunks; a disconnect surfaces as ClientDisconnect instead.
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,127 @@
+"""Package catalog stored in Mongo and served from an in-process cache.
+
+Every worker keeps the active packages in memory, so catalog reads on the
+request path cost no database round trip. Each package document carries a
+`version` that is bumped on every change and snapshotted into
+`package_versions`; registrations store that version instead of a copy of the
+package. Workers reload the catalog when a change stream reports a write to
+`packages`, or every `poll_interval` seconds when change streams are not
+available.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+
+from background import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_FIELDS = ("name", "price", "currency", "sessions")
+
+
+class PackageCatalog:
+    def __init__(self, database, poll_interval: float = 30.0):
+        self.database = database
+        self.poll_interval = poll_interval
+        self.packages: Dict[str, Dict] = {}
+        self.version = None
+        self._task = BackgroundTask()
+
+    @property
+    def collection(self):
+        return self.database.db["packages"]
+
+    @property
+    def versions(self):
+        return self.database.db["package_versions"]
+
+    def get(self, package_id: str) -> Optional[Dict]:
+        return self.packages.get(package_id)
+
+    async def seed(self, defaults: Dict[str, Dict]):
+        """Insert the built-in packages that are missing, leaving edited ones untouched."""
+        now = datetime.utcnow()
+        for package_id, package in defaults.items():
+            doc = {field: package[field] for field in PACKAGE_FIELDS}
+            result = await self.collection.update_one(
+                {"package_id": package_id},
+                {"$setOnInsert": {**doc, "active": True, "version": 1, "updated_at": now}},
+                upsert=True,
+            )
+            if result.upserted_id is not None:
+                await self._snapshot({"package_id": package_id, **doc, "active": True, "version": 1})
+
+    async def reload(self):
+        cursor = self.collection.find({"active": True}, {"_id": 0, "package_id": 1, "version": 1, **{f: 1 for f in PACKAGE_FIELDS}})
+        packages = {}
+        async for doc in cursor:
+            packages[doc.pop("package_id")] = doc
+        signature = ",".join(f"{package_id}:{packages[package_id]['version']}" for package_id in sorted(packages))
+        version = hashlib.sha1(signature.encode()).hexdigest()[:12]
+        if version == self.version:
+            return
+        self.packages = packages
+        self.version = version
+        logger.info("Loaded package catalog version %s (%d packages)", version, len(packages))
+
+    async def update(self, package_id: str, fields: Dict) -> Dict:
+        """Create or change a package; returns the new catalog entry."""
+        doc = await self.collection.find_one_and_update(
+            {"package_id": package_id},
+            {"$set": {**fields, "updated_at": datetime.utcnow()}, "$inc": {"version": 1}},
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        await self._snapshot(doc)
+        await self.reload()
+        return doc
+
+    async def _snapshot(self, doc: Dict):
+        snapshot = {field: doc.get(field) for field in ("package_id", "version", "active") + PACKAGE_FIELDS}
+        try:
+            await self.versions.insert_one({**snapshot, "created_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            pass
+
+    async def get_version(self, package_id: str, version: int) -> Optional[Dict]:
+        return await self.versions.find_one({"package_id": package_id, "version": version}, {"_id": 0})
+
+    async def start(self, use_change_stream: bool = False):
+        await self.reload()
+        self._task.start(self._watch() if use_change_stream else self._poll())
+
+    async def stop(self):
+        await self._task.stop()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.reload()
+            except PyMongoError as e:
+                logger.warning("Package catalog reload failed: %s", e)
+
+    async def _watch(self):
+        while True:
+            try:
+                async with self.collection.watch() as stream:
+                    # Writes between the last load and the stream opening would be missed otherwise
+                    await self.reload()
+                    async for _ in stream:
+                        await self.reload()
+            except OperationFailure as e:
+                if e.code == 40573:
+                    logger.warning("Change streams require a replica set; polling the package catalog instead")
+                    await self._poll()
+                    return
+                logger.warning("Package catalog change stream failed, retrying: %s", e)
+                await asyncio.sleep(5)
+            except PyMongoError as e:
+                logger.warning("Package catalog change stream unavailable, retrying: %s", e)
+                await asyncio.sleep(5)
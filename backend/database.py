@@ -0,0 +1,108 @@
+"""Async MongoDB data layer built on motor.
+
+The client is created and closed from the FastAPI lifespan so that every
+worker process owns its own connection pool.
+
+Writes and reads that must see them go through `db` (primary). Reads that
+tolerate bounded lag (exports, analytics, status lookups) go through
+`reporting_db`; with `secondary_reads` enabled it uses secondaryPreferred
+with maxStalenessSeconds, so they are served by a secondary that is at most
+that far behind and fall back to the primary when none qualifies. A local
+single-node replica set exercises the same code path:
+
+    mkdir -p /tmp/rs0 && mongod --replSet rs0 --dbpath /tmp/rs0 --fork --logpath /tmp/rs0/mongod.log
+    mongosh --eval 'rs.initiate()'
+    MONGO_URL=mongodb://localhost:27017/?replicaSet=rs0 MONGO_SECONDARY_READS=true
+"""
+from typing import Optional, Dict, List
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReadPreference
+from pymongo.read_preferences import SecondaryPreferred
+
+# Lower bound the drivers enforce for maxStalenessSeconds
+MIN_MAX_STALENESS_SECONDS = 90
+
+
+class RegistrationRepository:
+    def __init__(self, collection, reporting_collection=None):
+        self.collection = collection
+        self.reporting_collection = reporting_collection if reporting_collection is not None else collection
+
+    async def insert(self, registration_doc: Dict):
+        await self.collection.insert_one(registration_doc)
+
+
+class PaymentTransactionRepository:
+    def __init__(self, collection, reporting_collection=None):
+        self.collection = collection
+        self.reporting_collection = reporting_collection if reporting_collection is not None else collection
+
+    async def insert(self, payment_doc: Dict):
+        await self.collection.insert_one(payment_doc)
+
+    async def find_by_session(self, session_id: str) -> Optional[Dict]:
+        return await self.collection.find_one({"session_id": session_id})
+
+    async def find_status(self, session_id: str) -> Optional[Dict]:
+        """Lagging read for status polls; a session too new to have replicated is read from the primary."""
+        payment_doc = await self.reporting_collection.find_one({"session_id": session_id})
+        if payment_doc is None:
+            payment_doc = await self.find_by_session(session_id)
+        return payment_doc
+
+    async def find_by_sessions(self, session_ids: List[str]) -> List[Dict]:
+        return await self.collection.find({"session_id": {"$in": session_ids}}).to_list(length=None)
+
+
+class Database:
+    def __init__(self, mongo_url: str, db_name: str, max_pool_size: int = 100, min_pool_size: int = 0,
+                 event_listeners: Optional[List] = None, secondary_reads: bool = False,
+                 max_staleness_seconds: int = MIN_MAX_STALENESS_SECONDS):
+        if secondary_reads and max_staleness_seconds < MIN_MAX_STALENESS_SECONDS:
+            raise ValueError(f"max_staleness_seconds must be at least {MIN_MAX_STALENESS_SECONDS}")
+        self.mongo_url = mongo_url
+        self.db_name = db_name
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.event_listeners = event_listeners or []
+        self.secondary_reads = secondary_reads
+        self.max_staleness_seconds = max_staleness_seconds
+        self.client = None
+        self.db = None
+        self.reporting_db = None
+        self.registrations = None
+        self.payment_transactions = None
+
+    async def connect(self):
+        self.client = AsyncIOMotorClient(
+            self.mongo_url,
+            maxPoolSize=self.max_pool_size,
+            minPoolSize=self.min_pool_size,
+            event_listeners=self.event_listeners,
+        )
+        self.db = self.client[self.db_name]
+        if self.secondary_reads:
+            self.reporting_db = self.db.with_options(
+                read_preference=SecondaryPreferred(max_staleness=self.max_staleness_seconds)
+            )
+        else:
+            self.reporting_db = self.db.with_options(read_preference=ReadPreference.PRIMARY)
+        self.registrations = RegistrationRepository(
+            self.db["registrations"], self.reporting_db["registrations"]
+        )
+        self.payment_transactions = PaymentTransactionRepository(
+            self.db["payment_transactions"], self.reporting_db["payment_transactions"]
+        )
+
+    async def ping(self):
+        await self.client.admin.command("ping")
+
+    async def supports_transactions(self) -> bool:
+        hello = await self.client.admin.command("hello")
+        return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
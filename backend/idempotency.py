@@ -0,0 +1,167 @@
+"""Idempotency-Key support for non-idempotent POST routes.
+
+Keys are claimed in the `idempotency_keys` collection (expired by a TTL index)
+and completed responses are also kept in an in-process LRU. A retry with the
+same key replays the stored response; a concurrent request with the same key
+waits for the first one to finish, whether it runs in this worker or another.
+A claim is leased for `lease_seconds`; if its holder dies without completing
+or releasing it, the next request with the key takes it over once the lease
+has run out. A holder that fails releases the key, and a waiting request then
+claims it and runs the handler itself.
+"""
+import asyncio
+import hashlib
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used with a different request body."""
+
+
+class IdempotencyInProgress(Exception):
+    """Another request with the key is still running."""
+
+
+def request_fingerprint(body: str) -> str:
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, database, max_cached: int = 10000, wait_timeout: float = 30.0, poll_interval: float = 0.2,
+                 lease_seconds: float = 60.0):
+        self.database = database
+        self.max_cached = max_cached
+        self.wait_timeout = wait_timeout
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._cache = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def collection(self):
+        return self.database.db["idempotency_keys"]
+
+    def _remember(self, key: str, fingerprint: str, response: Dict):
+        self._cache[key] = (fingerprint, response)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    async def run(self, key: str, fingerprint: str, handler: Callable[[], Awaitable[Dict]]) -> Dict:
+        while True:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return self._check(key, fingerprint, cached[0], cached[1])
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            try:
+                stored_fingerprint, response = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+            except Exception:
+                pass
+            else:
+                return self._check(key, fingerprint, stored_fingerprint, response)
+            # The holder in this worker failed and released the key; claim it like any other retry
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            stored_fingerprint, response = await self._execute(key, fingerprint, handler)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            future.set_result((stored_fingerprint, response))
+            self._remember(key, stored_fingerprint, response)
+            return self._check(key, fingerprint, stored_fingerprint, response)
+        finally:
+            del self._inflight[key]
+
+    def _check(self, key: str, fingerprint: str, stored_fingerprint: str, response: Dict) -> Dict:
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyConflict(f"Idempotency-Key {key} was already used with a different request")
+        return response
+
+    async def _execute(self, key: str, fingerprint: str, handler):
+        lock_token = uuid.uuid4().hex
+        if not await self._claim(key, fingerprint, lock_token):
+            completed = await self._wait_for_completion(key, fingerprint, lock_token)
+            if completed is not None:
+                return completed
+
+        try:
+            response = await handler()
+        except BaseException:
+            # Release the key so the client can retry after a failure
+            await self.collection.delete_one({"_id": key, "lock_token": lock_token})
+            raise
+
+        # Guarded by the token: a holder whose lease was taken over does not overwrite the new one
+        await self.collection.update_one(
+            {"_id": key, "lock_token": lock_token},
+            {
+                "$set": {"status": "completed", "response": response, "completed_at": datetime.utcnow()},
+                "$unset": {"locked_until": ""},
+            }
+        )
+        return fingerprint, response
+
+    async def _claim(self, key: str, fingerprint: str, lock_token: str) -> bool:
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "_id": key,
+                "fingerprint": fingerprint,
+                "status": "in_progress",
+                "lock_token": lock_token,
+                "locked_until": now + timedelta(seconds=self.lease_seconds),
+                "created_at": now,
+            })
+            return True
+        except DuplicateKeyError:
+            return await self._take_over(key, fingerprint, lock_token)
+
+    async def _take_over(self, key: str, fingerprint: str, lock_token: str) -> bool:
+        """Claim a key whose holder's lease ran out without completing or releasing it."""
+        now = datetime.utcnow()
+        claimed = await self.collection.find_one_and_update(
+            {"_id": key, "status": "in_progress", "locked_until": {"$lt": now}},
+            {"$set": {
+                "fingerprint": fingerprint,
+                "lock_token": lock_token,
+                "locked_until": now + timedelta(seconds=self.lease_seconds),
+            }},
+            projection={"_id": 1},
+        )
+        return claimed is not None
+
+    async def _wait_for_completion(self, key: str, fingerprint: str, lock_token: str) -> Optional[Tuple[str, Dict]]:
+        """Return the stored response, or None once this request has claimed the key itself."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        while True:
+            doc = await self.collection.find_one({"_id": key})
+            if doc is not None and doc["status"] == "completed":
+                return doc["fingerprint"], doc["response"]
+            # The holder failed and released the key, or its lease ran out; whoever claims it next runs the handler
+            if doc is None or (doc.get("locked_until") is not None and doc["locked_until"] < datetime.utcnow()):
+                if await self._claim(key, fingerprint, lock_token):
+                    return None
+                continue
+            if loop.time() >= deadline:
+                raise IdempotencyInProgress(f"Request with Idempotency-Key {key} is still in progress")
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,151 @@
+"""Index bootstrap and query-plan self-check.
+
+`ensure_indexes` is idempotent and runs on every startup. `verify_query_plans`
+explains every production query shape and refuses to start if one of them
+would fall back to a collection scan.
+"""
+import logging
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from search import SEARCH_COLLATION
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "registrations": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("package_id", ASCENDING), ("created_at", ASCENDING)], name="package_id_created_at"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+        IndexModel([("phone_key", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], name="phone_key_created_at"),
+        IndexModel([("name", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+                   name="name_search", collation=SEARCH_COLLATION),
+        IndexModel([("child_name", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)],
+                   name="child_name_search", collation=SEARCH_COLLATION),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+        IndexModel(
+            [("event_id", ASCENDING)],
+            name="event_id_unique",
+            unique=True,
+            partialFilterExpression={"event_id": {"$exists": True}},
+        ),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING)], name="status_created_at"),
+        IndexModel([("registration_id", ASCENDING), ("created_at", DESCENDING)], name="registration_id_created_at"),
+        IndexModel([("rollup_pending", ASCENDING)], name="rollup_pending", sparse=True),
+        IndexModel([("payment_status", ASCENDING), ("created_at", ASCENDING)], name="payment_status_created_at"),
+    ],
+    "webhook_events": [
+        IndexModel([("event_id", ASCENDING)], name="event_id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("received_at", ASCENDING)], name="status_received_at"),
+        IndexModel([("lock_token", ASCENDING)], name="lock_token", sparse=True),
+        IndexModel([("processed_at", ASCENDING)], name="processed_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "daily_rollups": [
+        IndexModel([("day", ASCENDING), ("package_id", ASCENDING), ("currency", ASCENDING)],
+                   name="day_package_currency_unique", unique=True),
+    ],
+    "packages": [
+        IndexModel([("package_id", ASCENDING)], name="package_id_unique", unique=True),
+    ],
+    "package_versions": [
+        IndexModel([("package_id", ASCENDING), ("version", ASCENDING)], name="package_id_version_unique", unique=True),
+    ],
+    "class_slots": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("package_id", ASCENDING), ("starts_at", ASCENDING)], name="package_id_starts_at"),
+    ],
+    "slot_holds": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_expires_at"),
+        IndexModel([("session_id", ASCENDING)], name="session_id", sparse=True),
+        # Only released or releasing holds carry released_at; confirmed holds are kept as bookings
+        IndexModel([("released_at", ASCENDING)], name="released_at_ttl", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "registrations_archive": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+    ],
+    "payment_transactions_archive": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+    ],
+    "idempotency_keys": [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=24 * 3600),
+    ],
+}
+
+# (collection, filter, sort[, collation]) for every query the API issues on a hot path
+QUERY_SHAPES: List[Tuple] = [
+    ("registrations", {"id": "00000000-0000-0000-0000-000000000000"}, None),
+    ("registrations", {"status": "pending_payment", "created_at": {"$lt": datetime(1970, 1, 1)}}, [("created_at", DESCENDING)]),
+    ("registrations", {"created_at": {"$gte": datetime(1970, 1, 1)}}, [("created_at", ASCENDING)]),
+    ("registrations", {"package_id": "explain", "created_at": {"$gte": datetime(1970, 1, 1)}}, [("created_at", ASCENDING)]),
+    ("registrations", {"phone_key": "7770000000"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("registrations", {"phone_key": {"$regex": "^777123"}}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("registrations", {"$or": [
+        {"name": {"$gte": "explain", "$lt": "explain\uffff"}},
+        {"child_name": {"$gte": "explain", "$lt": "explain\uffff"}},
+    ]}, [("created_at", DESCENDING), ("id", DESCENDING)], SEARCH_COLLATION),
+    ("payment_transactions", {"session_id": "cs_explain"}, None),
+    ("payment_transactions", {"registration_id": "explain"}, [("created_at", DESCENDING)]),
+    ("payment_transactions", {"event_id": "evt_explain"}, None),
+    ("payment_transactions", {"status": "initiated", "created_at": {"$lt": datetime(1970, 1, 1)}}, [("created_at", DESCENDING)]),
+    ("payment_transactions", {
+        "status": {"$in": ["initiated", "open"]},
+        "payment_status": {"$ne": "paid"},
+        "created_at": {"$lt": datetime(1970, 1, 1)},
+    }, None),
+    ("payment_transactions", {"session_id": "cs_explain", "rollup_pending": True}, None),
+    ("payment_transactions", {"rollup_pending": True}, None),
+    ("daily_rollups", {"day": {"$gte": "1970-01-01", "$lte": "1970-01-31"}}, [("day", ASCENDING), ("package_id", ASCENDING)]),
+    ("payment_transactions", {"payment_status": {"$in": ["pending", "unpaid"]}, "created_at": {"$lt": datetime(1970, 1, 1)}}, None),
+    ("class_slots", {"id": "explain", "package_id": "explain", "available": {"$gt": 0}}, None),
+    ("slot_holds", {"status": "held", "expires_at": {"$lt": datetime(1970, 1, 1)}}, None),
+    ("slot_holds", {"status": "releasing"}, None),
+    ("slot_holds", {"session_id": {"$in": ["cs_explain"]}, "status": "held"}, None),
+    ("slot_holds", {"session_id": {"$in": ["cs_explain"]}, "status": {"$in": ["releasing", "released"]}}, None),
+    ("webhook_events", {"$or": [
+        {"status": "queued"},
+        {"status": "processing", "locked_until": {"$lt": datetime(1970, 1, 1)}},
+    ]}, [("received_at", ASCENDING)]),
+    ("webhook_events", {"lock_token": "explain"}, None),
+    ("webhook_events", {"status": "processing", "attempts": {"$gte": 5}, "locked_until": {"$lt": datetime(1970, 1, 1)}}, None),
+]
+
+
+async def ensure_indexes(db):
+    for collection_name, indexes in INDEXES.items():
+        created = await db[collection_name].create_indexes(indexes)
+        logger.info("Ensured indexes on %s: %s", collection_name, ", ".join(created))
+
+
+def _plan_stages(plan) -> List[str]:
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def verify_query_plans(db):
+    """Raise RuntimeError if any production query shape resolves to a COLLSCAN."""
+    failures = []
+    for collection_name, query, sort, *collation in QUERY_SHAPES:
+        cursor = db[collection_name].find(query, collation=collation[0] if collation else None)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        if "COLLSCAN" in stages:
+            failures.append(f"{collection_name} {query} -> {' > '.join(stages)}")
+    if failures:
+        raise RuntimeError("Query plans fall back to COLLSCAN:\n" + "\n".join(failures))
+    logger.info("Verified %d query plans use indexes", len(QUERY_SHAPES))
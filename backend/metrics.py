@@ -0,0 +1,207 @@
+"""Lightweight in-process metrics with Prometheus text exposition.
+
+Covers per-route request latency and in-flight counts (ASGI middleware),
+per-collection MongoDB command durations (pymongo command listener) and
+Stripe call durations (reported by the payment gateway). Observations are a
+dict lookup and a bisect, cheap enough to leave on in production.
+"""
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for label_values, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1.0):
+        self.inc(*label_values, amount=-amount)
+
+
+class CallbackGauge:
+    """Gauge whose samples are read from `callback` at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, label: str, callback: Callable[[], Dict[str, float]]):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        for label_value, value in sorted(self.callback().items()):
+            yield f"{self.name}{_format_labels((self.label,), (label_value,))} {value}"
+
+
+class CallbackCounter(CallbackGauge):
+    """Counter read from `callback` at scrape time; the values must only ever grow."""
+    kind = "counter"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *label_values: str):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def samples(self) -> Iterable[str]:
+        for label_values, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labels + ("le",), label_values + (le,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class AppMetrics:
+    def __init__(self):
+        self.request_duration = Histogram(
+            "unibaby_http_request_duration_seconds", "HTTP request latency by route",
+            ("method", "route", "status"),
+        )
+        self.requests_in_flight = Gauge(
+            "unibaby_http_requests_in_flight", "HTTP requests currently being served",
+        )
+        self.mongo_duration = Histogram(
+            "unibaby_mongo_command_duration_seconds", "MongoDB command latency by collection",
+            ("collection", "command", "outcome"),
+        )
+        self.stripe_duration = Histogram(
+            "unibaby_stripe_call_duration_seconds", "Stripe API call latency",
+            ("operation", "outcome"),
+        )
+        self.loop_lag = Histogram(
+            "unibaby_event_loop_lag_seconds", "Delay between a scheduled and actual event loop wake-up",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+        )
+        self.loop_blocked = Counter(
+            "unibaby_event_loop_blocked_total", "Callbacks that blocked the event loop past the threshold",
+        )
+        self._metrics = [
+            self.request_duration, self.requests_in_flight, self.mongo_duration, self.stripe_duration,
+            self.loop_lag, self.loop_blocked,
+        ]
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def observe_stripe(self, operation: str, seconds: float, outcome: str):
+        self.stripe_duration.observe(seconds, operation, outcome)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency and in-flight requests per route template."""
+
+    def __init__(self, app, metrics: AppMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        self.metrics.requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.requests_in_flight.dec()
+            # FastAPI stores the matched route in the scope, giving a low-cardinality label
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            self.metrics.request_duration.observe(elapsed, scope["method"], route_path, str(status["code"]))
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self, metrics: AppMetrics):
+        self.metrics = metrics
+        self._pending: Dict[Tuple[int, int], Tuple[str, str]] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            # getMore carries the collection in a separate field
+            collection = event.command.get("collection", "-")
+        self._pending[(event.connection_id, event.request_id)] = (collection, event.command_name)
+
+    def _finish(self, event, outcome: str):
+        collection, command = self._pending.pop(
+            (event.connection_id, event.request_id), ("-", event.command_name)
+        )
+        self.metrics.mongo_duration.observe(event.duration_micros / 1e6, collection, command, outcome)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
@@ -0,0 +1,88 @@
+"""In-process wake-ups for clients waiting on a checkout to finish.
+
+Handlers that record a terminal payment state call `publish`; the status
+stream endpoint parks on `subscribe`. With several workers, `start` can also
+tail a Mongo change stream so a webhook handled by one worker wakes clients
+connected to another.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+from background import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+
+def is_terminal(payment_status: Optional[str], status: Optional[str]) -> bool:
+    return payment_status == "paid" or status == "expired"
+
+
+def status_payload_from_doc(payment_doc: Dict) -> Dict:
+    return {
+        "status": payment_doc.get("status"),
+        "payment_status": payment_doc.get("payment_status"),
+        "amount_total": int(round(payment_doc.get("amount", 0) * 100)),
+        "currency": payment_doc.get("currency"),
+        "metadata": payment_doc.get("metadata", {}),
+    }
+
+
+class PaymentStatusNotifier:
+    def __init__(self):
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._watch_task = BackgroundTask()
+
+    def subscribe(self, session_id: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session_id, []).append(future)
+        return future
+
+    def unsubscribe(self, session_id: str, future: asyncio.Future):
+        waiters = self._waiters.get(session_id)
+        if not waiters:
+            return
+        if future in waiters:
+            waiters.remove(future)
+        if not waiters:
+            del self._waiters[session_id]
+
+    def publish(self, session_id: str, payload: Dict):
+        for future in self._waiters.pop(session_id, []):
+            if not future.done():
+                future.set_result(payload)
+
+    def start(self, collection, use_change_stream: bool = False):
+        if use_change_stream:
+            self._watch_task.start(self._watch(collection))
+
+    async def stop(self):
+        await self._watch_task.stop()
+
+    async def _watch(self, collection):
+        pipeline = [
+            {"$match": {
+                "operationType": {"$in": ["update", "replace"]},
+                "$or": [
+                    {"fullDocument.payment_status": "paid"},
+                    {"fullDocument.status": "expired"},
+                ],
+            }}
+        ]
+        while True:
+            try:
+                async with collection.watch(pipeline, full_document="updateLookup") as stream:
+                    async for change in stream:
+                        payment_doc = change["fullDocument"]
+                        self.publish(payment_doc["session_id"], status_payload_from_doc(payment_doc))
+            except OperationFailure as e:
+                if e.code == 40573:
+                    logger.error("Change streams require a replica set; cross-worker status wake-ups disabled")
+                    return
+                logger.warning("Payment status change stream failed, retrying: %s", e)
+                await asyncio.sleep(5)
+            except PyMongoError as e:
+                logger.warning("Payment status change stream unavailable, retrying: %s", e)
+                await asyncio.sleep(5)
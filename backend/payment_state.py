@@ -0,0 +1,227 @@
+"""Guarded state transitions for payments and registrations.
+
+Every write carries its allowed source states in the filter, so a stale
+poll or an out-of-order webhook matches nothing and becomes a no-op instead
+of overwriting a newer state. Payments only move forward to `paid`, checkout
+sessions only move `initiated` -> `open` -> `complete`/`expired`, and
+registrations only move `pending_payment` -> `paid` -> `confirmed`.
+The move to `paid` also marks the payment for the revenue rollups, which
+claim the marker before counting it (see rollups.py), and is reported to
+`paid_listeners`; sessions seen `expired` are reported to `expired_listeners`.
+"""
+import asyncio
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+# target payment_status -> payment_status values it may be reached from
+PAYMENT_TRANSITIONS = {
+    "pending": ["pending"],
+    "unpaid": ["pending", "unpaid"],
+    "no_payment_required": ["pending", "unpaid"],
+    "paid": ["pending", "unpaid"],
+}
+
+# target checkout status -> statuses it may be reached from
+STATUS_TRANSITIONS = {
+    "initiated": ["initiated"],
+    "open": ["initiated", "open"],
+    "complete": ["initiated", "open", "complete"],
+    "expired": ["initiated", "open", "expired"],
+}
+
+# target registration status -> statuses it may be reached from
+REGISTRATION_TRANSITIONS = {
+    "paid": ["pending_payment"],
+    "confirmed": ["pending_payment", "paid"],
+}
+
+
+def payment_transition(session_id: str, payment_status: str, status: Optional[str] = None,
+                       extra: Optional[Dict] = None) -> Tuple[Dict, Dict]:
+    """Filter and update moving one payment to `payment_status`/`status`."""
+    allowed = PAYMENT_TRANSITIONS.get(payment_status)
+    if allowed is None:
+        raise ValueError(f"Unknown payment status: {payment_status}")
+
+    query = {"session_id": session_id, "payment_status": {"$in": allowed}}
+    changed = [{"payment_status": {"$ne": payment_status}}]
+    update_data = {"payment_status": payment_status, "updated_at": datetime.utcnow()}
+    if payment_status == "paid":
+        update_data["paid_at"] = update_data["updated_at"]
+        update_data["rollup_pending"] = True
+    if status is not None:
+        allowed_status = STATUS_TRANSITIONS.get(status)
+        if allowed_status is None:
+            raise ValueError(f"Unknown checkout status: {status}")
+        query["status"] = {"$in": allowed_status}
+        changed.append({"status": {"$ne": status}})
+        update_data["status"] = status
+    if extra:
+        update_data.update(extra)
+
+    query["$or"] = changed
+    return query, {"$set": update_data}
+
+
+def registration_transition(registration_id: str, status: str) -> Tuple[Dict, Dict]:
+    """Filter and update moving one registration to `status`."""
+    allowed = REGISTRATION_TRANSITIONS.get(status)
+    if allowed is None:
+        raise ValueError(f"Unknown registration status: {status}")
+
+    query = {"id": registration_id, "status": {"$in": allowed}}
+    return query, {"$set": {"status": status, "updated_at": datetime.utcnow()}}
+
+
+class PaymentStateMachine:
+    def __init__(self, database, use_transactions: bool = False,
+                 paid_listeners: Optional[List[Callable[[List[str]], Awaitable]]] = None,
+                 expired_listeners: Optional[List[Callable[[List[str]], Awaitable]]] = None):
+        self.database = database
+        self.use_transactions = use_transactions
+        # Called in order with the session ids of payments that just moved to paid
+        self.paid_listeners = paid_listeners or []
+        # Called in order with the session ids of checkouts that expired unpaid
+        self.expired_listeners = expired_listeners or []
+
+    @property
+    def payments(self):
+        return self.database.payment_transactions.collection
+
+    @property
+    def registrations(self):
+        return self.database.registrations.collection
+
+    async def apply_checkout_status(self, payment_doc: Dict, payment_status: str, status: str,
+                                    registration_status: str = "paid") -> Optional[Dict]:
+        """Record a status seen at Stripe.
+
+        Returns the updated payment document, or None if the write was stale.
+        """
+        if payment_doc.get("payment_status") == payment_status and payment_doc.get("status") == status:
+            return None
+
+        payment_query, payment_update = payment_transition(payment_doc["session_id"], payment_status, status)
+        if payment_status != "paid":
+            updated_doc = await self.payments.find_one_and_update(
+                payment_query, payment_update, return_document=ReturnDocument.AFTER
+            )
+            if updated_doc is not None and status == "expired":
+                await self._notify(self.expired_listeners, [updated_doc["session_id"]])
+            return updated_doc
+
+        registration_query, registration_update = registration_transition(
+            payment_doc["registration_id"], registration_status
+        )
+        if self.use_transactions:
+            updated_doc = await self._in_transaction(
+                payment_query, payment_update, registration_query, registration_update
+            )
+        else:
+            # Both writes are guarded independently, so they can share one round trip
+            updated_doc, _ = await asyncio.gather(
+                self.payments.find_one_and_update(
+                    payment_query, payment_update, return_document=ReturnDocument.AFTER
+                ),
+                self.registrations.update_one(registration_query, registration_update),
+            )
+        if updated_doc is not None:
+            await self._notify(self.paid_listeners, [updated_doc["session_id"]])
+        return updated_doc
+
+    async def _notify(self, listeners: List[Callable[[List[str]], Awaitable]], session_ids: List[str]):
+        if not session_ids:
+            return
+        for listener in listeners:
+            await listener(session_ids)
+
+    async def _in_transaction(self, payment_query, payment_update, registration_query, registration_update):
+        async with await self.database.client.start_session() as session:
+            async with session.start_transaction():
+                updated_doc = await self.payments.find_one_and_update(
+                    payment_query, payment_update, return_document=ReturnDocument.AFTER, session=session
+                )
+                await self.registrations.update_one(registration_query, registration_update, session=session)
+                return updated_doc
+
+    async def apply_checkout_statuses(self, results: List[Tuple[Dict, str, str]]) -> int:
+        """Bulk variant of apply_checkout_status for (payment_doc, payment_status, status) tuples.
+
+        Returns the number of payments that changed.
+        """
+        payment_ops = []
+        registration_ops = []
+        paid_sessions = []
+        expired_sessions = []
+        for payment_doc, payment_status, status in results:
+            if payment_doc.get("payment_status") == payment_status and payment_doc.get("status") == status:
+                continue
+            payment_ops.append(UpdateOne(*payment_transition(payment_doc["session_id"], payment_status, status)))
+            if payment_status == "paid":
+                registration_ops.append(UpdateOne(*registration_transition(payment_doc["registration_id"], "paid")))
+                paid_sessions.append(payment_doc["session_id"])
+            elif status == "expired":
+                expired_sessions.append(payment_doc["session_id"])
+
+        if not payment_ops:
+            return 0
+        result = await self.payments.bulk_write(payment_ops, ordered=False)
+        if registration_ops:
+            await self.registrations.bulk_write(registration_ops, ordered=False)
+        await self._notify(self.paid_listeners, paid_sessions)
+        await self._notify(self.expired_listeners, expired_sessions)
+        return result.modified_count
+
+    async def apply_webhook_events(self, events: List[Dict]):
+        """Apply a batch of checkout.session.completed/expired events with one bulk_write per collection."""
+        now = datetime.utcnow()
+        payment_ops = []
+        registration_ids = []
+        paid_sessions = []
+        expired_sessions = []
+        missing_registration = []
+        for event in events:
+            status = "expired" if event["event_type"] == "checkout.session.expired" else "complete"
+            query, update = payment_transition(
+                event["session_id"],
+                event["payment_status"],
+                status,
+                extra={"event_id": event["event_id"], "webhook_processed_at": now},
+            )
+            payment_ops.append(UpdateOne(query, update))
+            if event["payment_status"] == "paid":
+                paid_sessions.append(event["session_id"])
+                registration_id = (event.get("metadata") or {}).get("registration_id")
+                if registration_id:
+                    registration_ids.append(registration_id)
+                else:
+                    missing_registration.append(event["session_id"])
+            elif status == "expired":
+                expired_sessions.append(event["session_id"])
+
+        await self.payments.bulk_write(payment_ops, ordered=False)
+        await self._notify(self.paid_listeners, paid_sessions)
+        await self._notify(self.expired_listeners, expired_sessions)
+
+        # Older sessions may predate registration_id in the Stripe metadata
+        if missing_registration:
+            cursor = self.payments.find({"session_id": {"$in": missing_registration}}, {"registration_id": 1})
+            registration_ids.extend([doc["registration_id"] async for doc in cursor])
+
+        if registration_ids:
+            await self.registrations.bulk_write([
+                UpdateOne(*registration_transition(registration_id, "confirmed"))
+                for registration_id in registration_ids
+            ], ordered=False)
+
+
+def build_payment_state(database, rollups, slot_manager, use_transactions: bool = False) -> PaymentStateMachine:
+    """The state machine with the rollup and seat-hold listeners; shared by the API and the reconcile CLI."""
+    return PaymentStateMachine(
+        database,
+        use_transactions=use_transactions,
+        paid_listeners=[rollups.record_paid, slot_manager.confirm],
+        expired_listeners=[slot_manager.release_sessions],
+    )
@@ -0,0 +1,154 @@
+"""Application-scoped payment gateway.
+
+One gateway is created per worker in the FastAPI lifespan and shared by all
+requests. It owns a keep-alive HTTP connection pool towards Stripe, applies a
+timeout to every call and caps the number of concurrent provider calls so a
+burst of checkouts or status polls cannot trip Stripe rate limits. The Stripe
+SDK and emergentintegrations are imported on first use, which keeps worker
+start-up fast.
+
+The SDK does blocking HTTP through `requests`, so provider calls run on a
+dedicated thread pool sized to the concurrency cap; the event loop keeps
+serving other requests and the timeout is enforced while the call is in
+flight. Webhook handling only verifies the signature locally and does not
+wait for a provider slot.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+
+class PaymentGatewayTimeout(Exception):
+    pass
+
+
+class PaymentGateway:
+    def __init__(
+        self,
+        api_key: str,
+        api_base: Optional[str] = None,
+        timeout: float = 10.0,
+        max_concurrency: int = 20,
+        max_connections: int = 50,
+        max_webhook_urls: int = 16,
+        metrics=None,
+    ):
+        self.api_key = api_key
+        self.api_base = api_base
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections
+        self.max_webhook_urls = max_webhook_urls
+        self.metrics = metrics
+        self._semaphore = None
+        self._executor = None
+        self._session = None
+        self._stripe = None
+        self._checkout_types = None
+        self._checkouts = OrderedDict()
+
+    def start(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="stripe")
+
+    def _load_client(self):
+        if self._session is not None:
+            return
+        import requests
+        import stripe
+        from requests.adapters import HTTPAdapter
+        from emergentintegrations.payments.stripe import checkout
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        stripe.default_http_client = stripe.http_client.RequestsClient(timeout=self.timeout, session=session)
+        self._stripe = stripe
+        self._checkout_types = checkout
+        self._session = session
+
+    def checkout_request(self, **fields):
+        """Build a CheckoutSessionRequest without importing the SDK at module load."""
+        self._load_client()
+        return self._checkout_types.CheckoutSessionRequest(**fields)
+
+    def close(self):
+        self._checkouts.clear()
+        if self._executor is not None:
+            # Calls still running are bounded by the HTTP client timeout
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _checkout(self, webhook_url: str = ""):
+        self._load_client()
+        # StripeCheckout binds a webhook URL at construction, so keep one
+        # instance per URL (in practice one per frontend origin).
+        checkout = self._checkouts.get(webhook_url)
+        if checkout is None:
+            checkout = self._checkout_types.StripeCheckout(api_key=self.api_key, webhook_url=webhook_url)
+            self._checkouts[webhook_url] = checkout
+            if len(self._checkouts) > self.max_webhook_urls:
+                self._checkouts.popitem(last=False)
+        else:
+            self._checkouts.move_to_end(webhook_url)
+        if self.api_base:
+            self._stripe.api_base = self.api_base
+        return checkout
+
+    def _observe(self, operation: str, started: float, outcome: str):
+        if self.metrics is not None:
+            self.metrics.observe_stripe(operation, time.perf_counter() - started, outcome)
+
+    async def _call(self, operation: str, call: Callable[[], Awaitable]):
+        async with self._semaphore:
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                # StripeCheckout's coroutines block on HTTP inside, so each one gets its own loop on a pool thread
+                future = asyncio.get_running_loop().run_in_executor(self._executor, asyncio.run, call())
+                result = await asyncio.wait_for(future, timeout=self.timeout)
+                outcome = "ok"
+                return result
+            except asyncio.TimeoutError:
+                outcome = "timeout"
+                raise PaymentGatewayTimeout(f"Payment provider did not respond within {self.timeout}s")
+            finally:
+                self._observe(operation, started, outcome)
+
+    async def create_checkout_session(self, checkout_request, webhook_url: str):
+        checkout = self._checkout(webhook_url)
+        return await self._call(
+            "create_checkout_session", lambda: checkout.create_checkout_session(checkout_request))
+
+    async def get_checkout_status(self, session_id: str):
+        checkout = self._checkout()
+        return await self._call("get_checkout_status", lambda: checkout.get_checkout_status(session_id))
+
+    async def expire_checkout_session(self, session_id: str):
+        """Expire an unpaid session so it can no longer be paid."""
+        self._load_client()
+        if self.api_base:
+            self._stripe.api_base = self.api_base
+
+        # StripeCheckout has no expire call, so this one goes to the SDK directly
+        async def expire():
+            return self._stripe.checkout.Session.expire(session_id, api_key=self.api_key)
+
+        return await self._call("expire_checkout_session", expire)
+
+    async def handle_webhook(self, webhook_body: bytes, stripe_signature: str):
+        # Signature verification is local, so webhook acks never queue behind provider calls
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await self._checkout().handle_webhook(webhook_body, stripe_signature)
+            outcome = "ok"
+            return result
+        finally:
+            self._observe("handle_webhook", started, outcome)
@@ -0,0 +1,95 @@
+"""Pre-serialized, pre-compressed JSON for read-mostly endpoints.
+
+`PrecomputedJSON` encodes a payload once per version of the underlying data
+and keeps identity, gzip and (when the `brotli` package is installed) brotli
+bodies in memory. A request is answered with a header lookup and a byte copy:
+a strong ETag per encoding, `Cache-Control`, and `304 Not Modified` when the
+client's `If-None-Match` still matches.
+"""
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Default response class for the app: orjson when it is installed
+FastJSONResponse = ORJSONResponse if orjson is not None else JSONResponse
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class PrecomputedJSON:
+    def __init__(self, cache_control: str = "public, max-age=60"):
+        self.cache_control = cache_control
+        self.version = None
+        self._etag = None
+        # content-encoding ("" for identity) -> body
+        self._bodies: Dict[str, bytes] = {}
+
+    def update(self, content: Any, version: Optional[str] = None):
+        body = dumps(content)
+        bodies = {"": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            bodies["br"] = brotli.compress(body, quality=11)
+        self._etag = hashlib.sha256(body).hexdigest()[:20]
+        self._bodies = bodies
+        self.version = version
+
+    def _encoding_for(self, request: Request) -> str:
+        accepted = set()
+        for part in request.headers.get("accept-encoding", "").split(","):
+            name, _, params = part.partition(";")
+            params = params.strip()
+            try:
+                quality = float(params[2:]) if params.startswith("q=") else 1.0
+            except ValueError:
+                quality = 1.0
+            if quality > 0:
+                accepted.add(name.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self._bodies:
+                return encoding
+        return ""
+
+    def _not_modified(self, request: Request) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            # Any encoding of the current body is still a valid cached copy
+            opaque = tag.removeprefix("W/").strip('"').split("-", 1)[0]
+            if opaque == self._etag:
+                return True
+        return False
+
+    def respond(self, request: Request) -> Response:
+        encoding = self._encoding_for(request)
+        headers = {
+            "ETag": f'"{self._etag}-{encoding}"' if encoding else f'"{self._etag}"',
+            "Cache-Control": self.cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if self._not_modified(request):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(self._bodies[encoding], media_type="application/json", headers=headers)
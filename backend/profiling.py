@@ -0,0 +1,225 @@
+"""Opt-in request profiling and event-loop health monitoring.
+
+`ProfilingMiddleware` samples the event-loop thread's stack while a chosen
+request is in flight and writes the result in collapsed-stack format (load it
+into speedscope or flamegraph.pl). A request is profiled when it carries the
+admin token in the `X-Profile-Request` header, or at random with
+PROFILING_SAMPLE_RATE when profiling is enabled. The sampler sees the whole
+loop thread, so a profile also contains the frames of every other request
+that ran on the loop at the same time; profile on an otherwise idle worker
+(or compare against a baseline) to attribute time to one request.
+
+`LoopMonitor` measures event-loop lag and runs a watchdog thread that
+captures the loop thread's stack whenever a single callback blocks the loop
+for longer than a threshold, so synchronous calls show up immediately.
+"""
+import asyncio
+import hmac
+import logging
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter, deque
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from background import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+
+def collapse_stack(frame) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(daemon=True, name="request-profiler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = StackCounter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        output_dir: str,
+        secret: Optional[str] = None,
+        enabled: bool = False,
+        sample_rate: float = 0.0,
+        interval: float = 0.005,
+        max_concurrent: int = 2,
+        max_files: int = 200,
+    ):
+        self.output_dir = Path(output_dir)
+        self.secret = secret
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_concurrent = max_concurrent
+        self.max_files = max_files
+        self._active = 0
+
+    def should_profile(self, token: Optional[str]) -> bool:
+        if self._active >= self.max_concurrent:
+            return False
+        # Compared as bytes: compare_digest raises TypeError on non-ASCII str
+        if token and self.secret and hmac.compare_digest(token.encode(), self.secret.encode()):
+            return True
+        return self.enabled and random.random() < self.sample_rate
+
+    def start(self) -> StackSampler:
+        self._active += 1
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        sampler.start()
+        return sampler
+
+    async def finish(self, sampler: StackSampler, method: str, route: str, status: int, elapsed: float) -> Path:
+        sampler.stop()
+        self._active -= 1
+        # Joining the sampler and writing the file would otherwise block the loop
+        return await asyncio.to_thread(self._write, sampler, method, route, status, elapsed)
+
+    def _write(self, sampler: StackSampler, method: str, route: str, status: int, elapsed: float) -> Path:
+        sampler.join()
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        slug = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+        path = self.output_dir / f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{method}-{slug}-{status}-{int(elapsed * 1000)}ms.collapsed"
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in sampler.samples.most_common()))
+        self._prune()
+        return path
+
+    def _prune(self):
+        files = sorted(self.output_dir.glob("*.collapsed"))
+        for old in files[:-self.max_files]:
+            old.unlink(missing_ok=True)
+
+    def list_profiles(self) -> List[Dict]:
+        if not self.output_dir.exists():
+            return []
+        profiles = []
+        for path in sorted(self.output_dir.glob("*.collapsed"), reverse=True):
+            stat = path.stat()
+            profiles.append({
+                "name": path.name,
+                "size": stat.st_size,
+                "created_at": datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+            })
+        return profiles
+
+    def profile_path(self, name: str) -> Optional[Path]:
+        path = (self.output_dir / name).resolve()
+        if path.parent != self.output_dir.resolve() or not path.is_file():
+            return None
+        return path
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile-request":
+                token = value.decode("latin-1")
+                break
+        if not self.profiler.should_profile(token):
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        sampler = self.profiler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", scope["path"])
+            path = await self.profiler.finish(sampler, scope["method"], route, status["code"], time.perf_counter() - started)
+            logger.info("Wrote request profile %s", path)
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.1, blocking_threshold: float = 0.1, metrics=None, max_reports: int = 50):
+        self.interval = interval
+        self.blocking_threshold = blocking_threshold
+        self.metrics = metrics
+        self.reports = deque(maxlen=max_reports)
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = BackgroundTask()
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task.start(self._measure_lag())
+        self._watchdog = threading.Thread(target=self._watch, daemon=True, name="loop-watchdog")
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        await self._task.stop()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+
+    async def _measure_lag(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            if self.metrics is not None:
+                self.metrics.loop_lag.observe(max(0.0, now - expected))
+
+    def _watch(self):
+        reported_heartbeat = None
+        while not self._stopped.wait(self.blocking_threshold / 2):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            # Report each blocking episode once, at the first check past the threshold
+            if blocked_for < self.blocking_threshold or heartbeat == reported_heartbeat:
+                continue
+            reported_heartbeat = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            self.reports.append({
+                "detected_at": datetime.utcnow().isoformat(),
+                "blocked_ms": round(blocked_for * 1000, 1),
+                "stack": stack,
+            })
+            if self.metrics is not None:
+                self.metrics.loop_blocked.inc()
+            logger.warning("Event loop blocked for %.0f ms:\n%s", blocked_for * 1000, stack)
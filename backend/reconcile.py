@@ -0,0 +1,137 @@
+"""Reconcile payments whose webhook never arrived.
+
+Streams non-terminal payment_transactions older than a cutoff with a batched
+cursor, asks Stripe for each session under a concurrency limit and applies a
+whole batch of state changes with one bulk_write. Runs as a periodic
+background task inside the API or once from the command line:
+
+    python reconcile.py --older-than 30 --concurrency 10
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from background import BackgroundTask, run_every
+
+logger = logging.getLogger(__name__)
+
+PENDING_STATUSES = ["initiated", "open"]
+
+
+class PaymentReconciler:
+    def __init__(
+        self,
+        database,
+        gateway,
+        state_machine,
+        on_updated: Optional[Callable[[List[str]], Awaitable[None]]] = None,
+        older_than_minutes: float = 30,
+        batch_size: int = 200,
+        concurrency: int = 10,
+    ):
+        self.database = database
+        self.gateway = gateway
+        self.state_machine = state_machine
+        self.on_updated = on_updated
+        self.older_than_minutes = older_than_minutes
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._task = BackgroundTask()
+
+    async def sweep(self) -> Dict:
+        started = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(minutes=self.older_than_minutes)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        report = {"scanned": 0, "updated": 0, "errors": 0, "batches": 0}
+
+        async def check(payment_doc):
+            async with semaphore:
+                try:
+                    checkout_status = await self.gateway.get_checkout_status(payment_doc["session_id"])
+                except Exception as e:
+                    logger.warning("Reconcile: status lookup failed for %s: %s", payment_doc["session_id"], e)
+                    report["errors"] += 1
+                    return None
+                return payment_doc, checkout_status.payment_status, checkout_status.status
+
+        cursor = self.database.payment_transactions.collection.find(
+            {"status": {"$in": PENDING_STATUSES}, "payment_status": {"$ne": "paid"}, "created_at": {"$lt": cutoff}},
+            {"_id": 0, "session_id": 1, "registration_id": 1, "payment_status": 1, "status": 1},
+        ).batch_size(self.batch_size)
+
+        batch = []
+        async for payment_doc in cursor:
+            batch.append(payment_doc)
+            if len(batch) >= self.batch_size:
+                await self._process_batch(batch, check, report, started)
+                batch = []
+        if batch:
+            await self._process_batch(batch, check, report, started)
+
+        report["elapsed_seconds"] = round(time.monotonic() - started, 3)
+        logger.info("Reconcile finished: %s", report)
+        return report
+
+    async def _process_batch(self, batch, check, report, started):
+        results = [r for r in await asyncio.gather(*(check(doc) for doc in batch)) if r is not None]
+        report["updated"] += await self.state_machine.apply_checkout_statuses(results)
+        report["scanned"] += len(batch)
+        report["batches"] += 1
+        if self.on_updated is not None:
+            await self.on_updated([doc["session_id"] for doc in batch])
+        elapsed = time.monotonic() - started
+        logger.info(
+            "Reconcile progress: %d scanned, %d updated, %d errors, %.1f sessions/s",
+            report["scanned"], report["updated"], report["errors"], report["scanned"] / max(elapsed, 1e-6)
+        )
+
+    def start(self, interval_seconds: float):
+        self._task.start(run_every(interval_seconds, self.sweep, logger, "Reconcile sweep"))
+
+    async def stop(self):
+        await self._task.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Reconcile stale pending payments with Stripe")
+    parser.add_argument("--older-than", type=float, default=30, help="minutes since the checkout was created")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    from database import Database
+    from payment_state import build_payment_state
+    from payments import PaymentGateway
+    from rollups import RevenueRollups
+    from slots import SlotManager
+
+    database = Database(
+        os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+        os.environ.get('MONGO_DB_NAME', 'unibaby_pool'),
+    )
+    gateway = PaymentGateway(os.environ['STRIPE_API_KEY'], api_base=os.environ.get('STRIPE_API_BASE'))
+    await database.connect()
+    gateway.start()
+    try:
+        reconciler = PaymentReconciler(
+            database,
+            gateway,
+            build_payment_state(database, RevenueRollups(database), SlotManager(database)),
+            older_than_minutes=args.older_than,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+        )
+        print(json.dumps(await reconciler.sweep(), indent=2))
+    finally:
+        gateway.close()
+        database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
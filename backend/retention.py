@@ -0,0 +1,168 @@
+"""Archive abandoned checkouts out of the hot collections.
+
+Unpaid payment_transactions (`pending`/`unpaid`) older than the cutoff are
+copied to `payment_transactions_archive` and deleted in batches. With each
+batch, the `pending_payment` registrations those checkouts were started for
+are moved to `registrations_archive` once no payment of theirs is left in the
+hot collection. Registrations that never had a checkout (bulk imports, plain
+sign-ups) are never selected. Every
+delete repeats the unpaid condition in its filter, so a record that gets
+paid while a batch is in flight stays where it is (and its archive copy is
+dropped). Paid or confirmed data is never selected. Runs periodically inside
+the API or once from the command line:
+
+    python retention.py --older-than-days 30 --dry-run
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from pymongo.errors import BulkWriteError
+
+from background import BackgroundTask, run_every
+
+logger = logging.getLogger(__name__)
+
+UNPAID_PAYMENT_STATUSES = ["pending", "unpaid"]
+
+# Stripe checkout sessions can be paid for up to 24 hours after creation
+MIN_AGE_DAYS = 2
+
+
+class RetentionManager:
+    def __init__(self, database, older_than_days: float = 30, batch_size: int = 500, archive: bool = True):
+        if older_than_days < MIN_AGE_DAYS:
+            raise ValueError(f"older_than_days must be at least {MIN_AGE_DAYS}")
+        self.database = database
+        self.older_than_days = older_than_days
+        self.batch_size = batch_size
+        self.archive = archive
+        self._task = BackgroundTask()
+
+    @property
+    def payments(self):
+        return self.database.payment_transactions.collection
+
+    @property
+    def registrations(self):
+        return self.database.registrations.collection
+
+    async def run(self, dry_run: bool = False) -> Dict:
+        started = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(days=self.older_than_days)
+        payment_filter = {"payment_status": {"$in": UNPAID_PAYMENT_STATUSES}, "created_at": {"$lt": cutoff}}
+        registration_filter = {"status": "pending_payment", "created_at": {"$lt": cutoff}}
+        report = {
+            "cutoff": cutoff.isoformat(),
+            "dry_run": dry_run,
+            "payments": {"matched": 0, "archived": 0},
+            "registrations": {"matched": 0, "archived": 0, "kept_with_payments": 0},
+        }
+
+        cursor = self.payments.find(payment_filter).batch_size(self.batch_size)
+        async for batch in self._batches(cursor):
+            report["payments"]["matched"] += len(batch)
+            if not dry_run:
+                report["payments"]["archived"] += await self._move(
+                    batch, self.payments, "payment_transactions_archive", "session_id", payment_filter
+                )
+            await self._archive_registrations(batch, payment_filter, registration_filter, dry_run, report)
+
+        report["elapsed_seconds"] = round(time.monotonic() - started, 3)
+        logger.info("Retention run finished: %s", report)
+        return report
+
+    async def _archive_registrations(self, payments: List[Dict], payment_filter: Dict, registration_filter: Dict,
+                                     dry_run: bool, report: Dict):
+        ids = list({doc["registration_id"] for doc in payments if doc.get("registration_id")})
+        if not ids:
+            return
+        # Keep registrations that still have a payment which is paid, recent or otherwise not archivable
+        hot_filter = {"registration_id": {"$in": ids}}
+        if dry_run:
+            hot_filter["$nor"] = [payment_filter]
+        with_payments = set(await self.payments.distinct("registration_id", hot_filter))
+        report["registrations"]["kept_with_payments"] += len(with_payments)
+
+        candidates = [registration_id for registration_id in ids if registration_id not in with_payments]
+        docs = await self.registrations.find({"id": {"$in": candidates}, **registration_filter}).to_list(length=None)
+        report["registrations"]["matched"] += len(docs)
+        if docs and not dry_run:
+            report["registrations"]["archived"] += await self._move(
+                docs, self.registrations, "registrations_archive", "id", registration_filter
+            )
+
+    async def _batches(self, cursor):
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def _move(self, docs: List[Dict], collection, archive_name: str, key: str, guard: Dict) -> int:
+        keys = [doc[key] for doc in docs]
+        archive = self.database.db[archive_name]
+        if self.archive:
+            now = datetime.utcnow()
+            try:
+                await archive.insert_many([{**doc, "archived_at": now} for doc in docs], ordered=False)
+            except BulkWriteError as e:
+                # Copies left by an interrupted run are already in place
+                if any(err["code"] != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+
+        result = await collection.delete_many({key: {"$in": keys}, **guard})
+        if self.archive and result.deleted_count < len(keys):
+            # Records that changed state mid-batch stay hot; drop their stale archive copies
+            kept = await collection.distinct(key, {key: {"$in": keys}})
+            if kept:
+                await archive.delete_many({key: {"$in": kept}})
+        return result.deleted_count
+
+    def start(self, interval_seconds: float):
+        self._task.start(run_every(interval_seconds, self.run, logger, "Retention run"))
+
+    async def stop(self):
+        await self._task.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Archive abandoned unpaid registrations and payments")
+    parser.add_argument("--older-than-days", type=float, default=30)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be archived")
+    parser.add_argument("--no-archive", action="store_true", help="delete instead of copying to *_archive")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    from database import Database
+    from indexes import ensure_indexes
+
+    database = Database(
+        os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+        os.environ.get('MONGO_DB_NAME', 'unibaby_pool'),
+    )
+    await database.connect()
+    try:
+        await ensure_indexes(database.db)
+        retention = RetentionManager(
+            database,
+            older_than_days=args.older_than_days,
+            batch_size=args.batch_size,
+            archive=not args.no_archive,
+        )
+        print(json.dumps(await retention.run(dry_run=args.dry_run), indent=2))
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
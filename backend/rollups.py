@@ -0,0 +1,229 @@
+"""Daily revenue and paid-enrollment rollups per package.
+
+A payment's transition to `paid` sets `paid_at` and a `rollup_pending` marker
+in the same guarded write (see payment_state). `record_paid` claims each
+marker with a token and a lease, adds each claimed payment to its (day,
+package_id, currency) document and only then clears the markers it still
+holds. Concurrent pollers, webhooks and workers never claim the same payment
+twice, and a crash or failed write never loses one: the periodic sweep takes
+over claims whose lease has run out. Each rollup document lists the sessions
+it has counted (`session_ids`) and every increment is filtered on the session
+not being listed yet, so a payment whose increment landed before a crash is
+not counted again when its claim is taken over. With transactions enabled the
+increments and the clearing also commit together. Dashboards read
+`daily_rollups`, which holds one document per day and package. Existing data
+is loaded once with an aggregation pipeline:
+
+    python rollups.py --backfill
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from background import BackgroundTask, run_every
+
+logger = logging.getLogger(__name__)
+
+DAY_FORMAT = "%Y-%m-%d"
+
+# Payments paid before paid_at existed fall back to their last known timestamps
+PAID_AT_EXPRESSION = {"$ifNull": ["$paid_at", "$webhook_processed_at", "$updated_at", "$created_at"]}
+
+CLEAR_MARKER = {"$unset": {"rollup_pending": "", "rollup_claim": "", "rollup_claimed_at": ""}}
+
+
+class RevenueRollups:
+    def __init__(self, database, claim_seconds: float = 60, use_transactions: bool = False):
+        self.database = database
+        self.claim_seconds = claim_seconds
+        self.use_transactions = use_transactions
+        self._task = BackgroundTask()
+
+    @property
+    def collection(self):
+        return self.database.db["daily_rollups"]
+
+    @property
+    def reporting_collection(self):
+        return self.database.reporting_db["daily_rollups"]
+
+    @property
+    def payments(self):
+        return self.database.payment_transactions.collection
+
+    def _claimable(self, now: datetime) -> Dict:
+        """Pending markers nobody holds, or whose holder's lease has run out."""
+        return {"rollup_pending": True, "$or": [
+            {"rollup_claimed_at": {"$exists": False}},
+            {"rollup_claimed_at": {"$lt": now - timedelta(seconds=self.claim_seconds)}},
+        ]}
+
+    async def record_paid(self, session_ids: Optional[List[str]] = None) -> int:
+        """Count newly paid payments once; with no session_ids, sweep every claimable marker."""
+        now = datetime.utcnow()
+        if session_ids is None:
+            cursor = self.payments.find(self._claimable(now), {"session_id": 1})
+            session_ids = [doc["session_id"] async for doc in cursor]
+        if not session_ids:
+            return 0
+
+        token = uuid.uuid4().hex
+        claimed = await asyncio.gather(*(
+            self.payments.find_one_and_update(
+                {"session_id": session_id, **self._claimable(now)},
+                {"$set": {"rollup_claim": token, "rollup_claimed_at": now}},
+                projection={"_id": 0, "session_id": 1, "package_id": 1, "amount": 1, "currency": 1,
+                            "paid_at": 1, "updated_at": 1},
+            )
+            for session_id in session_ids
+        ))
+        claimed = [doc for doc in claimed if doc is not None]
+        if not claimed:
+            return 0
+
+        rollup_ops = []
+        for doc in claimed:
+            paid_at = doc.get("paid_at") or doc.get("updated_at") or now
+            rollup_ops.append(UpdateOne(
+                {
+                    "day": paid_at.strftime(DAY_FORMAT),
+                    "package_id": doc["package_id"],
+                    "currency": doc["currency"],
+                    "session_ids": {"$ne": doc["session_id"]},
+                },
+                {
+                    "$inc": {"paid_count": 1, "revenue": doc["amount"]},
+                    "$addToSet": {"session_ids": doc["session_id"]},
+                    "$set": {"updated_at": now},
+                },
+                upsert=True,
+            ))
+        held = {"session_id": {"$in": [doc["session_id"] for doc in claimed]}, "rollup_claim": token}
+
+        if self.use_transactions:
+            async with await self.database.client.start_session() as session:
+                async with session.start_transaction():
+                    await self.collection.bulk_write(rollup_ops, ordered=False, session=session)
+                    await self.payments.update_many(held, CLEAR_MARKER, session=session)
+        else:
+            await self._increment(rollup_ops)
+            await self.payments.update_many(held, CLEAR_MARKER)
+        return len(claimed)
+
+    async def _increment(self, rollup_ops: List[UpdateOne]):
+        # An upsert fails on the unique day/package/currency index when the session is already
+        # counted (its filter misses), or when a concurrent upsert created the document first;
+        # a retry applies the latter and fails again only for the former
+        for _ in range(2):
+            try:
+                await self.collection.bulk_write(rollup_ops, ordered=False)
+                return
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(err["code"] != 11000 for err in errors):
+                    raise
+                rollup_ops = [rollup_ops[err["index"]] for err in errors]
+
+    def start(self, interval_seconds: float):
+        self._task.start(run_every(interval_seconds, self.record_paid, logger, "Rollup sweep"))
+
+    async def stop(self):
+        await self._task.stop()
+
+    async def query(self, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                    package_id: Optional[str] = None) -> List[Dict]:
+        query = {}
+        if date_from is not None or date_to is not None:
+            query["day"] = {}
+            if date_from is not None:
+                query["day"]["$gte"] = date_from
+            if date_to is not None:
+                query["day"]["$lte"] = date_to
+        if package_id is not None:
+            query["package_id"] = package_id
+        cursor = self.reporting_collection.find(query, {"_id": 0, "updated_at": 0, "session_ids": 0}).sort([("day", 1), ("package_id", 1)])
+        return await cursor.to_list(length=None)
+
+    async def backfill(self) -> Dict:
+        """Rebuild rollups for every payment paid before now and clear their pending markers.
+
+        Run it once after deploying, ideally while checkout traffic is low:
+        days are replaced wholesale, so increments recorded for payments paid
+        while the pipeline runs may be overwritten.
+        """
+        cutoff = datetime.utcnow()
+        paid_before_cutoff = {"payment_status": "paid", "$expr": {"$lt": [PAID_AT_EXPRESSION, cutoff]}}
+        await self.payments.aggregate([
+            {"$match": paid_before_cutoff},
+            {"$group": {
+                "_id": {
+                    "day": {"$dateToString": {"format": DAY_FORMAT, "date": PAID_AT_EXPRESSION}},
+                    "package_id": "$package_id",
+                    "currency": "$currency",
+                },
+                "paid_count": {"$sum": 1},
+                "revenue": {"$sum": "$amount"},
+                "session_ids": {"$addToSet": "$session_id"},
+            }},
+            {"$project": {
+                "_id": 0,
+                "day": "$_id.day",
+                "package_id": "$_id.package_id",
+                "currency": "$_id.currency",
+                "paid_count": 1,
+                "revenue": 1,
+                "session_ids": 1,
+                "updated_at": "$$NOW",
+            }},
+            {"$merge": {
+                "into": "daily_rollups",
+                "on": ["day", "package_id", "currency"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert",
+            }},
+        ], allowDiskUse=True).to_list(length=None)
+
+        cleared = await self.payments.update_many(
+            {**paid_before_cutoff, "rollup_pending": True}, CLEAR_MARKER
+        )
+        days = await self.collection.count_documents({})
+        return {"cutoff": cutoff.isoformat(), "rollup_documents": days, "pending_cleared": cleared.modified_count}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Maintain daily revenue and enrollment rollups")
+    parser.add_argument("--backfill", action="store_true",
+                        help="rebuild rollups from all paid payment_transactions")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    from database import Database
+    from indexes import ensure_indexes
+
+    database = Database(
+        os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+        os.environ.get('MONGO_DB_NAME', 'unibaby_pool'),
+    )
+    await database.connect()
+    try:
+        await ensure_indexes(database.db)
+        rollups = RevenueRollups(database)
+        if args.backfill:
+            report = await rollups.backfill()
+        else:
+            report = {"recorded": await rollups.record_paid()}
+        print(json.dumps(report, indent=2))
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,154 @@
+"""Registration search for front-desk staff.
+
+Phone numbers are normalized at write time into `phone_key` (the last ten
+digits, i.e. the number without the +7/8 trunk prefix), so "8 (777) 123-45-67"
+and "+7 777 1234567" find the same family. Names are matched as
+case-insensitive prefixes through a range query on indexes built with
+SEARCH_COLLATION. Results are ordered by (created_at, id) descending and
+paged with an opaque keyset cursor instead of skip.
+
+A full phone number walks phone_key_created_at in result order, so a page
+reads only its own rows. Partial phones and name prefixes scan the index
+range of the prefix and sort the matches in memory (a top-k sort bounded by
+the page size). Every match for the prefix is read on every page, which is
+why prefixes have a minimum length.
+
+Registrations created before phone_key existed are backfilled once with:
+
+    python search.py --backfill-phone-keys
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.collation import Collation, CollationStrength
+
+logger = logging.getLogger(__name__)
+
+SEARCH_COLLATION = Collation(locale="ru", strength=CollationStrength.SECONDARY)
+
+SEARCH_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "child_name": 1, "child_age": 1,
+    "phone": 1, "package_id": 1, "status": 1, "created_at": 1,
+}
+
+PHONE_KEY_DIGITS = 10
+MIN_PHONE_PREFIX_DIGITS = 6
+MIN_NAME_PREFIX_LENGTH = 2
+
+# ICU gives U+FFFF the highest primary weight, so it closes a prefix range
+PREFIX_UPPER_BOUND = "\uffff"
+
+
+def normalize_phone(phone: str) -> str:
+    return re.sub(r"\D", "", phone or "")[-PHONE_KEY_DIGITS:]
+
+
+def encode_cursor(doc: Dict) -> str:
+    raw = f"{doc['created_at'].isoformat()}|{doc['id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, registration_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), registration_id
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+class RegistrationSearch:
+    def __init__(self, database, max_limit: int = 100):
+        self.database = database
+        self.max_limit = max_limit
+
+    @property
+    def collection(self):
+        return self.database.registrations.collection
+
+    def build_query(self, phone: Optional[str] = None, name: Optional[str] = None) -> Tuple[Dict, Optional[Collation]]:
+        """Return the filter and the collation it must run with to use its index."""
+        if phone:
+            phone_key = normalize_phone(phone)
+            if len(phone_key) == PHONE_KEY_DIGITS:
+                return {"phone_key": phone_key}, None
+            if len(phone_key) < MIN_PHONE_PREFIX_DIGITS:
+                raise ValueError(f"phone must contain at least {MIN_PHONE_PREFIX_DIGITS} digits")
+            # A partial number is matched as a prefix of the national number
+            return {"phone_key": {"$regex": f"^{phone_key}"}}, None
+        if name and name.strip():
+            name = name.strip()
+            if len(name) < MIN_NAME_PREFIX_LENGTH:
+                raise ValueError(f"name must contain at least {MIN_NAME_PREFIX_LENGTH} characters")
+            prefix = {"$gte": name, "$lt": name + PREFIX_UPPER_BOUND}
+            return {"$or": [{"name": prefix}, {"child_name": prefix}]}, SEARCH_COLLATION
+        raise ValueError("Provide phone or name to search")
+
+    async def search(self, phone: Optional[str] = None, name: Optional[str] = None,
+                     limit: int = 20, cursor: Optional[str] = None) -> Dict:
+        query, collation = self.build_query(phone, name)
+        if cursor:
+            created_at, registration_id = decode_cursor(cursor)
+            query = {"$and": [query, {"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": registration_id}},
+            ]}]}
+
+        limit = max(1, min(limit, self.max_limit))
+        # Fetch one extra row to know whether another page exists
+        results: List[Dict] = await self.collection.find(
+            query, SEARCH_PROJECTION, collation=collation
+        ).sort([("created_at", -1), ("id", -1)]).limit(limit + 1).to_list(length=limit + 1)
+
+        next_cursor = encode_cursor(results[limit - 1]) if len(results) > limit else None
+        return {"results": results[:limit], "next_cursor": next_cursor}
+
+    async def backfill_phone_keys(self, batch_size: int = 1000) -> int:
+        updated = 0
+        cursor = self.collection.find({"phone_key": {"$exists": False}}, {"_id": 1, "phone": 1}).batch_size(batch_size)
+        batch = []
+        async for doc in cursor:
+            batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"phone_key": normalize_phone(doc.get("phone"))}}))
+            if len(batch) >= batch_size:
+                updated += (await self.collection.bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await self.collection.bulk_write(batch, ordered=False)).modified_count
+        return updated
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Maintain registration search keys")
+    parser.add_argument("--backfill-phone-keys", action="store_true",
+                        help="store phone_key on registrations created before it existed")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.backfill_phone_keys:
+        parser.error("nothing to do; pass --backfill-phone-keys")
+
+    from database import Database
+    from indexes import ensure_indexes
+
+    database = Database(
+        os.environ.get('MONGO_URL', 'mongodb://localhost:27017'),
+        os.environ.get('MONGO_DB_NAME', 'unibaby_pool'),
+    )
+    await database.connect()
+    try:
+        await ensure_indexes(database.db)
+        updated = await RegistrationSearch(database).backfill_phone_keys()
+        print(json.dumps({"phone_keys_backfilled": updated}, indent=2))
+    finally:
+        database.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,195 @@
+"""Production entry point: several uvicorn workers behind one socket.
+
+    python serve.py --workers 4 --port 8001
+
+The parent binds the socket and spawns the workers (fresh interpreters, not
+forks); each worker opens its own Mongo pool, Stripe HTTP session and
+background tasks in the FastAPI lifespan. The parent restarts any worker
+that exits, which uvicorn's own process manager does not do, backing off
+exponentially while workers keep failing at startup (Mongo unreachable, a
+failed query-plan check) and exiting non-zero after --max-rapid-failures
+such failures in a row so the orchestrator sees the crash.
+
+On SIGTERM/SIGINT the parent first sends every worker SIGUSR1, which makes
+/api/ready fail while the worker keeps serving, and waits --drain-seconds
+for the load balancer to take the pod out of rotation. Then it terminates
+the workers: they stop accepting connections, finish in-flight requests for
+up to --graceful-timeout seconds and close their clients. Keep the two
+together below the orchestrator's kill timeout. Point liveness probes at
+/api/health and readiness probes at /api/ready.
+
+Per-client rate limits are off unless RATE_LIMIT_TRUSTED_PROXIES lists the
+ingress addresses (or CIDR ranges, or "*" if the pod is reachable only
+through it); the API then keys on the X-Forwarded-For hop in front of them.
+Without a proxy, any value enables keying on the peer address.
+--forwarded-allow-ips only controls which peers uvicorn takes the scheme and
+client address from for logging.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+import uvicorn
+
+logger = logging.getLogger("uvicorn.error")
+
+multiprocessing.allow_connection_pickling()
+spawn = multiprocessing.get_context("spawn")
+
+
+def run_worker(config: uvicorn.Config, target, sockets):
+    """Entry point of a spawned worker; uvicorn's own helper for this is private API."""
+    config.configure_logging()
+    target(sockets=sockets)
+
+
+class WorkerSupervisor:
+    """Starts the workers, restarts the ones that exit and drains readiness on shutdown.
+
+    A worker that exits within `min_uptime` seconds of starting counts as a
+    rapid failure; restarts back off exponentially up to `max_backoff`, and
+    after `max_rapid_failures` in a row the supervisor gives up and exits
+    non-zero instead of spinning on a startup error.
+    """
+
+    def __init__(self, config, target, sockets, drain_seconds: float, check_interval: float = 0.5,
+                 min_uptime: float = 10.0, backoff: float = 1.0, max_backoff: float = 30.0,
+                 max_rapid_failures: int = 5):
+        self.config = config
+        self.target = target
+        self.sockets = sockets
+        self.drain_seconds = drain_seconds
+        self.check_interval = check_interval
+        self.min_uptime = min_uptime
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_rapid_failures = max_rapid_failures
+        self.should_exit = threading.Event()
+        self.exit_code = 0
+        self.processes = []
+        self.started_at = []
+        self.failures = []
+        self.restart_at = []
+
+    def spawn(self):
+        process = spawn.Process(
+            target=run_worker, kwargs={"config": self.config, "target": self.target, "sockets": self.sockets}
+        )
+        process.start()
+        return process
+
+    def run(self) -> int:
+        self.startup()
+        while not self.should_exit.wait(self.check_interval):
+            self.restart_exited()
+        self.drain()
+        self.shutdown()
+        return self.exit_code
+
+    def startup(self):
+        logger.info("Started parent process [%d]", os.getpid())
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda signum, frame: self.should_exit.set())
+        now = time.monotonic()
+        for _ in range(self.config.workers):
+            self.processes.append(self.spawn())
+            self.started_at.append(now)
+            self.failures.append(0)
+            self.restart_at.append(None)
+
+    def restart_exited(self):
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process is None:
+                if now >= self.restart_at[index]:
+                    self.processes[index] = self.spawn()
+                    self.started_at[index] = now
+                continue
+            if process.is_alive():
+                continue
+            process.join()
+            if now - self.started_at[index] < self.min_uptime:
+                self.failures[index] += 1
+            else:
+                self.failures[index] = 0
+            if self.failures[index] >= self.max_rapid_failures:
+                logger.error("Worker exited %d times in a row within %.0fs of starting (last exit code %s); giving up",
+                             self.failures[index], self.min_uptime, process.exitcode)
+                self.exit_code = 1
+                self.should_exit.set()
+                return
+            delay = min(self.max_backoff, self.backoff * 2 ** self.failures[index])
+            logger.warning("Worker %s exited with code %s, starting a new one in %.0fs",
+                           process.pid, process.exitcode, delay)
+            self.processes[index] = None
+            self.restart_at[index] = now + delay
+
+    def drain(self):
+        alive = [process for process in self.processes if process is not None and process.is_alive()]
+        if not alive or self.drain_seconds <= 0:
+            return
+        logger.info("Draining %d workers for %.0fs", len(alive), self.drain_seconds)
+        for process in alive:
+            os.kill(process.pid, signal.SIGUSR1)
+        time.sleep(self.drain_seconds)
+
+    def shutdown(self):
+        for process in self.processes:
+            if process is not None:
+                process.terminate()
+                process.join()
+        logger.info("Stopping parent process [%d]", os.getpid())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the UniBaby API with multiple workers")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8001")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--drain-seconds", type=float, default=float(os.environ.get("DRAIN_SECONDS", "5")),
+                        help="seconds to fail readiness before stopping the workers")
+    parser.add_argument("--graceful-timeout", type=float,
+                        default=float(os.environ.get("GRACEFUL_TIMEOUT_SECONDS", "20")),
+                        help="seconds to let in-flight requests finish on shutdown")
+    parser.add_argument("--keep-alive", type=int, default=int(os.environ.get("KEEP_ALIVE_SECONDS", "5")))
+    parser.add_argument("--forwarded-allow-ips", default=os.environ.get("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+                        help="comma-separated proxy addresses trusted to set X-Forwarded-For")
+    parser.add_argument("--max-rapid-failures", type=int,
+                        default=int(os.environ.get("WORKER_MAX_RAPID_FAILURES", "5")),
+                        help="exit non-zero after a worker fails this many times in a row right after starting")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "info"))
+    args = parser.parse_args()
+
+    # Spawned workers inherit sys.path, so they can import server:app
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    config = uvicorn.Config(
+        "server:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        lifespan="on",
+        timeout_graceful_shutdown=args.graceful_timeout,
+        timeout_keep_alive=args.keep_alive,
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        log_level=args.log_level,
+    )
+    server = uvicorn.Server(config)
+    supervisor = WorkerSupervisor(
+        config,
+        target=server.run,
+        sockets=[config.bind_socket()],
+        drain_seconds=args.drain_seconds,
+        max_rapid_failures=args.max_rapid_failures,
+    )
+    sys.exit(supervisor.run())
+
+
+if __name__ == "__main__":
+    main()
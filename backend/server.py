@@ -1,23 +1,289 @@
+import asyncio
+import hmac
+import json
+import logging
 import os
+import signal
+import threading
 import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
 from typing import Optional, Dict, List
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from pymongo import MongoClient
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+
+from database import Database
+from metrics import AppMetrics, CallbackCounter, CallbackGauge, Counter, MetricsMiddleware, MongoCommandListener
+from admission import ClientAddressResolver, ConcurrencyLimiter, TokenBucketLimiter, retry_after_header
+from bulk_import import RegistrationImporter, RequestStreamingResponse
+from catalog import PackageCatalog
+from export import RegistrationExporter, export_filter
+from profiling import LoopMonitor, ProfilingMiddleware, RequestProfiler
+from indexes import ensure_indexes, verify_query_plans
+from precomputed import FastJSONResponse, PrecomputedJSON
+from payments import PaymentGateway, PaymentGatewayTimeout
+from notifier import PaymentStatusNotifier, is_terminal, status_payload_from_doc
+from status_cache import StatusCache
+from webhook_queue import WebhookQueue
+from payment_state import build_payment_state
+from reconcile import PaymentReconciler
+from retention import RetentionManager
+from search import RegistrationSearch, normalize_phone
+from rollups import RevenueRollups
+from slots import SlotManager, SlotNotFound, SlotUnavailable
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore, request_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Metrics
+metrics = AppMetrics()
+
+# Admin access for operational routes
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Prometheus sends this as a bearer token; the admin token is accepted too
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Profiling and event loop health
+request_profiler = RequestProfiler(
+    os.environ.get('PROFILING_DIR', '/tmp/unibaby-profiles'),
+    secret=ADMIN_TOKEN,
+    enabled=os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true',
+    sample_rate=float(os.environ.get('PROFILING_SAMPLE_RATE', '0.01')),
+    interval=float(os.environ.get('PROFILING_INTERVAL_MS', '5')) / 1000,
+)
+loop_monitor = LoopMonitor(
+    interval=float(os.environ.get('LOOP_MONITOR_INTERVAL_MS', '100')) / 1000,
+    blocking_threshold=float(os.environ.get('LOOP_BLOCKING_THRESHOLD_MS', '100')) / 1000,
+    metrics=metrics,
+)
 
 # Database setup
 mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = MongoClient(mongo_url)
-db = client['unibaby_pool']
+database = Database(
+    mongo_url,
+    os.environ.get('MONGO_DB_NAME', 'unibaby_pool'),
+    max_pool_size=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    min_pool_size=int(os.environ.get('MONGO_MIN_POOL_SIZE', '0')),
+    event_listeners=[MongoCommandListener(metrics)],
+    secondary_reads=os.environ.get('MONGO_SECONDARY_READS', 'false').lower() == 'true',
+    max_staleness_seconds=int(os.environ.get('MONGO_MAX_STALENESS_SECONDS', '90')),
+)
+VERIFY_QUERY_PLANS = os.environ.get('MONGO_VERIFY_QUERY_PLANS', 'true').lower() == 'true'
+USE_TRANSACTIONS = os.environ.get('MONGO_USE_TRANSACTIONS', 'false').lower() == 'true'
+revenue_rollups = RevenueRollups(
+    database,
+    claim_seconds=float(os.environ.get('ROLLUP_CLAIM_SECONDS', '60')),
+)
+ROLLUP_SWEEP_INTERVAL = float(os.environ.get('ROLLUP_SWEEP_INTERVAL_SECONDS', '300'))
+
+# Class slots and seat holds
+async def expire_abandoned_sessions(session_ids: List[str]):
+    # The seat is gone, so the parent must not be able to pay for it any more
+    for session_id in session_ids:
+        try:
+            await payment_gateway.expire_checkout_session(session_id)
+        except Exception as e:
+            logger.warning("Expiring abandoned checkout session %s failed: %s", session_id, e)
+
+slot_manager = SlotManager(
+    database,
+    hold_minutes=float(os.environ.get('SLOT_HOLD_MINUTES', '30')),
+    cache_ttl=float(os.environ.get('SLOT_AVAILABILITY_TTL_SECONDS', '2')),
+    on_expired=expire_abandoned_sessions,
+)
+SLOT_REAPER_INTERVAL = float(os.environ.get('SLOT_REAPER_INTERVAL_SECONDS', '30'))
+
+payment_state = build_payment_state(database, revenue_rollups, slot_manager)
+
+# Stripe setup
+STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY')
+payment_gateway = PaymentGateway(
+    STRIPE_API_KEY,
+    api_base=os.environ.get('STRIPE_API_BASE'),
+    timeout=float(os.environ.get('STRIPE_TIMEOUT_SECONDS', '10')),
+    max_concurrency=int(os.environ.get('STRIPE_MAX_CONCURRENCY', '20')),
+    max_connections=int(os.environ.get('STRIPE_MAX_CONNECTIONS', '50')),
+    metrics=metrics,
+)
+
+# Admission control for routes that call Stripe
+# Per-client limits only apply once the proxies in front of the API are listed
+client_address_resolver = ClientAddressResolver(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', ''))
+client_rate_limiter = TokenBucketLimiter(
+    rate=float(os.environ.get('RATE_LIMIT_CLIENT_PER_SECOND', '5')),
+    burst=float(os.environ.get('RATE_LIMIT_CLIENT_BURST', '30')),
+    max_keys=int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000')),
+)
+session_rate_limiter = TokenBucketLimiter(
+    rate=float(os.environ.get('RATE_LIMIT_SESSION_PER_SECOND', '1')),
+    burst=float(os.environ.get('RATE_LIMIT_SESSION_BURST', '5')),
+    max_keys=int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000')),
+)
+stripe_route_limiter = ConcurrencyLimiter(
+    limit=int(os.environ.get('STRIPE_ROUTE_MAX_CONCURRENCY', '40')),
+    max_queue=int(os.environ.get('STRIPE_ROUTE_MAX_QUEUE', '80')),
+    max_wait=float(os.environ.get('STRIPE_ROUTE_MAX_WAIT_SECONDS', '2')),
+)
+admission_rejected = metrics.register(Counter(
+    "unibaby_admission_rejected_total", "Requests rejected by rate limiting or load shedding", ("reason",)
+))
+metrics.register(CallbackGauge(
+    "unibaby_stripe_route_concurrency", "Stripe-bound requests being served or queued", "state",
+    stripe_route_limiter.stats
+))
+
+# Payment status push notifications
+payment_status_notifier = PaymentStatusNotifier()
+USE_CHANGE_STREAMS = os.environ.get('MONGO_USE_CHANGE_STREAMS', 'false').lower() == 'true'
+STATUS_STREAM_TIMEOUT = float(os.environ.get('STATUS_STREAM_TIMEOUT_SECONDS', '120'))
+STATUS_STREAM_KEEPALIVE = float(os.environ.get('STATUS_STREAM_KEEPALIVE_SECONDS', '15'))
+
+# Package catalog, cached in every worker
+package_catalog = PackageCatalog(
+    database,
+    poll_interval=float(os.environ.get('CATALOG_POLL_SECONDS', '30')),
+)
+
+packages_payload = PrecomputedJSON(
+    cache_control=os.environ.get('PACKAGES_CACHE_CONTROL', 'public, max-age=60, stale-while-revalidate=300'),
+)
+
+# Non-terminal checkout status cache
+status_cache = StatusCache(
+    ttl=float(os.environ.get('STATUS_CACHE_TTL_SECONDS', '3')),
+    max_entries=int(os.environ.get('STATUS_CACHE_MAX_ENTRIES', '10000')),
+)
+metrics.register(CallbackGauge(
+    "unibaby_status_cache_size", "Checkout statuses cached or being loaded", "state", status_cache.sizes
+))
+metrics.register(CallbackCounter(
+    "unibaby_status_cache_events_total", "Checkout status cache hits, misses, evictions and invalidations", "event",
+    status_cache.counters
+))
+
+async def on_webhook_events_processed(events: List[Dict]):
+    for event in events:
+        status_cache.invalidate(event["session_id"])
+    final_sessions = [
+        e["session_id"] for e in events
+        if e["payment_status"] == "paid" or e["event_type"] == "checkout.session.expired"
+    ]
+    if final_sessions:
+        for payment_doc in await database.payment_transactions.find_by_sessions(final_sessions):
+            payment_status_notifier.publish(payment_doc["session_id"], status_payload_from_doc(payment_doc))
 
-# Collections
-registrations_collection = db['registrations']
-payment_transactions_collection = db['payment_transactions']
+# Webhook ingestion queue
+webhook_queue = WebhookQueue(
+    database,
+    payment_state,
+    on_processed=on_webhook_events_processed,
+    batch_size=int(os.environ.get('WEBHOOK_BATCH_SIZE', '100')),
+    poll_interval=float(os.environ.get('WEBHOOK_POLL_INTERVAL_SECONDS', '1')),
+)
 
-app = FastAPI()
+# Front-desk registration search
+registration_search = RegistrationSearch(database)
+
+# Bulk registration imports
+def build_imported_registration_doc(row: Dict) -> Dict:
+    registration = RegistrationData(**row)
+    if package_catalog.get(registration.package_id) is None:
+        raise ValueError(f"package_id: Invalid package '{registration.package_id}'")
+    return build_registration_doc(registration)
+
+registration_importer = RegistrationImporter(
+    database,
+    build_imported_registration_doc,
+    batch_size=int(os.environ.get('IMPORT_BATCH_SIZE', '500')),
+)
+
+# Admin exports
+registration_exporter = RegistrationExporter(
+    database,
+    batch_size=int(os.environ.get('EXPORT_BATCH_SIZE', '500')),
+)
+
+# Idempotency-Key support for checkout creation
+idempotency_store = IdempotencyStore(
+    database,
+    max_cached=int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000')),
+    wait_timeout=float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '30')),
+    lease_seconds=float(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '60')),
+)
+
+async def on_payments_reconciled(session_ids: List[str]):
+    for session_id in session_ids:
+        status_cache.invalidate(session_id)
+
+# Background reconciliation of payments whose webhook never arrived
+RECONCILE_INTERVAL = float(os.environ.get('RECONCILE_INTERVAL_SECONDS', '0'))
+payment_reconciler = PaymentReconciler(
+    database,
+    payment_gateway,
+    payment_state,
+    on_updated=on_payments_reconciled,
+    older_than_minutes=float(os.environ.get('RECONCILE_OLDER_THAN_MINUTES', '30')),
+    batch_size=int(os.environ.get('RECONCILE_BATCH_SIZE', '200')),
+    concurrency=int(os.environ.get('RECONCILE_CONCURRENCY', '10')),
+)
+
+READINESS_TIMEOUT = float(os.environ.get('READINESS_TIMEOUT_SECONDS', '2'))
+
+# Archival of abandoned unpaid checkouts
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL_SECONDS', '0'))
+retention_manager = RetentionManager(
+    database,
+    older_than_days=float(os.environ.get('RETENTION_OLDER_THAN_DAYS', '30')),
+    batch_size=int(os.environ.get('RETENTION_BATCH_SIZE', '500')),
+    archive=os.environ.get('RETENTION_ARCHIVE', 'true').lower() == 'true',
+)
+
+# Every worker builds its own clients here, after the process manager has spawned it
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    loop_monitor.start()
+    await database.connect()
+    await ensure_indexes(database.db)
+    if VERIFY_QUERY_PLANS:
+        await verify_query_plans(database.db)
+    await package_catalog.seed(DEFAULT_PACKAGES)
+    await package_catalog.start(use_change_stream=USE_CHANGE_STREAMS)
+    if USE_TRANSACTIONS:
+        payment_state.use_transactions = await database.supports_transactions()
+        revenue_rollups.use_transactions = payment_state.use_transactions
+    # Count payments whose rollup increment was interrupted by a restart or a failed write
+    await revenue_rollups.record_paid()
+    revenue_rollups.start(ROLLUP_SWEEP_INTERVAL)
+    payment_gateway.start()
+    payment_status_notifier.start(database.payment_transactions.collection, use_change_stream=USE_CHANGE_STREAMS)
+    webhook_queue.start()
+    slot_manager.start(SLOT_REAPER_INTERVAL)
+    if RECONCILE_INTERVAL > 0:
+        payment_reconciler.start(RECONCILE_INTERVAL)
+    if RETENTION_INTERVAL > 0:
+        retention_manager.start(RETENTION_INTERVAL)
+    app.state.ready = True
+    # serve.py sends SIGUSR1 before stopping the workers so the load balancer drains them first
+    if hasattr(signal, "SIGUSR1") and threading.current_thread() is threading.main_thread():
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, setattr, app.state, "ready", False)
+    yield
+    # uvicorn runs this after the socket is closed and in-flight requests have finished
+    app.state.ready = False
+    await retention_manager.stop()
+    await payment_reconciler.stop()
+    await slot_manager.stop()
+    await revenue_rollups.stop()
+    await webhook_queue.stop()
+    await payment_status_notifier.stop()
+    await package_catalog.stop()
+    payment_gateway.close()
+    database.close()
+    await loop_monitor.stop()
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -27,12 +293,11 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+app.add_middleware(ProfilingMiddleware, profiler=request_profiler)
 
-# Stripe setup
-STRIPE_API_KEY = os.environ.get('STRIPE_API_KEY')
-
-# Swimming packages with fixed prices
-SWIMMING_PACKAGES = {
+# Built-in swimming packages, seeded into the catalog on first start
+DEFAULT_PACKAGES = {
     "baby_splash": {"name": "Baby Splash (0-2 года)", "price": 15000.0, "currency": "kzt", "sessions": 8},
     "junior_swim": {"name": "Junior Swim (3-5 лет)", "price": 18000.0, "currency": "kzt", "sessions": 8},
     "aqua_kids": {"name": "Aqua Kids (6-12 лет)", "price": 20000.0, "currency": "kzt", "sessions": 8},
@@ -53,70 +318,186 @@ class CheckoutRequest(BaseModel):
     package_id: str
     registration_data: RegistrationData
     origin_url: str
+    slot_id: Optional[str] = None
+
+class SlotCreate(BaseModel):
+    package_id: str
+    label: str
+    capacity: int = Field(gt=0)
+    starts_at: Optional[datetime] = None
+
+class SlotUpdate(BaseModel):
+    capacity: int = Field(ge=0)
+
+class PackageData(BaseModel):
+    name: str
+    price: float = Field(gt=0)
+    currency: str
+    sessions: int = Field(gt=0)
+    active: bool = True
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # Compared as bytes: compare_digest raises TypeError on non-ASCII str
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+async def require_metrics_access(authorization: Optional[str] = Header(None),
+                                 x_admin_token: Optional[str] = Header(None)):
+    scheme, _, token = (authorization or "").partition(" ")
+    if METRICS_TOKEN and scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+        return
+    await require_admin(x_admin_token)
+
+async def limit_client_rate(request: Request):
+    client_ip = client_address_resolver.resolve(request)
+    if client_ip is None:
+        return
+    retry_after = client_rate_limiter.acquire(client_ip)
+    if retry_after:
+        admission_rejected.inc("client_rate")
+        raise HTTPException(status_code=429, detail="Too many requests", headers=retry_after_header(retry_after))
+
+async def limit_session_rate(session_id: str):
+    retry_after = session_rate_limiter.acquire(session_id)
+    if retry_after:
+        admission_rejected.inc("session_rate")
+        raise HTTPException(status_code=429, detail="Too many requests for this session", headers=retry_after_header(retry_after))
+
+@asynccontextmanager
+async def stripe_route_admission():
+    # Shed load instead of letting requests queue behind a slow Stripe without bound
+    if not await stripe_route_limiter.acquire():
+        admission_rejected.inc("overloaded")
+        raise HTTPException(status_code=503, detail="Server is busy, please retry", headers=retry_after_header(1))
+    try:
+        yield
+    finally:
+        stripe_route_limiter.release()
+
+async def stripe_route_slot():
+    async with stripe_route_admission():
+        yield
 
 # API Routes
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "service": "unibaby_pool"}
 
+@app.get("/api/ready")
+async def readiness_check(request: Request):
+    checks = {}
+    try:
+        await asyncio.wait_for(database.ping(), timeout=READINESS_TIMEOUT)
+        checks["mongo"] = "ok"
+    except Exception as e:
+        checks["mongo"] = f"unavailable: {e.__class__.__name__}"
+    checks["catalog"] = "ok" if package_catalog.version else "not loaded"
+    checks["stripe"] = "ok" if STRIPE_API_KEY else "not configured"
+    
+    ready = getattr(request.app.state, "ready", False) and all(value == "ok" for value in checks.values())
+    return FastJSONResponse(
+        {"status": "ready" if ready else "not_ready", "checks": checks},
+        status_code=200 if ready else 503
+    )
+
+@app.get("/api/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_metrics_access)])
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/packages")
-async def get_packages():
-    return {"packages": SWIMMING_PACKAGES}
+async def get_packages(request: Request):
+    # Encoded and compressed once per catalog version, not per request
+    if packages_payload.version != package_catalog.version:
+        packages_payload.update({"packages": package_catalog.packages}, package_catalog.version)
+    return packages_payload.respond(request)
 
-@app.post("/api/register")
-async def register_user(registration: RegistrationData):
-    # Validate package
-    if registration.package_id not in SWIMMING_PACKAGES:
-        raise HTTPException(status_code=400, detail="Invalid package selected")
-    
-    # Create registration record
-    registration_id = str(uuid.uuid4())
-    registration_doc = {
-        "id": registration_id,
+def build_registration_doc(registration: RegistrationData) -> Dict:
+    return {
+        "id": str(uuid.uuid4()),
         "name": registration.name,
         "phone": registration.phone,
+        "phone_key": normalize_phone(registration.phone),
         "child_name": registration.child_name,
         "child_age": registration.child_age,
         "package_id": registration.package_id,
-        "package_info": SWIMMING_PACKAGES[registration.package_id],
+        "package_version": package_catalog.get(registration.package_id)["version"],
         "email": registration.email,
         "additional_info": registration.additional_info,
         "created_at": datetime.utcnow(),
         "status": "pending_payment"
     }
+
+@app.get("/api/slots")
+async def get_slots(package_id: Optional[str] = None):
+    return {"slots": await slot_manager.availability(package_id)}
+
+@app.post("/api/register")
+async def register_user(registration: RegistrationData):
+    # Validate package
+    if package_catalog.get(registration.package_id) is None:
+        raise HTTPException(status_code=400, detail="Invalid package selected")
     
-    registrations_collection.insert_one(registration_doc)
+    # Create registration record
+    registration_doc = build_registration_doc(registration)
+    await database.registrations.insert(registration_doc)
     
     return {
-        "registration_id": registration_id,
+        "registration_id": registration_doc["id"],
         "status": "registered",
         "message": "Registration successful"
     }
 
-@app.post("/api/checkout/session")
-async def create_checkout_session(request: CheckoutRequest):
+@app.post("/api/checkout/session", dependencies=[Depends(limit_client_rate), Depends(stripe_route_slot)])
+async def create_checkout_session(request: CheckoutRequest, idempotency_key: Optional[str] = Header(None)):
     if not STRIPE_API_KEY:
         raise HTTPException(status_code=500, detail="Stripe not configured")
     
+    if not idempotency_key:
+        return await start_checkout(request)
+    
+    # Retries with the same key replay the first response without touching Stripe
+    try:
+        return await idempotency_store.run(
+            idempotency_key,
+            request_fingerprint(request.model_dump_json()),
+            lambda: start_checkout(request)
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+async def start_checkout(request: CheckoutRequest) -> Dict:
     # Validate package
-    if request.package_id not in SWIMMING_PACKAGES:
+    package = package_catalog.get(request.package_id)
+    if package is None:
         raise HTTPException(status_code=400, detail="Invalid package")
     
-    package = SWIMMING_PACKAGES[request.package_id]
+    if package_catalog.get(request.registration_data.package_id) is None:
+        raise HTTPException(status_code=400, detail="Invalid package selected")
+    registration_doc = build_registration_doc(request.registration_data)
+    registration_id = registration_doc["id"]
+    
+    # Take a seat in the chosen class group before storing anything, so a full
+    # or unknown slot leaves no pending registration behind
+    slot_hold = None
+    if request.slot_id:
+        try:
+            slot_hold = await slot_manager.hold(request.slot_id, request.package_id, registration_id)
+        except SlotNotFound:
+            raise HTTPException(status_code=404, detail="Class slot not found")
+        except SlotUnavailable as e:
+            raise HTTPException(status_code=409, detail=str(e))
     
-    # Register user first
-    registration = await register_user(request.registration_data)
-    registration_id = registration["registration_id"]
+    await database.registrations.insert(registration_doc)
     
-    # Initialize Stripe
     webhook_url = f"{request.origin_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url=webhook_url)
     
     # Create checkout session
     success_url = f"{request.origin_url}/success?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{request.origin_url}/"
     
-    checkout_request = CheckoutSessionRequest(
+    checkout_request = payment_gateway.checkout_request(
         amount=package["price"],
         currency=package["currency"],
         success_url=success_url,
@@ -128,8 +509,19 @@ async def create_checkout_session(request: CheckoutRequest):
             "parent_name": request.registration_data.name
         }
     )
+    if slot_hold is not None:
+        checkout_request.metadata["slot_id"] = request.slot_id
     
-    session = await stripe_checkout.create_checkout_session(checkout_request)
+    try:
+        session = await payment_gateway.create_checkout_session(checkout_request, webhook_url)
+    except Exception as e:
+        if slot_hold is not None:
+            await slot_manager.release(slot_hold["id"])
+        if isinstance(e, PaymentGatewayTimeout):
+            raise HTTPException(status_code=504, detail=str(e))
+        raise
+    if slot_hold is not None:
+        await slot_manager.attach_session(slot_hold["id"], session.session_id)
     
     # Create payment transaction record
     payment_doc = {
@@ -137,15 +529,17 @@ async def create_checkout_session(request: CheckoutRequest):
         "session_id": session.session_id,
         "registration_id": registration_id,
         "package_id": request.package_id,
+        "package_version": package["version"],
         "amount": package["price"],
         "currency": package["currency"],
         "payment_status": "pending",
         "status": "initiated",
+        "slot_id": request.slot_id,
         "metadata": checkout_request.metadata,
         "created_at": datetime.utcnow()
     }
     
-    payment_transactions_collection.insert_one(payment_doc)
+    await database.payment_transactions.insert(payment_doc)
     
     return {
         "checkout_url": session.url,
@@ -153,49 +547,109 @@ async def create_checkout_session(request: CheckoutRequest):
         "registration_id": registration_id
     }
 
-@app.get("/api/checkout/status/{session_id}")
+@app.get("/api/checkout/status/{session_id}",
+         dependencies=[Depends(limit_client_rate), Depends(limit_session_rate), Depends(stripe_route_slot)])
 async def get_checkout_status(session_id: str):
     if not STRIPE_API_KEY:
         raise HTTPException(status_code=500, detail="Stripe not configured")
     
-    # Initialize Stripe
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
-    
-    # Get payment status from Stripe
-    checkout_status = await stripe_checkout.get_checkout_status(session_id)
-    
-    # Find payment transaction
-    payment_doc = payment_transactions_collection.find_one({"session_id": session_id})
+    # Find payment transaction; a stale non-terminal copy is refreshed from Stripe below
+    payment_doc = await database.payment_transactions.find_status(session_id)
     if not payment_doc:
         raise HTTPException(status_code=404, detail="Payment transaction not found")
     
-    # Update payment status if changed
-    if payment_doc["payment_status"] != checkout_status.payment_status:
-        update_data = {
-            "payment_status": checkout_status.payment_status,
-            "status": checkout_status.status,
-            "updated_at": datetime.utcnow()
-        }
-        
-        payment_transactions_collection.update_one(
-            {"session_id": session_id},
-            {"$set": update_data}
-        )
-        
-        # Update registration status if payment completed
-        if checkout_status.payment_status == "paid":
-            registrations_collection.update_one(
-                {"id": payment_doc["registration_id"]},
-                {"$set": {"status": "paid", "updated_at": datetime.utcnow()}}
-            )
+    # Terminal states are final, so there is nothing to ask Stripe
+    if is_terminal(payment_doc["payment_status"], payment_doc["status"]):
+        status_cache.record_terminal_hit()
+        return status_payload_from_doc(payment_doc)
     
-    return {
+    return await status_cache.get(session_id, lambda: refresh_checkout_status(payment_doc))
+
+async def refresh_checkout_status(payment_doc: Dict) -> Dict:
+    session_id = payment_doc["session_id"]
+    
+    # Get payment status from Stripe
+    try:
+        checkout_status = await payment_gateway.get_checkout_status(session_id)
+    except PaymentGatewayTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    
+    # Guarded transition; a poll racing the webhook cannot move the state backwards
+    await payment_state.apply_checkout_status(payment_doc, checkout_status.payment_status, checkout_status.status)
+    
+    status_payload = {
         "status": checkout_status.status,
         "payment_status": checkout_status.payment_status,
         "amount_total": checkout_status.amount_total,
         "currency": checkout_status.currency,
         "metadata": checkout_status.metadata
     }
+    if is_terminal(checkout_status.payment_status, checkout_status.status):
+        payment_status_notifier.publish(session_id, status_payload)
+    
+    return status_payload
+
+def format_sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/api/checkout/status/{session_id}/stream",
+         dependencies=[Depends(limit_client_rate), Depends(limit_session_rate)])
+async def stream_checkout_status(session_id: str):
+    if not STRIPE_API_KEY:
+        raise HTTPException(status_code=500, detail="Stripe not configured")
+    
+    payment_doc = await database.payment_transactions.find_status(session_id)
+    if not payment_doc:
+        raise HTTPException(status_code=404, detail="Payment transaction not found")
+    
+    # Subscribe before checking so a webhook landing in between is not missed
+    waiter = payment_status_notifier.subscribe(session_id)
+    try:
+        if is_terminal(payment_doc["payment_status"], payment_doc["status"]):
+            status_payload = status_payload_from_doc(payment_doc)
+        else:
+            # Single upstream check; afterwards we wait for the webhook, re-reading Mongo on every keep-alive.
+            # The stream itself stays open, so only the check takes a Stripe route slot.
+            async with stripe_route_admission():
+                status_payload = await status_cache.get(session_id, lambda: refresh_checkout_status(payment_doc))
+    except Exception:
+        payment_status_notifier.unsubscribe(session_id, waiter)
+        raise
+    
+    async def event_stream():
+        try:
+            yield format_sse("status", status_payload)
+            if is_terminal(status_payload["payment_status"], status_payload["status"]):
+                return
+            
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + STATUS_STREAM_TIMEOUT
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield format_sse("timeout", status_payload)
+                    return
+                try:
+                    final_payload = await asyncio.wait_for(
+                        asyncio.shield(waiter), timeout=min(STATUS_STREAM_KEEPALIVE, remaining)
+                    )
+                    yield format_sse("status", final_payload)
+                    return
+                except asyncio.TimeoutError:
+                    # The webhook may have been applied by another worker; the notifier only sees this one
+                    payment_doc = await database.payment_transactions.find_status(session_id)
+                    if payment_doc and is_terminal(payment_doc["payment_status"], payment_doc["status"]):
+                        yield format_sse("status", status_payload_from_doc(payment_doc))
+                        return
+                    yield ": keep-alive\n\n"
+        finally:
+            payment_status_notifier.unsubscribe(session_id, waiter)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/webhook/stripe")
 async def stripe_webhook(request: Request):
@@ -208,40 +662,128 @@ async def stripe_webhook(request: Request):
     if not stripe_signature:
         raise HTTPException(status_code=400, detail="Missing Stripe signature")
     
-    # Initialize Stripe
-    stripe_checkout = StripeCheckout(api_key=STRIPE_API_KEY, webhook_url="")
-    
     try:
-        webhook_response = await stripe_checkout.handle_webhook(webhook_body, stripe_signature)
+        webhook_response = await payment_gateway.handle_webhook(webhook_body, stripe_signature)
         
-        # Process the webhook event
-        if webhook_response.event_type == "checkout.session.completed":
-            # Update payment transaction
-            payment_transactions_collection.update_one(
-                {"session_id": webhook_response.session_id},
-                {
-                    "$set": {
-                        "payment_status": webhook_response.payment_status,
-                        "event_id": webhook_response.event_id,
-                        "webhook_processed_at": datetime.utcnow()
-                    }
-                }
-            )
-            
-            # Update registration if payment successful
-            if webhook_response.payment_status == "paid":
-                payment_doc = payment_transactions_collection.find_one({"session_id": webhook_response.session_id})
-                if payment_doc:
-                    registrations_collection.update_one(
-                        {"id": payment_doc["registration_id"]},
-                        {"$set": {"status": "confirmed", "updated_at": datetime.utcnow()}}
-                    )
+        # Durably enqueue; duplicates are dropped by the unique event_id index
+        await webhook_queue.enqueue(webhook_response, webhook_body)
         
         return {"status": "success"}
     
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Webhook error: {str(e)}")
 
+@app.put("/api/admin/packages/{package_id}", dependencies=[Depends(require_admin)])
+async def update_package(package_id: str, package: PackageData):
+    return await package_catalog.update(package_id, package.model_dump())
+
+@app.get("/api/admin/packages/{package_id}/versions/{version}", dependencies=[Depends(require_admin)])
+async def get_package_version(package_id: str, version: int):
+    snapshot = await package_catalog.get_version(package_id, version)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Package version not found")
+    return snapshot
+
+@app.post("/api/admin/slots", dependencies=[Depends(require_admin)])
+async def create_slot(slot: SlotCreate):
+    if package_catalog.get(slot.package_id) is None:
+        raise HTTPException(status_code=400, detail="Invalid package")
+    return await slot_manager.create_slot(slot.package_id, slot.label, slot.capacity, slot.starts_at)
+
+@app.patch("/api/admin/slots/{slot_id}", dependencies=[Depends(require_admin)])
+async def update_slot(slot_id: str, update: SlotUpdate):
+    try:
+        return await slot_manager.set_capacity(slot_id, update.capacity)
+    except SlotNotFound:
+        raise HTTPException(status_code=404, detail="Class slot not found")
+    except SlotUnavailable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/api/admin/registrations/import", dependencies=[Depends(require_admin)])
+async def import_registrations(request: Request, format: Optional[str] = None):
+    """Bulk-import registrations from an NDJSON or CSV body, streaming per-row results back."""
+    if format is None:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'ndjson'")
+    
+    async def results():
+        async for event in registration_importer.run(request.stream(), format):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    
+    return RequestStreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.get("/api/admin/registrations/search", dependencies=[Depends(require_admin)])
+async def search_registrations(phone: Optional[str] = None, name: Optional[str] = None,
+                               limit: int = 20, cursor: Optional[str] = None):
+    """Find registrations by phone number or parent/child name prefix, newest first."""
+    try:
+        return await registration_search.search(phone=phone, name=name, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/admin/export/registrations", dependencies=[Depends(require_admin)])
+async def export_registrations(
+    format: str = "ndjson",
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    package_id: Optional[str] = None,
+    status: Optional[str] = None,
+):
+    """Stream registrations with their latest payment as NDJSON or CSV."""
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'ndjson'")
+    
+    query = export_filter(created_from, created_to, package_id, status)
+    if format == "csv":
+        body, media_type = registration_exporter.csv(query), "text/csv; charset=utf-8"
+    else:
+        body, media_type = registration_exporter.ndjson(query), "application/x-ndjson"
+    filename = f"registrations-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
+    return StreamingResponse(body, media_type=media_type, headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
+
+@app.get("/api/admin/analytics/daily", dependencies=[Depends(require_admin)])
+async def get_daily_analytics(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                              package_id: Optional[str] = None):
+    """Paid enrollments and revenue per day and package, with totals per package and currency (YYYY-MM-DD, inclusive)."""
+    for value in (date_from, date_to):
+        if value is not None:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Dates must be formatted as YYYY-MM-DD")
+    
+    rollups = await revenue_rollups.query(date_from, date_to, package_id)
+    # Per package and currency: a package repriced in another currency must not mix the two
+    totals = {}
+    for rollup in rollups:
+        total = totals.setdefault(rollup["package_id"], {}).setdefault(rollup["currency"], {"paid_count": 0, "revenue": 0.0})
+        total["paid_count"] += rollup["paid_count"]
+        total["revenue"] += rollup["revenue"]
+    return {"daily": rollups, "totals": totals}
+
+@app.post("/api/admin/retention/run", dependencies=[Depends(require_admin)])
+async def run_retention(dry_run: bool = True):
+    """Archive abandoned unpaid checkouts; defaults to a dry-run report."""
+    return await retention_manager.run(dry_run=dry_run)
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    return {"profiles": request_profiler.list_profiles()}
+
+@app.get("/api/admin/profiles/{name}", dependencies=[Depends(require_admin)])
+async def download_profile(name: str):
+    path = request_profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="text/plain")
+
+@app.get("/api/admin/event-loop", dependencies=[Depends(require_admin)])
+async def get_event_loop_reports():
+    return {"blocking_reports": list(loop_monitor.reports)}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,256 @@
+"""Class slots with capacity and time-limited seat holds.
+
+Each package can have several schedulable groups (`class_slots`), each with a
+capacity and an `available` counter. A checkout takes a seat with one
+conditional `$inc` (`available > 0` in the filter), so concurrent signups
+for the same slot can never overbook it and never retry. The seat is held in
+`slot_holds` until the payment is confirmed. A hold expires after
+`hold_minutes`; a background reaper gives the seats of expired holds back and
+reports their Stripe sessions to `on_expired`, which expires them at Stripe
+so the parent cannot pay for a seat that is no longer held. A session that
+expires first (webhook, reconciler or status poll) releases its hold through
+`release_sessions`, and a payment that still lands after its hold was
+released takes a seat again if one is left (see `confirm`).
+
+The slot lists the holds that own one of its seats (`hold_ids`), so giving a
+seat back is a single conditional update that pulls the hold id and
+increments `available`, and cannot run twice. Releases are claimed first
+(`releasing`) and finished by the next reaper run if the process dies midway.
+
+Availability is served from an in-process view that is refreshed at most
+every `cache_ttl` seconds and patched with the counters returned by this
+worker's own reservations in between.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+
+from background import BackgroundTask, run_every
+
+logger = logging.getLogger(__name__)
+
+SLOT_FIELDS = {"_id": 0, "id": 1, "package_id": 1, "label": 1, "starts_at": 1, "capacity": 1, "available": 1}
+HOLD_FIELDS = {"_id": 0, "id": 1, "slot_id": 1, "session_id": 1, "seat_tracked": 1}
+
+
+class SlotNotFound(Exception):
+    pass
+
+
+class SlotUnavailable(Exception):
+    pass
+
+
+class SlotManager:
+    def __init__(self, database, hold_minutes: float = 30, cache_ttl: float = 2.0,
+                 on_expired: Optional[Callable[[List[str]], Awaitable[None]]] = None):
+        self.database = database
+        self.hold_minutes = hold_minutes
+        self.cache_ttl = cache_ttl
+        # Called with the Stripe session ids of holds the reaper released
+        self.on_expired = on_expired
+        self._view: Dict[str, Dict] = {}
+        self._loaded_at = None
+        self._refreshing = None
+        self._task = BackgroundTask()
+
+    @property
+    def slots(self):
+        return self.database.db["class_slots"]
+
+    @property
+    def holds(self):
+        return self.database.db["slot_holds"]
+
+    async def create_slot(self, package_id: str, label: str, capacity: int, starts_at: Optional[datetime] = None) -> Dict:
+        slot_doc = {
+            "id": str(uuid.uuid4()),
+            "package_id": package_id,
+            "label": label,
+            "starts_at": starts_at,
+            "capacity": capacity,
+            "available": capacity,
+            "created_at": datetime.utcnow(),
+        }
+        await self.slots.insert_one(slot_doc)
+        slot = {field: slot_doc[field] for field in SLOT_FIELDS if field != "_id"}
+        self._apply(slot)
+        return slot
+
+    async def set_capacity(self, slot_id: str, capacity: int) -> Dict:
+        """Resize a slot; fails if more seats are taken than the new capacity allows."""
+        slot = await self.slots.find_one({"id": slot_id}, SLOT_FIELDS)
+        if slot is None:
+            raise SlotNotFound(slot_id)
+        delta = capacity - slot["capacity"]
+        # Guard on the capacity we read so a concurrent resize is not applied twice
+        updated = await self.slots.find_one_and_update(
+            {"id": slot_id, "capacity": slot["capacity"], "available": {"$gte": -delta}},
+            {"$inc": {"capacity": delta, "available": delta}},
+            projection=SLOT_FIELDS,
+            return_document=ReturnDocument.AFTER,
+        )
+        if updated is None:
+            raise SlotUnavailable(f"Slot {slot_id} has more seats taken than the new capacity")
+        self._apply(updated)
+        return updated
+
+    async def hold(self, slot_id: str, package_id: str, registration_id: str) -> Dict:
+        """Take one seat and record a hold that expires after hold_minutes."""
+        now = datetime.utcnow()
+        hold_doc = {
+            "id": str(uuid.uuid4()),
+            "slot_id": slot_id,
+            "registration_id": registration_id,
+            "status": "held",
+            "seat_tracked": True,
+            "created_at": now,
+            "expires_at": now + timedelta(minutes=self.hold_minutes),
+        }
+        # Hold first: if we die before taking the seat, the reaper finds nothing to give back
+        await self.holds.insert_one(hold_doc)
+        slot = await self.slots.find_one_and_update(
+            {"id": slot_id, "package_id": package_id, "available": {"$gt": 0}},
+            {"$inc": {"available": -1}, "$push": {"hold_ids": hold_doc["id"]}},
+            projection=SLOT_FIELDS,
+            return_document=ReturnDocument.AFTER,
+        )
+        if slot is None:
+            await self.holds.delete_one({"id": hold_doc["id"]})
+            if await self.slots.count_documents({"id": slot_id, "package_id": package_id}, limit=1) == 0:
+                raise SlotNotFound(slot_id)
+            raise SlotUnavailable(f"Slot {slot_id} is fully booked")
+        self._apply(slot)
+        return hold_doc
+
+    async def attach_session(self, hold_id: str, session_id: str):
+        await self.holds.update_one({"id": hold_id, "status": "held"}, {"$set": {"session_id": session_id}})
+
+    async def release(self, hold_id: str) -> bool:
+        hold = await self._claim_release({"id": hold_id, "status": "held"})
+        if hold is None:
+            return False
+        await self._return_seat(hold)
+        return True
+
+    async def release_sessions(self, session_ids: List[str]) -> int:
+        """Give back the seats held for Stripe sessions that expired unpaid."""
+        released = 0
+        while True:
+            hold = await self._claim_release({"session_id": {"$in": session_ids}, "status": "held"})
+            if hold is None:
+                return released
+            await self._return_seat(hold)
+            released += 1
+
+    async def release_expired(self) -> int:
+        """Give back the seats of holds whose checkout was abandoned."""
+        # Finish releases an interrupted run or request left half done
+        async for hold in self.holds.find({"status": "releasing"}, HOLD_FIELDS):
+            await self._return_seat(hold)
+
+        released = []
+        while True:
+            hold = await self._claim_release({"status": "held", "expires_at": {"$lt": datetime.utcnow()}})
+            if hold is None:
+                break
+            await self._return_seat(hold)
+            released.append(hold)
+        if released:
+            logger.info("Released %d expired slot holds", len(released))
+            session_ids = [hold["session_id"] for hold in released if hold.get("session_id")]
+            if session_ids and self.on_expired is not None:
+                await self.on_expired(session_ids)
+        return len(released)
+
+    async def _claim_release(self, query: Dict) -> Optional[Dict]:
+        return await self.holds.find_one_and_update(
+            query,
+            {"$set": {"status": "releasing", "released_at": datetime.utcnow()}},
+            projection=HOLD_FIELDS,
+        )
+
+    async def _return_seat(self, hold: Dict):
+        if hold.get("seat_tracked"):
+            # Matches only while the slot still counts this hold, so a retry cannot add a second seat
+            slot_query = {"id": hold["slot_id"], "hold_ids": hold["id"]}
+        else:
+            # Holds taken before slots listed their hold ids
+            slot_query = {"id": hold["slot_id"]}
+        slot = await self.slots.find_one_and_update(
+            slot_query,
+            {"$inc": {"available": 1}, "$pull": {"hold_ids": hold["id"]}},
+            projection=SLOT_FIELDS,
+            return_document=ReturnDocument.AFTER,
+        )
+        if slot is not None:
+            self._apply(slot)
+        await self.holds.update_one({"id": hold["id"], "status": "releasing"}, {"$set": {"status": "released"}})
+
+    async def confirm(self, session_ids: List[str]):
+        """Turn the holds of paid sessions into bookings."""
+        async for hold in self.holds.find({"session_id": {"$in": session_ids}, "status": "held"}, HOLD_FIELDS):
+            confirmed = await self.holds.find_one_and_update(
+                {"id": hold["id"], "status": "held"},
+                {"$set": {"status": "confirmed", "confirmed_at": datetime.utcnow()}, "$unset": {"expires_at": ""}},
+            )
+            if confirmed is not None:
+                # The seat stays taken; the slot no longer has to track who holds it
+                await self.slots.update_one({"id": hold["slot_id"]}, {"$pull": {"hold_ids": hold["id"]}})
+
+        # A payment can complete after its hold expired; take the seat again if one is left
+        cursor = self.holds.find(
+            {"session_id": {"$in": session_ids}, "status": {"$in": ["releasing", "released"]}}, HOLD_FIELDS
+        )
+        async for hold in cursor:
+            slot = await self.slots.find_one_and_update(
+                {"id": hold["slot_id"], "available": {"$gt": 0}},
+                {"$inc": {"available": -1}},
+                projection=SLOT_FIELDS,
+                return_document=ReturnDocument.AFTER,
+            )
+            status = "confirmed" if slot is not None else "overbooked"
+            await self.holds.update_one(
+                {"id": hold["id"], "status": {"$in": ["releasing", "released"]}},
+                {"$set": {"status": status, "confirmed_at": datetime.utcnow()}, "$unset": {"released_at": ""}},
+            )
+            if slot is not None:
+                self._apply(slot)
+            else:
+                logger.warning("Paid after hold expired and slot %s is full: hold %s", hold["slot_id"], hold["id"])
+
+    def _apply(self, slot: Dict):
+        if self._loaded_at is not None:
+            self._view[slot["id"]] = slot
+
+    async def availability(self, package_id: Optional[str] = None) -> List[Dict]:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.cache_ttl:
+            # Concurrent requests share one refresh
+            if self._refreshing is None:
+                self._refreshing = asyncio.ensure_future(self._refresh())
+            refreshing = self._refreshing
+            try:
+                await asyncio.shield(refreshing)
+            finally:
+                if self._refreshing is refreshing and refreshing.done():
+                    self._refreshing = None
+        return [
+            slot for slot in self._view.values()
+            if package_id is None or slot["package_id"] == package_id
+        ]
+
+    async def _refresh(self):
+        cursor = self.slots.find({}, SLOT_FIELDS).sort([("package_id", 1), ("starts_at", 1)])
+        self._view = {slot["id"]: slot async for slot in cursor}
+        self._loaded_at = time.monotonic()
+
+    def start(self, interval_seconds: float):
+        self._task.start(run_every(interval_seconds, self.release_expired, logger, "Releasing expired slot holds"))
+
+    async def stop(self):
+        await self._task.stop()
@@ -0,0 +1,93 @@
+"""Short-lived cache for non-terminal checkout statuses.
+
+Concurrent polls for the same session share one upstream call, results live
+for a few seconds, the least recently used entries are evicted first and the
+webhook invalidates an entry as soon as the session changes state.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict
+
+
+class StatusCache:
+    def __init__(self, ttl: float = 3.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.terminal_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    async def get(self, session_id: str, loader: Callable[[], Awaitable[Dict]]) -> Dict:
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            expires_at, payload = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(session_id)
+                self.hits += 1
+                return payload
+            del self._entries[session_id]
+
+        inflight = self._inflight.get(session_id)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[session_id] = future
+        try:
+            payload = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an exception nobody else awaited is not logged
+            future.exception()
+            raise
+        else:
+            future.set_result(payload)
+            # An invalidation that raced the load wins over the stale result
+            if self._inflight.get(session_id) is future:
+                self._store(session_id, payload)
+            return payload
+        finally:
+            if self._inflight.get(session_id) is future:
+                del self._inflight[session_id]
+
+    def _store(self, session_id: str, payload: Dict):
+        self._entries[session_id] = (time.monotonic() + self.ttl, payload)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, session_id: str):
+        self.invalidations += 1
+        self._entries.pop(session_id, None)
+        self._inflight.pop(session_id, None)
+
+    def record_terminal_hit(self):
+        self.terminal_hits += 1
+
+    def sizes(self) -> Dict:
+        return {"entries": len(self._entries), "inflight": len(self._inflight)}
+
+    def counters(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "terminal_hits": self.terminal_hits,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def stats(self) -> Dict:
+        return {**self.sizes(), **self.counters()}
@@ -0,0 +1,175 @@
+"""Durable queue for verified Stripe webhook events.
+
+The webhook route only verifies the signature and inserts the event into
+`webhook_events`; the unique index on `event_id` drops duplicate deliveries
+at insert time. A background worker claims queued events in batches and
+hands completed and expired checkout events to the payment state machine,
+which applies each batch with one `bulk_write` per collection. If a batch
+fails, its events are retried one by one so a single bad event cannot hold
+back the rest; an event that still fails after `max_attempts` claims is
+marked `failed` and logged.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from background import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+# Other event types are acknowledged and marked processed without any effect
+HANDLED_EVENT_TYPES = ("checkout.session.completed", "checkout.session.expired")
+
+
+class WebhookQueue:
+    def __init__(
+        self,
+        database,
+        state_machine,
+        on_processed: Optional[Callable[[List[Dict]], Awaitable[None]]] = None,
+        batch_size: int = 100,
+        poll_interval: float = 1.0,
+        lease_seconds: float = 60.0,
+        max_attempts: int = 5,
+    ):
+        self.database = database
+        self.state_machine = state_machine
+        self.on_processed = on_processed
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._wakeup = None
+        self._task = BackgroundTask()
+
+    @property
+    def collection(self):
+        return self.database.db["webhook_events"]
+
+    async def enqueue(self, webhook_response, webhook_body: bytes) -> bool:
+        """Store a verified event. Returns False if it was already received."""
+        try:
+            await self.collection.insert_one({
+                "event_id": webhook_response.event_id,
+                "event_type": webhook_response.event_type,
+                "session_id": webhook_response.session_id,
+                "payment_status": webhook_response.payment_status,
+                "metadata": webhook_response.metadata,
+                "raw_body": webhook_body.decode("utf-8", errors="replace"),
+                "status": "queued",
+                "attempts": 0,
+                "received_at": datetime.utcnow(),
+            })
+        except DuplicateKeyError:
+            return False
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task.start(self._run())
+
+    async def stop(self):
+        await self._task.stop()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                while await self.drain_once() == self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Webhook queue drain failed")
+
+    async def _fail_exhausted(self):
+        """Give up on events whose last allowed claim has run out its lease."""
+        now = datetime.utcnow()
+        while True:
+            event = await self.collection.find_one_and_update(
+                {"status": "processing", "attempts": {"$gte": self.max_attempts}, "locked_until": {"$lt": now}},
+                {
+                    "$set": {"status": "failed", "processed_at": now},
+                    "$unset": {"lock_token": "", "locked_until": ""},
+                },
+                projection={"event_id": 1, "session_id": 1, "attempts": 1, "last_error": 1},
+            )
+            if event is None:
+                return
+            logger.error(
+                "Webhook event %s for session %s failed after %d attempts: %s",
+                event["event_id"], event.get("session_id"), event["attempts"], event.get("last_error"),
+            )
+
+    async def _claim_batch(self) -> List[Dict]:
+        now = datetime.utcnow()
+        claimable = {
+            "attempts": {"$lt": self.max_attempts},
+            "$or": [
+                {"status": "queued"},
+                {"status": "processing", "locked_until": {"$lt": now}},
+            ],
+        }
+        cursor = self.collection.find(claimable, {"_id": 1}).sort("received_at", 1).limit(self.batch_size)
+        ids = [doc["_id"] async for doc in cursor]
+        if not ids:
+            return []
+
+        lock_token = uuid.uuid4().hex
+        await self.collection.update_many(
+            {"_id": {"$in": ids}, **claimable},
+            {
+                "$set": {
+                    "status": "processing",
+                    "lock_token": lock_token,
+                    "locked_until": now + timedelta(seconds=self.lease_seconds),
+                },
+                "$inc": {"attempts": 1},
+            }
+        )
+        return await self.collection.find({"lock_token": lock_token}).to_list(length=None)
+
+    async def _apply(self, events: List[Dict]):
+        await self.state_machine.apply_webhook_events(events)
+        if self.on_processed is not None:
+            await self.on_processed(events)
+
+    async def drain_once(self) -> int:
+        await self._fail_exhausted()
+        events = await self._claim_batch()
+        if not events:
+            return 0
+
+        handled = [e for e in events if e["event_type"] in HANDLED_EVENT_TYPES]
+        failed_ids = set()
+        if handled:
+            try:
+                await self._apply(handled)
+            except Exception:
+                logger.exception("Applying %d webhook events failed; retrying them one by one", len(handled))
+                # Transitions are guarded, so re-applying the events that did go through is a no-op
+                for event in handled:
+                    try:
+                        await self._apply([event])
+                    except Exception as e:
+                        logger.exception("Webhook event %s failed", event["event_id"])
+                        failed_ids.add(event["_id"])
+                        # Left in processing: claimed again once the lease runs out
+                        await self.collection.update_one({"_id": event["_id"]}, {"$set": {"last_error": repr(e)}})
+
+        await self.collection.update_many(
+            {"_id": {"$in": [e["_id"] for e in events if e["_id"] not in failed_ids]}},
+            {
+                "$set": {"status": "processed", "processed_at": datetime.utcnow()},
+                "$unset": {"lock_token": "", "locked_until": ""},
+            }
+        )
+        return len(events)
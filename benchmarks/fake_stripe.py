@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Minimal fake of the Stripe Checkout REST API for local benchmarks.
+
+Implements just enough of /v1/checkout/sessions for the backend's payment
+gateway, with a fixed artificial latency to stand in for the real provider.
+Point the backend at it with STRIPE_API_BASE=http://127.0.0.1:<port>.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+
+app = FastAPI()
+SESSIONS = {}
+LATENCY_SECONDS = 0.0
+
+
+def sign_webhook(payload: bytes, secret: str) -> str:
+    """Build a Stripe-Signature header value for payload."""
+    timestamp = int(time.time())
+    signed = f"{timestamp}.".encode() + payload
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def completed_event(session_id: str, metadata: dict) -> bytes:
+    """checkout.session.completed event body for a paid session."""
+    session = {
+        "id": session_id,
+        "object": "checkout.session",
+        "status": "complete",
+        "payment_status": "paid",
+        "metadata": metadata,
+    }
+    return json.dumps({
+        "id": f"evt_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": "checkout.session.completed",
+        "data": {"object": session},
+    }).encode()
+
+
+def parse_form(body: bytes) -> dict:
+    from urllib.parse import parse_qsl
+    form = {}
+    for key, value in parse_qsl(body.decode()):
+        if key.startswith("metadata["):
+            form.setdefault("metadata", {})[key[len("metadata["):-1]] = value
+        else:
+            form[key] = value
+    return form
+
+
+@app.post("/v1/checkout/sessions")
+async def create_session(request: Request):
+    await asyncio.sleep(LATENCY_SECONDS)
+    form = parse_form(await request.body())
+    session_id = f"cs_test_{uuid.uuid4().hex}"
+    SESSIONS[session_id] = {
+        "id": session_id,
+        "object": "checkout.session",
+        "url": f"https://checkout.stripe.com/c/pay/{session_id}",
+        "status": "open",
+        "payment_status": "unpaid",
+        "amount_total": int(form.get("line_items[0][price_data][unit_amount]", 0)),
+        "currency": form.get("line_items[0][price_data][currency]", "kzt"),
+        "metadata": form.get("metadata", {}),
+    }
+    return SESSIONS[session_id]
+
+
+@app.get("/v1/checkout/sessions/{session_id}")
+async def retrieve_session(session_id: str):
+    await asyncio.sleep(LATENCY_SECONDS)
+    return SESSIONS.get(session_id) or {
+        "id": session_id,
+        "object": "checkout.session",
+        "status": "open",
+        "payment_status": "unpaid",
+        "amount_total": 0,
+        "currency": "kzt",
+        "metadata": {},
+    }
+
+
+def main():
+    global LATENCY_SECONDS
+    parser = argparse.ArgumentParser(description="Fake Stripe Checkout API")
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--latency-ms", type=float, default=80.0)
+    args = parser.parse_args()
+    LATENCY_SECONDS = args.latency_ms / 1000
+
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Local load test and benchmark for the UniBaby backend API.
+
+Starts backend/server.py with uvicorn against a local MongoDB and the fake
+Stripe server in this directory, drives concurrent async load at every public
+endpoint and reports throughput plus p50/p95/p99 latency per endpoint.
+
+    python benchmarks/load_test.py --requests 2000 --concurrency 50 --output bench.json
+    python benchmarks/load_test.py --baseline bench.json   # fail on p95 regressions
+
+Requires a MongoDB on MONGO_URL (default mongodb://localhost:27017); the
+benchmark uses its own database and drops it afterwards. Webhooks are signed
+with the STRIPE_WEBHOOK_SECRET passed to the backend, so the webhook phase
+measures the full verify-and-enqueue path.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from fake_stripe import completed_event, sign_webhook
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT / "backend"
+BENCH_DIR = Path(__file__).resolve().parent
+WEBHOOK_SECRET = "whsec_benchmark"
+
+REGISTRATION_DATA = {
+    "name": "Анна Смирнова",
+    "phone": "+7 777 123 4567",
+    "child_name": "Максим",
+    "child_age": 4,
+    "package_id": "junior_swim",
+    "email": "anna.smirnova@example.com",
+    "additional_info": "Benchmark"
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(name, latencies, errors, elapsed):
+    latencies.sort()
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        "endpoint": name,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round((len(latencies) + errors) / elapsed, 1) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1] if latencies else None),
+    }
+
+
+async def run_phase(name, total, concurrency, make_request):
+    """Issue `total` requests with `concurrency` workers; make_request(i) returns a response."""
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await make_request(i)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result = summarize(name, latencies, errors, time.perf_counter() - started)
+    print(f"{name:<24} {result['throughput_rps']:>8} rps  p50 {result['p50_ms']} ms  "
+          f"p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms  errors {errors}")
+    return result
+
+
+async def run_benchmark(base_url, args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        results = []
+        results.append(await run_phase(
+            "GET /api/packages", args.requests, args.concurrency,
+            lambda i: client.get("/api/packages")
+        ))
+        results.append(await run_phase(
+            "POST /api/register", args.requests, args.concurrency,
+            lambda i: client.post("/api/register", json=REGISTRATION_DATA)
+        ))
+
+        sessions = []
+
+        async def create_session(i):
+            response = await client.post("/api/checkout/session", json={
+                "package_id": "junior_swim",
+                "registration_data": REGISTRATION_DATA,
+                "origin_url": "http://127.0.0.1:3000"
+            })
+            if response.status_code == 200:
+                sessions.append(response.json())
+            return response
+
+        results.append(await run_phase(
+            "POST /api/checkout/session", args.requests, args.concurrency, create_session
+        ))
+        if not sessions:
+            print("No checkout sessions were created; skipping status and webhook phases")
+            return results
+
+        results.append(await run_phase(
+            "GET /api/checkout/status", args.requests, args.concurrency,
+            lambda i: client.get(f"/api/checkout/status/{sessions[i % len(sessions)]['session_id']}")
+        ))
+
+        def send_webhook(i):
+            session = sessions[i % len(sessions)]
+            payload = completed_event(session["session_id"], {"registration_id": session["registration_id"]})
+            return client.post("/api/webhook/stripe", content=payload, headers={
+                "Content-Type": "application/json",
+                "Stripe-Signature": sign_webhook(payload, WEBHOOK_SECRET)
+            })
+
+        results.append(await run_phase(
+            "POST /api/webhook/stripe", args.requests, args.concurrency, send_webhook
+        ))
+        return results
+
+
+def wait_for(url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process exited with code {process.returncode} before {url} was ready")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def compare(results, baseline_path, tolerance):
+    baseline = {r["endpoint"]: r for r in json.loads(Path(baseline_path).read_text())["results"]}
+    regressions = []
+    print(f"\n{'='*60}\nCOMPARISON WITH {baseline_path}\n{'='*60}")
+    for result in results:
+        previous = baseline.get(result["endpoint"])
+        if not previous or not previous["p95_ms"] or not result["p95_ms"]:
+            continue
+        change = (result["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"]
+        print(f"{result['endpoint']:<28} p95 {previous['p95_ms']} -> {result['p95_ms']} ms ({change:+.0%})")
+        if change > tolerance:
+            regressions.append(result["endpoint"])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the UniBaby backend locally")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--stripe-latency-ms", type=float, default=80.0)
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--output", default=str(BENCH_DIR / "results" / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"))
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 increase vs baseline")
+    args = parser.parse_args()
+
+    stripe_port = free_port()
+    api_port = free_port()
+    db_name = f"unibaby_bench_{os.getpid()}"
+    env = {
+        **os.environ,
+        "MONGO_URL": args.mongo_url,
+        "MONGO_DB_NAME": db_name,
+        "STRIPE_API_KEY": "sk_test_benchmark",
+        "STRIPE_API_BASE": f"http://127.0.0.1:{stripe_port}",
+        "STRIPE_WEBHOOK_SECRET": WEBHOOK_SECRET,
+        # Every benchmark request comes from 127.0.0.1; per-client limits would turn the run into a 429 test
+        "RATE_LIMIT_CLIENT_PER_SECOND": "1000000",
+        "RATE_LIMIT_CLIENT_BURST": "1000000",
+        "RATE_LIMIT_SESSION_PER_SECOND": "1000000",
+        "RATE_LIMIT_SESSION_BURST": "1000000",
+    }
+
+    stripe_process = subprocess.Popen(
+        [sys.executable, str(BENCH_DIR / "fake_stripe.py"), "--port", str(stripe_port),
+         "--latency-ms", str(args.stripe_latency_ms)],
+        env=env
+    )
+    api_process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(api_port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+
+    try:
+        wait_for(f"http://127.0.0.1:{stripe_port}/v1/checkout/sessions/cs_ready", stripe_process)
+        wait_for(f"http://127.0.0.1:{api_port}/api/health", api_process)
+
+        print(f"\n{'='*60}\nBENCHMARK: {args.requests} requests/endpoint, concurrency {args.concurrency}, "
+              f"{args.workers} worker(s)\n{'='*60}")
+        results = asyncio.run(run_benchmark(f"http://127.0.0.1:{api_port}", args))
+    finally:
+        api_process.terminate()
+        stripe_process.terminate()
+        api_process.wait(timeout=30)
+        stripe_process.wait(timeout=30)
+        from pymongo import MongoClient
+        with MongoClient(args.mongo_url) as client:
+            client.drop_database(db_name)
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "workers": args.workers,
+            "stripe_latency_ms": args.stripe_latency_ms,
+        },
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "results": results,
+    }
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"\nResults written to {output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        if regressions:
+            print(f"⚠️  p95 regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("🎉 No p95 regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,22 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 
+// crypto.randomUUID only exists on secure origins and in Safari 15.4+
+const newIdempotencyKey = () => {
+  const cryptoApi = window.crypto;
+  if (cryptoApi && typeof cryptoApi.randomUUID === 'function') {
+    return cryptoApi.randomUUID();
+  }
+  if (cryptoApi && typeof cryptoApi.getRandomValues === 'function') {
+    const bytes = cryptoApi.getRandomValues(new Uint8Array(16));
+    bytes[6] = (bytes[6] & 0x0f) | 0x40;
+    bytes[8] = (bytes[8] & 0x3f) | 0x80;
+    const hex = Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+    return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+};
+
 const App = () => {
   const [isMenuOpen, setIsMenuOpen] = useState(false);
   const [showRegistrationModal, setShowRegistrationModal] = useState(false);
@@ -9,6 +25,7 @@ const App = () => {
   const [packages, setPackages] = useState({});
   const [isLoading, setIsLoading] = useState(false);
   const [paymentStatus, setPaymentStatus] = useState('');
+  const checkoutAttemptRef = useRef({ body: null, key: null });
 
   const [registrationData, setRegistrationData] = useState({
     name: '',
@@ -61,8 +78,48 @@ const App = () => {
     
     if (sessionId) {
       setPaymentStatus('checking');
+      streamPaymentStatus(sessionId);
+    }
+  };
+
+  const applyPaymentStatus = (data) => {
+    if (data.payment_status === 'paid') {
+      setPaymentStatus('success');
+      return true;
+    } else if (data.status === 'expired') {
+      setPaymentStatus('expired');
+      return true;
+    }
+    return false;
+  };
+
+  const streamPaymentStatus = (sessionId) => {
+    if (!window.EventSource) {
       pollPaymentStatus(sessionId);
+      return;
     }
+
+    const source = new EventSource(`${process.env.REACT_APP_BACKEND_URL}/api/checkout/status/${sessionId}/stream`);
+    let finished = false;
+
+    source.addEventListener('status', (event) => {
+      if (applyPaymentStatus(JSON.parse(event.data))) {
+        finished = true;
+        source.close();
+      }
+    });
+
+    source.addEventListener('timeout', () => {
+      // No final status within the stream window; keep checking with a few polls
+      finished = true;
+      source.close();
+      pollPaymentStatus(sessionId);
+    });
+
+    source.onerror = () => {
+      source.close();
+      if (!finished) pollPaymentStatus(sessionId);
+    };
   };
 
   const pollPaymentStatus = async (sessionId, attempts = 0) => {
@@ -75,17 +132,16 @@ const App = () => {
 
     try {
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/checkout/status/${sessionId}`);
+      if (response.status === 429 || response.status === 503) {
+        // Rate limited or shedding load: wait as long as the server asks before the next attempt
+        const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 2;
+        setTimeout(() => pollPaymentStatus(sessionId, attempts + 1), retryAfter * 1000);
+        return;
+      }
       if (!response.ok) throw new Error('Failed to check payment status');
 
       const data = await response.json();
-      
-      if (data.payment_status === 'paid') {
-        setPaymentStatus('success');
-        return;
-      } else if (data.status === 'expired') {
-        setPaymentStatus('expired');
-        return;
-      }
+      if (applyPaymentStatus(data)) return;
 
       setTimeout(() => pollPaymentStatus(sessionId, attempts + 1), 2000);
     } catch (error) {
@@ -111,10 +167,19 @@ const App = () => {
         origin_url: window.location.origin
       };
 
+      // Resubmitting the same form reuses the key so the server replays the first session
+      const body = JSON.stringify(checkoutRequest);
+      if (checkoutAttemptRef.current.body !== body) {
+        checkoutAttemptRef.current = { body, key: newIdempotencyKey() };
+      }
+
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/checkout/session`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(checkoutRequest)
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': checkoutAttemptRef.current.key
+        },
+        body
       });
 
       if (!response.ok) throw new Error('Failed to create checkout session');
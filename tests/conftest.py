@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+# Backend modules import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+
+@pytest.fixture
+def database(monkeypatch):
+    """A Database bound to an in-memory Mongo; reporting reads go to the same collections."""
+    from mongomock.collection import Collection
+    from mongomock_motor import AsyncMongoMockClient
+
+    from database import Database, PaymentTransactionRepository, RegistrationRepository
+
+    find_and_modify = Collection._find_and_modify
+
+    def find_and_modify_by_id(self, query, projection=None, *args, **kwargs):
+        # mongomock re-reads the updated document with the original filter unless the
+        # projection keeps _id, so guarded updates (`available > 0`) would return None
+        if not projection or projection.get("_id", 1):
+            return find_and_modify(self, query, projection, *args, **kwargs)
+        doc = find_and_modify(self, query, {k: v for k, v in projection.items() if k != "_id"} or None,
+                              *args, **kwargs)
+        if doc is not None:
+            doc.pop("_id", None)
+        return doc
+
+    monkeypatch.setattr(Collection, "_find_and_modify", find_and_modify_by_id)
+
+    database = Database("mongodb://localhost:27017", "unibaby_test")
+    database.client = AsyncMongoMockClient()
+    database.db = database.reporting_db = database.client["unibaby_test"]
+    database.registrations = RegistrationRepository(database.db["registrations"])
+    database.payment_transactions = PaymentTransactionRepository(database.db["payment_transactions"])
+    return database
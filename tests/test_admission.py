@@ -0,0 +1,102 @@
+import asyncio
+
+from starlette.requests import Request
+
+from admission import ClientAddressResolver, ConcurrencyLimiter, TokenBucketLimiter, retry_after_header
+
+
+def make_request(peer, forwarded_for=None):
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers, "client": (peer, 443)})
+
+
+def test_token_bucket_allows_burst_then_reports_wait(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("admission.time.monotonic", lambda: now[0])
+    limiter = TokenBucketLimiter(rate=2, burst=3)
+
+    assert [limiter.acquire("ip") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("ip") == 0.5
+    # Other keys have their own bucket
+    assert limiter.acquire("other") == 0.0
+
+    now[0] += 0.5
+    assert limiter.acquire("ip") == 0.0
+    now[0] += 60
+    assert [limiter.acquire("ip") for _ in range(4)] == [0.0, 0.0, 0.0, 0.5]
+
+
+def test_token_bucket_evicts_least_recently_used_key(monkeypatch):
+    monkeypatch.setattr("admission.time.monotonic", lambda: 0.0)
+    limiter = TokenBucketLimiter(rate=1, burst=1, max_keys=2)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    limiter.acquire("a")
+    limiter.acquire("c")
+
+    assert len(limiter) == 2
+    # "b" was evicted, so it starts again with a full bucket
+    assert limiter.acquire("b") == 0.0
+    assert limiter.acquire("c") == 1.0
+
+
+def test_concurrency_limiter_queues_then_sheds():
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=1, max_queue=1, max_wait=0.05)
+        assert await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        shed = await limiter.acquire()
+        stats = limiter.stats()
+        limiter.release()
+        return shed, stats, await queued, limiter
+
+    shed, stats, queued, limiter = asyncio.run(scenario())
+    assert shed is False
+    assert stats == {"active": 1, "waiting": 1, "limit": 1}
+    assert queued is True
+    assert limiter.stats()["active"] == 1
+
+
+def test_concurrency_limiter_times_out_waiting():
+    async def scenario():
+        limiter = ConcurrencyLimiter(limit=1, max_queue=5, max_wait=0.01)
+        await limiter.acquire()
+        return await limiter.acquire(), limiter.stats()
+
+    acquired, stats = asyncio.run(scenario())
+    assert acquired is False
+    assert stats["waiting"] == 0
+
+
+def test_retry_after_rounds_up_to_whole_seconds():
+    assert retry_after_header(0.2) == {"Retry-After": "1"}
+    assert retry_after_header(2.01) == {"Retry-After": "3"}
+
+
+def test_forwarded_clients_behind_trusted_proxy_get_separate_buckets(monkeypatch):
+    monkeypatch.setattr("admission.time.monotonic", lambda: 0.0)
+    resolver = ClientAddressResolver("10.0.0.0/8")
+    limiter = TokenBucketLimiter(rate=1, burst=1)
+    first = resolver.resolve(make_request("10.1.2.3", "203.0.113.5"))
+    second = resolver.resolve(make_request("10.1.2.3", "198.51.100.7"))
+
+    assert (first, second) == ("203.0.113.5", "198.51.100.7")
+    assert limiter.acquire(first) == 0.0
+    assert limiter.acquire(second) == 0.0
+    assert limiter.acquire(first) == 1.0
+
+
+def test_client_address_skips_only_trusted_hops():
+    resolver = ClientAddressResolver("10.0.0.1, 10.0.0.2")
+    # A spoofed left-most entry is ignored; the hop the trusted proxies saw wins
+    assert resolver.resolve(make_request("10.0.0.1", "6.6.6.6, 203.0.113.5, 10.0.0.2")) == "203.0.113.5"
+    # An untrusted peer cannot choose its own key
+    assert resolver.resolve(make_request("198.51.100.7", "203.0.113.5")) == "198.51.100.7"
+    assert ClientAddressResolver("*").resolve(make_request("10.9.9.9", "203.0.113.5")) == "203.0.113.5"
+
+
+def test_client_limits_are_off_without_trusted_proxies():
+    resolver = ClientAddressResolver("")
+    assert resolver.enabled is False
+    assert resolver.resolve(make_request("10.1.2.3", "203.0.113.5")) is None
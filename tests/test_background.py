@@ -0,0 +1,38 @@
+import asyncio
+import logging
+
+from background import BackgroundTask, run_every
+
+
+def test_run_every_keeps_going_after_a_failed_run(caplog):
+    async def scenario():
+        calls = []
+
+        async def work():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                raise RuntimeError("mongo unavailable")
+
+        task = BackgroundTask()
+        task.start(run_every(0.01, work, logging.getLogger("sweeper"), "Test sweep"))
+        while len(calls) < 3:
+            await asyncio.sleep(0.01)
+        await task.stop()
+        stopped_at = len(calls)
+        await asyncio.sleep(0.03)
+        return stopped_at, len(calls)
+
+    with caplog.at_level(logging.ERROR, logger="sweeper"):
+        stopped_at, calls = asyncio.run(scenario())
+
+    assert stopped_at == calls
+    assert [record.getMessage() for record in caplog.records] == ["Test sweep failed"]
+
+
+def test_stop_without_start_is_a_no_op():
+    async def scenario():
+        task = BackgroundTask()
+        await task.stop()
+        await task.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,56 @@
+import asyncio
+
+from bulk_import import iter_rows
+
+
+async def chunked(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def rows(fmt, *chunks):
+    async def collect():
+        return [row async for row in iter_rows(chunked(*chunks), fmt)]
+    return asyncio.run(collect())
+
+
+def test_ndjson_rows_split_across_chunks():
+    assert rows("ndjson", b'{"name": "A"}\n{"na', b'me": "B"}\n\n{"name": "C"}') == [
+        (1, {"name": "A"}, None),
+        (2, {"name": "B"}, None),
+        (3, {"name": "C"}, None),
+    ]
+
+
+def test_ndjson_reports_bad_lines():
+    result = rows("ndjson", b'not json\n[1, 2]\n{"name": "A"}\n')
+    assert result[0][0] == 1 and result[0][2].startswith("invalid JSON")
+    assert result[1] == (2, None, "expected a JSON object")
+    assert result[2] == (3, {"name": "A"}, None)
+
+
+def test_csv_header_bom_crlf_and_empty_cells():
+    body = "\ufeffname, phone ,email\r\nАнна,+7 777 123 4567,\r\nB,1\r\n".encode("utf-8")
+    assert rows("csv", body) == [
+        (1, {"name": "Анна", "phone": "+7 777 123 4567"}, None),
+        (2, None, "expected 3 columns, got 2"),
+    ]
+
+
+def test_non_utf8_line_is_a_row_error():
+    body = "name,phone\n".encode() + "Анна,1\n".encode("cp1251") + b"B,2\n"
+    result = rows("csv", body)
+    assert result[0][0] == 1 and "UTF-8" in result[0][2]
+    assert result[1] == (2, {"name": "B", "phone": "2"}, None)
+
+
+def test_undecodable_csv_header_stops_the_import():
+    result = rows("csv", "имя,телефон\n".encode("cp1251"), b"A,1\n")
+    assert len(result) == 1
+    assert result[0][0] == 0 and result[0][2].startswith("header:")
+
+
+def test_overlong_line_is_dropped_without_buffering_it():
+    result = rows("ndjson", *[b"x" * 40000] * 5, b'\n{"name": "A"}\n')
+    assert result[0][0] == 1 and "longer than" in result[0][2]
+    assert result[1] == (2, {"name": "A"}, None)
@@ -0,0 +1,60 @@
+import asyncio
+
+from pymongo import ReadPreference
+
+from database import Database, PaymentTransactionRepository
+from rollups import RevenueRollups
+
+
+def connect(**options):
+    async def scenario():
+        # The motor client connects lazily, so no server is needed to inspect its options
+        database = Database("mongodb://localhost:27017", "unibaby_test", **options)
+        await database.connect()
+        database.close()
+        return database
+
+    return asyncio.run(scenario())
+
+
+def test_reporting_reads_use_bounded_staleness_secondaries_when_enabled():
+    database = connect(secondary_reads=True, max_staleness_seconds=120)
+    assert database.reporting_db.read_preference.mongos_mode == "secondaryPreferred"
+    assert database.reporting_db.read_preference.max_staleness == 120
+    assert database.db.read_preference == ReadPreference.PRIMARY
+    assert database.payment_transactions.reporting_collection.read_preference.mongos_mode == "secondaryPreferred"
+    assert database.payment_transactions.collection.read_preference == ReadPreference.PRIMARY
+
+
+def test_reporting_reads_stay_on_the_primary_by_default():
+    database = connect()
+    assert database.reporting_db.read_preference == ReadPreference.PRIMARY
+
+
+def test_find_status_falls_back_to_the_primary_when_the_secondary_misses(database):
+    async def scenario():
+        primary = database.db["payment_transactions"]
+        secondary = database.client["lagging_secondary"]["payment_transactions"]
+        await primary.insert_many([
+            {"session_id": "cs_new", "status": "open"},
+            {"session_id": "cs_old", "status": "complete"},
+        ])
+        await secondary.insert_one({"session_id": "cs_old", "status": "open"})
+        repository = PaymentTransactionRepository(primary, secondary)
+        return await repository.find_status("cs_new"), await repository.find_status("cs_old")
+
+    new, old = asyncio.run(scenario())
+    assert new["status"] == "open"
+    # A replicated copy is served from the secondary, even if it lags
+    assert old["status"] == "open"
+
+
+def test_rollup_dashboard_reads_from_the_reporting_db(database):
+    async def scenario():
+        database.reporting_db = database.client["lagging_secondary"]
+        await database.reporting_db["daily_rollups"].insert_one(
+            {"day": "2026-10-17", "package_id": "junior_swim", "currency": "kzt", "paid_count": 1, "revenue": 1.0}
+        )
+        return await RevenueRollups(database).query()
+
+    assert [row["paid_count"] for row in asyncio.run(scenario())] == [1]
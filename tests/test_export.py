@@ -0,0 +1,127 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from export import RegistrationExporter, escape_formula, export_filter, export_pipeline, flatten_row
+
+
+@pytest.mark.parametrize("value", ["=HYPERLINK(\"http://x\")", "+SUM(A1:A9)", "-2+3", "@cmd", "\t=1", "+7-777", "+"])
+def test_formula_cells_are_escaped(value):
+    assert escape_formula(value) == "'" + value
+
+
+@pytest.mark.parametrize("value", ["+77771234567", "+7 777 123 45 67", "87771234567", "Айгерим", "", None, 18000.0])
+def test_phone_numbers_and_plain_values_are_left_alone(value):
+    assert escape_formula(value) == value
+
+
+def test_export_filter():
+    created_from, created_to = datetime(2026, 10, 1), datetime(2026, 11, 1)
+    assert export_filter() == {}
+    assert export_filter(created_from, created_to, "junior_swim", "paid") == {
+        "created_at": {"$gte": created_from, "$lt": created_to},
+        "package_id": "junior_swim",
+        "status": "paid",
+    }
+    assert export_filter(created_to=created_to) == {"created_at": {"$lt": created_to}}
+
+
+def test_flatten_row_reads_payment_fields_and_formats_dates():
+    row = flatten_row({
+        "id": "r1",
+        "created_at": datetime(2026, 10, 17, 9, 30),
+        "phone": "+77771234567",
+        "payment": {"session_id": "cs_1", "amount": 18000.0, "updated_at": datetime(2026, 10, 17, 9, 45)},
+    })
+    assert row["registration_id"] == "r1"
+    assert row["created_at"] == "2026-10-17T09:30:00"
+    assert (row["session_id"], row["amount"], row["payment_updated_at"]) == ("cs_1", 18000.0, "2026-10-17T09:45:00")
+    # Registrations without a payment export empty payment columns
+    assert flatten_row({"id": "r2"})["session_id"] is None
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    """Stands in for the reporting collection: mongomock has no `$lookup` with a pipeline."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = []
+
+    def aggregate(self, pipeline, **kwargs):
+        self.calls.append((pipeline, kwargs))
+        return FakeCursor(self.docs)
+
+
+REGISTRATIONS = [
+    {"id": "r0", "created_at": datetime(2026, 10, 1), "name": "Айгерим", "phone": "+7 777 123 45 67",
+     "payment": {"session_id": "cs_0", "amount": 18000.0}},
+    {"id": "r1", "created_at": datetime(2026, 10, 2), "name": "=cmd|' /C calc'!A0", "phone": "+7 777 123 45 67"},
+    {"id": "r2", "created_at": datetime(2026, 10, 3), "name": "Алан", "phone": "+77771234567"},
+]
+
+
+def export(fmt, query, batch_size=2):
+    collection = FakeCollection(REGISTRATIONS)
+    exporter = RegistrationExporter(SimpleNamespace(registrations=SimpleNamespace(reporting_collection=collection)), batch_size)
+
+    async def scenario():
+        stream = exporter.csv(query) if fmt == "csv" else exporter.ndjson(query)
+        return [chunk async for chunk in stream]
+
+    return asyncio.run(scenario()), collection.calls
+
+
+def test_export_pipeline_matches_then_joins_the_latest_payment():
+    pipeline = export_pipeline({"status": "paid"})
+
+    assert pipeline[0] == {"$match": {"status": "paid"}}
+    assert pipeline[2]["$project"]["_id"] == 0
+    lookup = pipeline[3]["$lookup"]
+    assert (lookup["localField"], lookup["foreignField"]) == ("id", "registration_id")
+    assert lookup["pipeline"][:2] == [{"$sort": {"created_at": -1}}, {"$limit": 1}]
+    assert pipeline[4]["$unwind"]["preserveNullAndEmptyArrays"] is True
+
+
+def test_ndjson_export_streams_one_chunk_per_batch():
+    chunks, calls = export("ndjson", {"package_id": "junior_swim"})
+    rows = [json.loads(line) for line in "".join(chunks).splitlines()]
+
+    assert calls[0][0][0] == {"$match": {"package_id": "junior_swim"}}
+    assert calls[0][1]["batchSize"] == 2
+    assert [len(chunk.splitlines()) for chunk in chunks] == [2, 1]
+    assert [row["registration_id"] for row in rows] == ["r0", "r1", "r2"]
+    assert rows[0]["session_id"] == "cs_0"
+    assert rows[0]["created_at"] == "2026-10-01T00:00:00"
+    # NDJSON is not opened by spreadsheets, so values stay verbatim
+    assert rows[1]["name"] == "=cmd|' /C calc'!A0"
+
+
+def test_csv_export_escapes_formulas_but_not_phone_numbers():
+    chunks, _ = export("csv", {})
+    rows = list(csv.DictReader(io.StringIO("".join(chunks))))
+
+    # Header first, then one chunk per batch
+    assert len(chunks) == 3
+    assert [row["name"] for row in rows] == ["Айгерим", "'=cmd|' /C calc'!A0", "Алан"]
+    assert [row["phone"] for row in rows] == ["+7 777 123 45 67", "+7 777 123 45 67", "+77771234567"]
+    assert rows[0]["amount"] == "18000.0"
+    assert rows[1]["session_id"] == ""
@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from idempotency import IdempotencyConflict, IdempotencyInProgress, IdempotencyStore
+
+
+def make_store(database, **options):
+    return IdempotencyStore(database, poll_interval=0.01, **options)
+
+
+def test_retry_replays_the_stored_response(database):
+    async def scenario():
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            return {"session_id": "cs_1"}
+
+        first = await make_store(database).run("key", "fp", handler)
+        # Another worker has nothing cached and reads the response back from Mongo
+        replayed = await make_store(database).run("key", "fp", handler)
+        with pytest.raises(IdempotencyConflict):
+            await make_store(database).run("key", "other-body", handler)
+        return calls, first, replayed
+
+    calls, first, replayed = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert first == replayed == {"session_id": "cs_1"}
+
+
+def test_waiter_runs_the_handler_after_the_holder_fails(database):
+    async def scenario():
+        holder_started = asyncio.Event()
+
+        async def failing():
+            holder_started.set()
+            await asyncio.sleep(0.03)
+            raise RuntimeError("Stripe unavailable")
+
+        async def succeeding():
+            return {"session_id": "cs_2"}
+
+        holder = asyncio.create_task(make_store(database).run("key", "fp", failing))
+        await holder_started.wait()
+        waiter = await make_store(database, wait_timeout=1).run("key", "fp", succeeding)
+        with pytest.raises(RuntimeError):
+            await holder
+        return waiter
+
+    assert asyncio.run(scenario()) == {"session_id": "cs_2"}
+
+
+def test_waiter_in_the_same_worker_retries_after_the_holder_fails(database):
+    async def scenario():
+        store = make_store(database)
+        calls = []
+
+        async def handler():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            if len(calls) == 1:
+                raise RuntimeError("Stripe unavailable")
+            return {"session_id": "cs_4"}
+
+        return await asyncio.gather(*(store.run("key", "fp", handler) for _ in range(3)), return_exceptions=True), calls
+
+    results, calls = asyncio.run(scenario())
+    assert isinstance(results[0], RuntimeError)
+    assert results[1:] == [{"session_id": "cs_4"}] * 2
+    assert len(calls) == 2
+
+
+def test_expired_lease_is_taken_over(database):
+    async def scenario():
+        await database.db["idempotency_keys"].insert_one({
+            "_id": "key",
+            "fingerprint": "fp",
+            "status": "in_progress",
+            "lock_token": "dead-worker",
+            "locked_until": datetime.utcnow() - timedelta(seconds=1),
+            "created_at": datetime.utcnow(),
+        })
+
+        async def handler():
+            return {"session_id": "cs_3"}
+
+        response = await make_store(database).run("key", "fp", handler)
+        return response, await database.db["idempotency_keys"].find_one({"_id": "key"})
+
+    response, doc = asyncio.run(scenario())
+    assert response == {"session_id": "cs_3"}
+    assert doc["status"] == "completed"
+    assert doc["lock_token"] != "dead-worker"
+
+
+def test_live_claim_reports_in_progress_after_the_wait(database):
+    async def scenario():
+        await database.db["idempotency_keys"].insert_one({
+            "_id": "key",
+            "fingerprint": "fp",
+            "status": "in_progress",
+            "lock_token": "other-worker",
+            "locked_until": datetime.utcnow() + timedelta(minutes=1),
+            "created_at": datetime.utcnow(),
+        })
+
+        async def handler():
+            return {}
+
+        await make_store(database, wait_timeout=0.03).run("key", "fp", handler)
+
+    with pytest.raises(IdempotencyInProgress):
+        asyncio.run(scenario())
@@ -0,0 +1,41 @@
+import asyncio
+
+from notifier import PaymentStatusNotifier, is_terminal, status_payload_from_doc
+
+
+def test_publish_wakes_every_subscriber_of_the_session():
+    async def scenario():
+        notifier = PaymentStatusNotifier()
+        first, second = notifier.subscribe("cs_1"), notifier.subscribe("cs_1")
+        other = notifier.subscribe("cs_2")
+        notifier.publish("cs_1", {"payment_status": "paid"})
+        return first, second, other, notifier
+
+    first, second, other, notifier = asyncio.run(scenario())
+    assert first.result() == second.result() == {"payment_status": "paid"}
+    assert not other.done()
+    assert list(notifier._waiters) == ["cs_2"]
+
+
+def test_unsubscribed_waiters_are_dropped():
+    async def scenario():
+        notifier = PaymentStatusNotifier()
+        waiter = notifier.subscribe("cs_1")
+        notifier.unsubscribe("cs_1", waiter)
+        # A second unsubscribe, as the stream's finally block may do, is harmless
+        notifier.unsubscribe("cs_1", waiter)
+        notifier.publish("cs_1", {"payment_status": "paid"})
+        return waiter, notifier
+
+    waiter, notifier = asyncio.run(scenario())
+    assert not waiter.done()
+    assert notifier._waiters == {}
+
+
+def test_terminal_states_and_payload():
+    assert is_terminal("paid", "complete")
+    assert is_terminal("unpaid", "expired")
+    assert not is_terminal("unpaid", "open")
+    assert status_payload_from_doc({"status": "complete", "payment_status": "paid", "amount": 180.5, "currency": "kzt"}) == {
+        "status": "complete", "payment_status": "paid", "amount_total": 18050, "currency": "kzt", "metadata": {},
+    }
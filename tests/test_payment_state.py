@@ -0,0 +1,100 @@
+import pytest
+
+from payment_state import build_payment_state, payment_transition, registration_transition
+
+
+def matches(doc, query):
+    """Evaluate the subset of the query language the transitions use."""
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(field)
+            if "$in" in condition and value not in condition["$in"]:
+                return False
+            if "$ne" in condition and value == condition["$ne"]:
+                return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+
+def payment(payment_status, status):
+    return {"session_id": "cs", "payment_status": payment_status, "status": status}
+
+
+@pytest.mark.parametrize("doc, payment_status, status", [
+    (payment("pending", "initiated"), "unpaid", "open"),
+    (payment("unpaid", "open"), "paid", "complete"),
+    (payment("unpaid", "open"), "unpaid", "expired"),
+    (payment("unpaid", "complete"), "paid", "complete"),
+    (payment("pending", "open"), "no_payment_required", "complete"),
+])
+def test_payment_moves_forward(doc, payment_status, status):
+    query, update = payment_transition("cs", payment_status, status)
+    assert matches(doc, query)
+    assert update["$set"]["payment_status"] == payment_status
+    assert update["$set"]["status"] == status
+
+
+@pytest.mark.parametrize("doc, payment_status, status", [
+    (payment("unpaid", "expired"), "unpaid", "open"),
+    (payment("unpaid", "complete"), "unpaid", "open"),
+    (payment("unpaid", "expired"), "paid", "complete"),
+    (payment("unpaid", "complete"), "unpaid", "expired"),
+    (payment("paid", "complete"), "unpaid", "complete"),
+    (payment("paid", "complete"), "paid", "complete"),
+    (payment("unpaid", "open"), "pending", "initiated"),
+])
+def test_stale_or_repeated_payment_write_matches_nothing(doc, payment_status, status):
+    query, _ = payment_transition("cs", payment_status, status)
+    assert not matches(doc, query)
+
+
+def test_payment_status_only_update_ignores_checkout_status():
+    query, update = payment_transition("cs", "paid")
+    assert matches(payment("unpaid", "complete"), query)
+    assert "status" not in update["$set"]
+
+
+def test_paid_marks_rollup_pending():
+    _, update = payment_transition("cs", "paid", "complete", extra={"event_id": "evt"})
+    assert update["$set"]["rollup_pending"] is True
+    assert update["$set"]["paid_at"] == update["$set"]["updated_at"]
+    assert update["$set"]["event_id"] == "evt"
+
+
+@pytest.mark.parametrize("payment_status, status", [("refunded", "complete"), ("paid", "canceled")])
+def test_unknown_status_is_rejected(payment_status, status):
+    with pytest.raises(ValueError):
+        payment_transition("cs", payment_status, status)
+
+
+@pytest.mark.parametrize("current, target, allowed", [
+    ("pending_payment", "paid", True),
+    ("pending_payment", "confirmed", True),
+    ("paid", "confirmed", True),
+    ("paid", "paid", False),
+    ("confirmed", "paid", False),
+    ("confirmed", "confirmed", False),
+])
+def test_registration_transition(current, target, allowed):
+    query, update = registration_transition("r1", target)
+    assert matches({"id": "r1", "status": current}, query) is allowed
+    assert update["$set"]["status"] == target
+
+
+def test_unknown_registration_status_is_rejected():
+    with pytest.raises(ValueError):
+        registration_transition("r1", "cancelled")
+
+
+def test_build_payment_state_wires_rollups_and_seat_holds():
+    from rollups import RevenueRollups
+    from slots import SlotManager
+
+    rollups, slots = RevenueRollups(database=None), SlotManager(database=None)
+    state = build_payment_state(None, rollups, slots)
+    assert state.paid_listeners == [rollups.record_paid, slots.confirm]
+    assert state.expired_listeners == [slots.release_sessions]
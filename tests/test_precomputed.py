@@ -0,0 +1,61 @@
+import gzip
+import json
+
+from starlette.requests import Request
+
+from precomputed import PrecomputedJSON
+
+
+def make_request(**headers):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/api/packages",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def make_payload():
+    payload = PrecomputedJSON(cache_control="public, max-age=60")
+    payload.update({"packages": [{"id": "junior_swim", "name": "Junior Swim"}]}, version="v1")
+    return payload
+
+
+def test_identity_and_gzip_bodies_share_one_etag():
+    payload = make_payload()
+    plain = payload.respond(make_request())
+    zipped = payload.respond(make_request(accept_encoding="gzip"))
+
+    assert plain.status_code == 200
+    assert json.loads(plain.body) == {"packages": [{"id": "junior_swim", "name": "Junior Swim"}]}
+    assert zipped.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(zipped.body) == plain.body
+    assert zipped.headers["etag"] == plain.headers["etag"][:-1] + '-gzip"'
+    assert plain.headers["vary"] == "Accept-Encoding"
+
+
+def test_zero_quality_encoding_is_not_used():
+    response = make_payload().respond(make_request(accept_encoding="gzip;q=0, identity"))
+    assert "content-encoding" not in response.headers
+
+
+def test_matching_etag_returns_304_for_any_encoding():
+    payload = make_payload()
+    etag = payload.respond(make_request(accept_encoding="gzip")).headers["etag"]
+
+    assert payload.respond(make_request(if_none_match=etag)).status_code == 304
+    assert payload.respond(make_request(if_none_match=f"W/{etag}")).status_code == 304
+    assert payload.respond(make_request(if_none_match="*")).status_code == 304
+    not_modified = payload.respond(make_request(if_none_match=f'"other", {etag}'))
+    assert not_modified.status_code == 304 and not_modified.body == b""
+
+
+def test_update_changes_etag():
+    payload = make_payload()
+    old_etag = payload.respond(make_request()).headers["etag"]
+    payload.update({"packages": []}, version="v2")
+
+    response = payload.respond(make_request(if_none_match=old_etag))
+    assert response.status_code == 200
+    assert response.headers["etag"] != old_etag
+    assert payload.version == "v2"
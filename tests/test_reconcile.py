@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from payment_state import PaymentStateMachine
+from reconcile import PaymentReconciler
+
+
+class FakeGateway:
+    """Answers with a fixed (payment_status, status) per session; unknown sessions fail like a Stripe outage."""
+
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = []
+
+    async def get_checkout_status(self, session_id):
+        self.calls.append(session_id)
+        if session_id not in self.statuses:
+            raise RuntimeError("stripe unavailable")
+        payment_status, status = self.statuses[session_id]
+        return SimpleNamespace(payment_status=payment_status, status=status)
+
+
+async def seed_payments(database, payments):
+    for session_id, status, age_minutes in payments:
+        created_at = datetime.utcnow() - timedelta(minutes=age_minutes)
+        await database.registrations.collection.insert_one(
+            {"id": f"r_{session_id}", "status": "pending_payment", "created_at": created_at}
+        )
+        await database.payment_transactions.collection.insert_one({
+            "session_id": session_id, "registration_id": f"r_{session_id}", "payment_status": "pending",
+            "status": status, "created_at": created_at,
+        })
+
+
+def test_sweep_applies_stripe_statuses_to_stale_payments(database):
+    async def scenario():
+        await seed_payments(database, [
+            ("cs_paid", "initiated", 60),
+            ("cs_expired", "open", 45),
+            ("cs_open", "open", 40),
+            ("cs_fresh", "initiated", 5),
+            ("cs_done", "expired", 90),
+        ])
+        gateway = FakeGateway({
+            "cs_paid": ("paid", "complete"),
+            "cs_expired": ("unpaid", "expired"),
+            "cs_open": ("pending", "open"),
+        })
+        notified = []
+
+        async def on_updated(session_ids):
+            notified.append(sorted(session_ids))
+
+        reconciler = PaymentReconciler(database, gateway, PaymentStateMachine(database), on_updated=on_updated,
+                                       older_than_minutes=30, batch_size=2)
+        report = await reconciler.sweep()
+        payments = {doc["session_id"]: (doc["payment_status"], doc["status"])
+                    async for doc in database.payment_transactions.collection.find({}, {"_id": 0})}
+        registrations = {doc["id"]: doc["status"] async for doc in database.registrations.collection.find({}, {"_id": 0})}
+        return report, sorted(gateway.calls), notified, payments, registrations
+
+    report, calls, notified, payments, registrations = asyncio.run(scenario())
+
+    # Fresh checkouts still wait for their webhook and terminal ones are never asked about
+    assert calls == ["cs_expired", "cs_open", "cs_paid"]
+    assert {key: report[key] for key in ("scanned", "updated", "errors", "batches")} == {
+        "scanned": 3, "updated": 2, "errors": 0, "batches": 2,
+    }
+    assert sorted(sum(notified, [])) == calls
+    assert payments["cs_paid"] == ("paid", "complete")
+    assert payments["cs_expired"] == ("unpaid", "expired")
+    assert payments["cs_open"] == ("pending", "open")
+    assert payments["cs_fresh"] == ("pending", "initiated")
+    assert registrations["r_cs_paid"] == "paid"
+    assert registrations["r_cs_expired"] == "pending_payment"
+
+
+def test_failed_lookups_are_counted_and_left_for_the_next_sweep(database):
+    async def scenario():
+        await seed_payments(database, [("cs_paid", "initiated", 60), ("cs_down", "initiated", 60)])
+        gateway = FakeGateway({"cs_paid": ("paid", "complete")})
+        reconciler = PaymentReconciler(database, gateway, PaymentStateMachine(database), older_than_minutes=30)
+        first = await reconciler.sweep()
+        # Once Stripe answers, the next sweep only has the skipped session left
+        gateway.statuses["cs_down"] = ("paid", "complete")
+        gateway.calls.clear()
+        second = await reconciler.sweep()
+        return first, second, gateway.calls
+
+    first, second, calls = asyncio.run(scenario())
+    assert (first["scanned"], first["updated"], first["errors"]) == (2, 1, 1)
+    assert (second["scanned"], second["updated"], second["errors"]) == (1, 1, 0)
+    assert calls == ["cs_down"]
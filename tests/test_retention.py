@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from retention import RetentionManager
+
+OLD = datetime.utcnow() - timedelta(days=40)
+
+
+def registration(registration_id, created_at=OLD):
+    return {"id": registration_id, "status": "pending_payment", "created_at": created_at}
+
+
+def payment(session_id, registration_id, payment_status="pending", created_at=OLD):
+    return {"session_id": session_id, "registration_id": registration_id,
+            "payment_status": payment_status, "status": "open", "created_at": created_at}
+
+
+def seed_and_run(database, registrations, payments, dry_run=False):
+    async def scenario():
+        await database.registrations.collection.insert_many(registrations)
+        if payments:
+            await database.payment_transactions.collection.insert_many(payments)
+        report = await RetentionManager(database, older_than_days=30).run(dry_run=dry_run)
+        hot = await database.registrations.collection.distinct("id")
+        archived = await database.db["registrations_archive"].distinct("id")
+        return report, sorted(hot), sorted(archived)
+
+    return asyncio.run(scenario())
+
+
+def test_abandoned_checkout_archives_payment_and_registration(database):
+    report, hot, archived = seed_and_run(database, [registration("r1")], [payment("cs_1", "r1")])
+
+    assert report["payments"]["archived"] == 1
+    assert report["registrations"]["archived"] == 1
+    assert (hot, archived) == ([], ["r1"])
+
+
+def test_registrations_without_a_checkout_are_kept(database):
+    # Bulk-imported enrollments and plain sign-ups never get a payment
+    report, hot, archived = seed_and_run(database, [registration("imported"), registration("signup")], [])
+
+    assert report["registrations"]["matched"] == 0
+    assert (hot, archived) == (["imported", "signup"], [])
+
+
+def test_registration_with_a_live_payment_is_kept(database):
+    payments = [payment("cs_old", "r1"), payment("cs_new", "r1", created_at=datetime.utcnow())]
+    report, hot, archived = seed_and_run(database, [registration("r1")], payments)
+
+    assert report["payments"]["archived"] == 1
+    assert report["registrations"]["kept_with_payments"] == 1
+    assert (hot, archived) == (["r1"], [])
+
+
+def test_dry_run_reports_without_moving(database):
+    report, hot, archived = seed_and_run(
+        database, [registration("r1"), registration("imported")], [payment("cs_1", "r1")], dry_run=True
+    )
+
+    assert report["payments"] == {"matched": 1, "archived": 0}
+    assert report["registrations"]["matched"] == 1
+    assert (hot, archived) == (["imported", "r1"], [])
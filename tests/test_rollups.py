@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from indexes import INDEXES
+from rollups import RevenueRollups
+
+PAID_AT = datetime(2026, 10, 17, 9, 30)
+
+
+def paid_payment(session_id, amount=18000.0, **fields):
+    return {"session_id": session_id, "package_id": "junior_swim", "amount": amount, "currency": "kzt",
+            "payment_status": "paid", "paid_at": PAID_AT, "rollup_pending": True, **fields}
+
+
+class UnreachableRollups:
+    async def bulk_write(self, *args, **kwargs):
+        raise RuntimeError("rollup write failed")
+
+
+class CrashingRevenueRollups(RevenueRollups):
+    @property
+    def collection(self):
+        return UnreachableRollups()
+
+
+async def seed(database, *payments):
+    await database.db["daily_rollups"].create_indexes(INDEXES["daily_rollups"])
+    await database.payment_transactions.collection.insert_many(list(payments))
+
+
+async def rollup_rows(database):
+    return await RevenueRollups(database).query()
+
+
+def test_paid_session_is_counted_once(database):
+    async def scenario():
+        await seed(database, paid_payment("cs_1"), paid_payment("cs_2", 8000.0))
+        rollups = RevenueRollups(database)
+        # Webhook and status poll report the same payment at once, then the sweep runs
+        counted = await asyncio.gather(rollups.record_paid(["cs_1"]), rollups.record_paid(["cs_1"]))
+        swept = await rollups.record_paid()
+        again = await rollups.record_paid(["cs_1", "cs_2"])
+        pending = await database.payment_transactions.collection.count_documents({"rollup_pending": True})
+        return sorted(counted), swept, again, pending, await rollup_rows(database)
+
+    counted, swept, again, pending, rows = asyncio.run(scenario())
+    assert (counted, swept, again, pending) == ([0, 1], 1, 0, 0)
+    assert rows == [{"day": "2026-10-17", "package_id": "junior_swim", "currency": "kzt",
+                     "paid_count": 2, "revenue": 26000.0}]
+
+
+def test_failed_increment_keeps_the_marker_for_the_sweep(database):
+    async def scenario():
+        await seed(database, paid_payment("cs_1"))
+        with pytest.raises(RuntimeError):
+            await CrashingRevenueRollups(database).record_paid(["cs_1"])
+        doc = await database.payment_transactions.collection.find_one({"session_id": "cs_1"})
+        # The claim is still leased, so an immediate sweep leaves it alone
+        early = await RevenueRollups(database).record_paid()
+        # The crashed holder's lease runs out
+        await database.payment_transactions.collection.update_one(
+            {"session_id": "cs_1"}, {"$set": {"rollup_claimed_at": datetime.utcnow() - timedelta(minutes=5)}}
+        )
+        late = await RevenueRollups(database).record_paid()
+        return doc, early, late, await rollup_rows(database)
+
+    doc, early, late, rows = asyncio.run(scenario())
+    assert doc["rollup_pending"] is True and "rollup_claim" in doc
+    assert (early, late) == (0, 1)
+    assert [row["paid_count"] for row in rows] == [1]
+
+
+def test_sweep_recovers_a_claim_left_by_a_crashed_worker(database):
+    async def scenario():
+        await seed(
+            database,
+            paid_payment("cs_dead", rollup_claim="dead-worker", rollup_claimed_at=datetime.utcnow() - timedelta(minutes=5)),
+            paid_payment("cs_live", rollup_claim="live-worker", rollup_claimed_at=datetime.utcnow()),
+        )
+        rollups = RevenueRollups(database, claim_seconds=60)
+        first = await rollups.record_paid()
+        second = await rollups.record_paid()
+        live = await database.payment_transactions.collection.find_one({"session_id": "cs_live"})
+        return first, second, live, await rollup_rows(database)
+
+    first, second, live, rows = asyncio.run(scenario())
+    assert (first, second) == (1, 0)
+    assert live["rollup_claim"] == "live-worker"
+    assert [row["paid_count"] for row in rows] == [1]
+
+
+def test_crash_after_the_increment_is_not_counted_twice(database):
+    async def scenario():
+        await seed(database, paid_payment("cs_1"), paid_payment("cs_2", 8000.0))
+        rollups = RevenueRollups(database)
+        await rollups.record_paid(["cs_1"])
+        # The worker died after the increment landed and before it cleared the marker
+        await database.payment_transactions.collection.update_one({"session_id": "cs_1"}, {"$set": {
+            "rollup_pending": True, "rollup_claim": "dead-worker",
+            "rollup_claimed_at": datetime.utcnow() - timedelta(minutes=5),
+        }})
+        swept = await rollups.record_paid()
+        pending = await database.payment_transactions.collection.count_documents({"rollup_pending": True})
+        return swept, pending, await rollup_rows(database)
+
+    swept, pending, rows = asyncio.run(scenario())
+    # Both were claimed; only cs_2 was added
+    assert (swept, pending) == (2, 0)
+    assert [(row["paid_count"], row["revenue"]) for row in rows] == [(2, 26000.0)]
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+import pytest
+
+from search import RegistrationSearch, SEARCH_COLLATION, decode_cursor, encode_cursor, normalize_phone
+
+
+@pytest.mark.parametrize("phone", ["+7 (777) 123-45-67", "8 777 123 45 67", "7771234567", "+77771234567"])
+def test_normalize_phone_keeps_national_number(phone):
+    assert normalize_phone(phone) == "7771234567"
+
+
+def test_normalize_phone_handles_missing_and_short_numbers():
+    assert normalize_phone(None) == ""
+    assert normalize_phone("12-34") == "1234"
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2026, 10, 17, 9, 30, 15, 123000)
+    cursor = encode_cursor({"created_at": created_at, "id": "a|b"})
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (created_at, "a|b")
+
+
+@pytest.mark.parametrize("cursor", ["@@@", "bm90LWEtY3Vyc29y", "//79"])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_build_query_for_full_and_partial_phone():
+    search = RegistrationSearch(database=None)
+    assert search.build_query(phone="8 (777) 123-45-67") == ({"phone_key": "7771234567"}, None)
+    assert search.build_query(phone="777 123") == ({"phone_key": {"$regex": "^777123"}}, None)
+    with pytest.raises(ValueError):
+        search.build_query(phone="77712")
+
+
+def test_build_query_for_name_prefix():
+    query, collation = RegistrationSearch(database=None).build_query(name="  Ан ")
+    assert collation is SEARCH_COLLATION
+    assert query == {"$or": [
+        {"name": {"$gte": "Ан", "$lt": "Ан\uffff"}},
+        {"child_name": {"$gte": "Ан", "$lt": "Ан\uffff"}},
+    ]}
+    with pytest.raises(ValueError):
+        RegistrationSearch(database=None).build_query(name="А")
+    with pytest.raises(ValueError):
+        RegistrationSearch(database=None).build_query()
@@ -0,0 +1,76 @@
+from types import SimpleNamespace
+
+from serve import WorkerSupervisor
+
+
+class FakeProcess:
+    def __init__(self):
+        self.alive = True
+        self.pid = 1234
+        self.exitcode = None
+
+    def is_alive(self):
+        return self.alive
+
+    def join(self):
+        pass
+
+    def crash(self):
+        self.alive = False
+        self.exitcode = 3
+
+
+class FakeSupervisor(WorkerSupervisor):
+    def __init__(self, **options):
+        super().__init__(SimpleNamespace(workers=1), target=None, sockets=[], drain_seconds=0, **options)
+        self.spawned = []
+
+    def spawn(self):
+        self.spawned.append(FakeProcess())
+        return self.spawned[-1]
+
+
+def test_crashing_worker_restarts_with_backoff_then_gives_up(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("serve.time.monotonic", lambda: now[0])
+    monkeypatch.setattr("serve.signal.signal", lambda *args: None)
+    supervisor = FakeSupervisor(min_uptime=10, backoff=1, max_backoff=30, max_rapid_failures=3)
+    supervisor.startup()
+
+    delays = []
+    for _ in range(2):
+        supervisor.spawned[-1].crash()
+        supervisor.restart_exited()
+        delays.append(supervisor.restart_at[0] - now[0])
+        now[0] += delays[-1] - 0.1
+        supervisor.restart_exited()
+        # Not restarted before the backoff has passed
+        assert supervisor.processes[0] is None
+        now[0] += 0.1
+        supervisor.restart_exited()
+        assert supervisor.processes[0] is supervisor.spawned[-1]
+
+    assert delays == [2, 4]
+    supervisor.spawned[-1].crash()
+    supervisor.restart_exited()
+    assert supervisor.should_exit.is_set()
+    assert supervisor.exit_code == 1
+
+
+def test_worker_that_ran_for_a_while_restarts_without_backoff(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("serve.time.monotonic", lambda: now[0])
+    monkeypatch.setattr("serve.signal.signal", lambda *args: None)
+    supervisor = FakeSupervisor(min_uptime=10, backoff=1, max_rapid_failures=2)
+    supervisor.startup()
+
+    for _ in range(3):
+        now[0] += 60
+        supervisor.spawned[-1].crash()
+        supervisor.restart_exited()
+        assert supervisor.restart_at[0] - now[0] == 1
+        now[0] += 1
+        supervisor.restart_exited()
+
+    assert len(supervisor.spawned) == 4
+    assert not supervisor.should_exit.is_set()
@@ -0,0 +1,218 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from notifier import PaymentStatusNotifier
+from status_cache import StatusCache
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Without the lifespan nothing connects; routes that only check headers still run
+    monkeypatch.setattr(server, "ADMIN_TOKEN", "admin-secret")
+    monkeypatch.setattr(server, "METRICS_TOKEN", "metrics-secret")
+    monkeypatch.setattr(server.request_profiler, "secret", "admin-secret")
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def api(client, database, monkeypatch):
+    """The client with the app bound to the in-memory database and the default catalog loaded."""
+    for name in ("client", "db", "reporting_db", "registrations", "payment_transactions"):
+        monkeypatch.setattr(server.database, name, getattr(database, name))
+    monkeypatch.setattr(server, "STRIPE_API_KEY", "sk_test")
+    monkeypatch.setattr(server.package_catalog, "packages", {})
+    monkeypatch.setattr(server.package_catalog, "version", None)
+    monkeypatch.setattr(server.packages_payload, "version", None)
+    monkeypatch.setattr(server.slot_manager, "_loaded_at", None)
+    monkeypatch.setattr(server.slot_manager, "_view", {})
+
+    async def load_catalog():
+        await server.package_catalog.seed(server.DEFAULT_PACKAGES)
+        await server.package_catalog.reload()
+
+    asyncio.run(load_catalog())
+    return client
+
+
+def checkout_body(**fields):
+    return {
+        "package_id": "junior_swim",
+        "origin_url": "https://unibaby.example",
+        "registration_data": {"name": "Айгерим", "phone": "+7 777 123 45 67", "child_name": "Алан",
+                              "child_age": 4, "package_id": "junior_swim"},
+        **fields,
+    }
+
+
+def test_non_ascii_profile_token_is_ignored(client):
+    response = client.get("/api/health", headers={"X-Profile-Request": "caf\xe9".encode("latin-1")})
+    assert response.status_code == 200
+
+
+def test_non_ascii_admin_token_is_rejected(client):
+    response = client.get("/api/admin/event-loop", headers={"X-Admin-Token": "caf\xe9".encode("latin-1")})
+    assert response.status_code == 403
+    assert client.get("/api/admin/event-loop", headers={"X-Admin-Token": "admin-secret"}).status_code == 200
+
+
+def test_metrics_require_a_matching_bearer_token(client):
+    assert client.get("/api/metrics").status_code == 403
+    assert client.get("/api/metrics", headers={"Authorization": "Bearer caf\xe9".encode("latin-1")}).status_code == 403
+    assert client.get("/api/metrics", headers={"Authorization": "Bearer metrics-secret"}).status_code == 200
+    assert client.get("/api/metrics", headers={"X-Admin-Token": "admin-secret"}).status_code == 200
+
+
+def test_status_cache_counters_are_exported_as_counters(client):
+    body = client.get("/api/metrics", headers={"Authorization": "Bearer metrics-secret"}).text
+
+    assert "# TYPE unibaby_status_cache_events_total counter" in body
+    assert 'unibaby_status_cache_events_total{event="misses"}' in body
+    assert "# TYPE unibaby_status_cache_size gauge" in body
+    assert 'unibaby_status_cache_size{state="entries"}' in body
+
+
+def test_rejected_seat_hold_stores_no_registration(api, database):
+    async def fill_slot():
+        slot = await server.slot_manager.create_slot("junior_swim", "Mon 10:00", capacity=1)
+        await server.slot_manager.hold(slot["id"], "junior_swim", "someone-else")
+        return slot
+
+    slot = asyncio.run(fill_slot())
+    assert api.post("/api/checkout/session", json=checkout_body(slot_id=slot["id"])).status_code == 409
+    assert api.post("/api/checkout/session", json=checkout_body(slot_id="no-such-slot")).status_code == 404
+    assert asyncio.run(database.registrations.collection.count_documents({})) == 0
+
+
+def test_package_update_changes_the_public_catalog(api):
+    package = {"name": "Junior Swim (3-5 лет)", "price": 19500.0, "currency": "kzt", "sessions": 10}
+    assert api.put("/api/admin/packages/junior_swim", json=package).status_code == 403
+
+    response = api.put("/api/admin/packages/junior_swim", json=package, headers={"X-Admin-Token": "admin-secret"})
+    assert response.status_code == 200
+    assert response.json()["version"] == 2
+
+    packages = api.get("/api/packages").json()["packages"]
+    assert packages["junior_swim"]["price"] == 19500.0
+    assert packages["junior_swim"]["sessions"] == 10
+    assert packages["baby_splash"]["price"] == 15000.0
+
+
+def test_inactive_package_can_no_longer_be_checked_out(api):
+    package = {**server.DEFAULT_PACKAGES["junior_swim"], "active": False}
+    response = api.put("/api/admin/packages/junior_swim", json=package, headers={"X-Admin-Token": "admin-secret"})
+    assert response.status_code == 200
+
+    assert "junior_swim" not in api.get("/api/packages").json()["packages"]
+    response = api.post("/api/checkout/session", json=checkout_body())
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid package"
+
+
+def test_analytics_totals_keep_currencies_apart(api, database):
+    asyncio.run(database.db["daily_rollups"].insert_many([
+        {"day": "2026-10-16", "package_id": "junior_swim", "currency": "kzt", "paid_count": 2, "revenue": 36000.0},
+        {"day": "2026-10-17", "package_id": "junior_swim", "currency": "kzt", "paid_count": 1, "revenue": 18000.0},
+        {"day": "2026-10-17", "package_id": "junior_swim", "currency": "usd", "paid_count": 1, "revenue": 40.0},
+    ]))
+    response = api.get("/api/admin/analytics/daily", headers={"X-Admin-Token": "admin-secret"})
+
+    assert response.status_code == 200
+    assert response.json()["totals"] == {"junior_swim": {
+        "kzt": {"paid_count": 3, "revenue": 54000.0},
+        "usd": {"paid_count": 1, "revenue": 40.0},
+    }}
+
+
+class FakeGateway:
+    async def get_checkout_status(self, session_id):
+        return SimpleNamespace(status="open", payment_status="unpaid", amount_total=1800000, currency="kzt", metadata={})
+
+
+@pytest.fixture
+def stream(api, database, monkeypatch):
+    """Opens the status stream for a pending checkout and collects the events it sends."""
+    monkeypatch.setattr(server, "payment_gateway", FakeGateway())
+    monkeypatch.setattr(server, "status_cache", StatusCache())
+    monkeypatch.setattr(server, "payment_status_notifier", PaymentStatusNotifier())
+    asyncio.run(database.payment_transactions.insert({
+        "id": "p1", "session_id": "cs_1", "registration_id": "r1", "package_id": "junior_swim",
+        "amount": 18000.0, "currency": "kzt", "payment_status": "pending", "status": "initiated",
+        "metadata": {}, "created_at": datetime.utcnow(),
+    }))
+
+    async def run(on_event=None, disconnect_after=None):
+        """Calls `on_event(event)` after each event; the client hangs up after `disconnect_after` events."""
+        events = []
+        hang_up = asyncio.Event()
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                events.append(message["body"].decode())
+                if on_event is not None:
+                    await on_event(events[-1])
+                if len(events) == disconnect_after:
+                    hang_up.set()
+
+        async def receive():
+            await hang_up.wait()
+            return {"type": "http.disconnect"}
+
+        response = await server.stream_checkout_status("cs_1")
+        await response({"type": "http", "method": "GET", "path": "/"}, receive, send)
+        return events
+
+    return run
+
+
+def test_status_stream_delivers_the_terminal_event_from_the_notifier(stream):
+    async def scenario():
+        async def on_event(event):
+            if "unpaid" in event:
+                assert server.payment_status_notifier._waiters
+                server.payment_status_notifier.publish("cs_1", {"status": "complete", "payment_status": "paid"})
+
+        return await stream(on_event)
+
+    events = asyncio.run(scenario())
+    assert events[0].startswith("event: status\n") and '"payment_status": "unpaid"' in events[0]
+    assert events[1] == 'event: status\ndata: {"status": "complete", "payment_status": "paid"}\n\n'
+    assert server.payment_status_notifier._waiters == {}
+
+
+def test_status_stream_unsubscribes_when_the_client_disconnects(stream):
+    events = asyncio.run(stream(disconnect_after=1))
+    assert len(events) == 1
+    assert server.payment_status_notifier._waiters == {}
+
+
+def test_status_stream_times_out_so_the_client_falls_back_to_polling(stream, monkeypatch):
+    monkeypatch.setattr(server, "STATUS_STREAM_TIMEOUT", 0.05)
+    monkeypatch.setattr(server, "STATUS_STREAM_KEEPALIVE", 0.02)
+    events = asyncio.run(stream())
+
+    assert events[0].startswith("event: status\n")
+    assert ": keep-alive\n\n" in events
+    assert events[-1].startswith("event: timeout\n") and '"payment_status": "unpaid"' in events[-1]
+    assert server.payment_status_notifier._waiters == {}
+
+
+def test_status_stream_picks_up_a_payment_applied_by_another_worker(stream, database, monkeypatch):
+    monkeypatch.setattr(server, "STATUS_STREAM_KEEPALIVE", 0.02)
+
+    async def scenario():
+        async def on_event(event):
+            # Written without publishing, as a webhook handled by another worker would be
+            await database.payment_transactions.collection.update_one(
+                {"session_id": "cs_1"}, {"$set": {"payment_status": "paid", "status": "complete"}}
+            )
+
+        return await stream(on_event)
+
+    events = asyncio.run(scenario())
+    assert len(events) == 2
+    assert events[1].startswith("event: status\n") and '"payment_status": "paid"' in events[1]
@@ -0,0 +1,132 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from slots import SlotManager, SlotUnavailable
+
+
+async def slot_doc(manager, slot_id):
+    return await manager.slots.find_one({"id": slot_id}, {"_id": 0, "available": 1, "hold_ids": 1})
+
+
+async def expire_hold(manager, hold_id):
+    await manager.holds.update_one({"id": hold_id}, {"$set": {"expires_at": datetime.utcnow() - timedelta(seconds=1)}})
+
+
+def test_hold_takes_seats_until_the_slot_is_full(database):
+    async def scenario():
+        manager = SlotManager(database)
+        slot = await manager.create_slot("junior_swim", "Mon 10:00", capacity=2)
+        holds = await asyncio.gather(*(manager.hold(slot["id"], "junior_swim", f"r{i}") for i in range(2)))
+        with pytest.raises(SlotUnavailable):
+            await manager.hold(slot["id"], "junior_swim", "r3")
+        return holds, await slot_doc(manager, slot["id"]), await manager.holds.count_documents({})
+
+    holds, slot, hold_count = asyncio.run(scenario())
+    assert slot["available"] == 0
+    assert sorted(slot["hold_ids"]) == sorted(hold["id"] for hold in holds)
+    # The losing hold is removed again
+    assert hold_count == 2
+
+
+def test_expired_hold_is_released_and_reported(database):
+    async def scenario():
+        expired_sessions = []
+
+        async def on_expired(session_ids):
+            expired_sessions.extend(session_ids)
+
+        manager = SlotManager(database, on_expired=on_expired)
+        slot = await manager.create_slot("junior_swim", "Mon 10:00", capacity=1)
+        hold = await manager.hold(slot["id"], "junior_swim", "r1")
+        await manager.attach_session(hold["id"], "cs_1")
+        await expire_hold(manager, hold["id"])
+        released = await manager.release_expired()
+        return released, expired_sessions, await slot_doc(manager, slot["id"]), await manager.holds.find_one({"id": hold["id"]})
+
+    released, expired_sessions, slot, hold = asyncio.run(scenario())
+    assert released == 1
+    assert expired_sessions == ["cs_1"]
+    assert (slot["available"], slot["hold_ids"]) == (1, [])
+    assert hold["status"] == "released"
+
+
+def test_release_is_idempotent(database):
+    async def scenario():
+        manager = SlotManager(database)
+        slot = await manager.create_slot("junior_swim", "Mon 10:00", capacity=1)
+        hold = await manager.hold(slot["id"], "junior_swim", "r1")
+        await manager.attach_session(hold["id"], "cs_1")
+        first = await manager.release(hold["id"])
+        second = await manager.release(hold["id"])
+        by_session = await manager.release_sessions(["cs_1"])
+        # A hold left half released is finished once, not twice
+        await manager.holds.update_one({"id": hold["id"]}, {"$set": {"status": "releasing"}})
+        await manager.release_expired()
+        return first, second, by_session, await slot_doc(manager, slot["id"])
+
+    first, second, by_session, slot = asyncio.run(scenario())
+    assert (first, second, by_session) == (True, False, 0)
+    assert slot["available"] == 1
+
+
+def test_expired_session_releases_its_hold(database):
+    async def scenario():
+        manager = SlotManager(database)
+        slot = await manager.create_slot("junior_swim", "Mon 10:00", capacity=1)
+        hold = await manager.hold(slot["id"], "junior_swim", "r1")
+        await manager.attach_session(hold["id"], "cs_1")
+        return await manager.release_sessions(["cs_1"]), await slot_doc(manager, slot["id"])
+
+    released, slot = asyncio.run(scenario())
+    assert released == 1
+    assert slot["available"] == 1
+
+
+def test_payment_after_release_retakes_a_free_seat(database):
+    async def scenario():
+        manager = SlotManager(database)
+        slot = await manager.create_slot("junior_swim", "Mon 10:00", capacity=1)
+        hold = await manager.hold(slot["id"], "junior_swim", "r1")
+        await manager.attach_session(hold["id"], "cs_1")
+        await manager.release(hold["id"])
+        await manager.confirm(["cs_1"])
+        return await slot_doc(manager, slot["id"]), await manager.holds.find_one({"id": hold["id"]})
+
+    slot, hold = asyncio.run(scenario())
+    assert slot["available"] == 0
+    assert hold["status"] == "confirmed"
+
+
+def test_payment_after_release_into_a_full_slot_is_marked_overbooked(database):
+    async def scenario():
+        manager = SlotManager(database)
+        slot = await manager.create_slot("junior_swim", "Mon 10:00", capacity=1)
+        hold = await manager.hold(slot["id"], "junior_swim", "r1")
+        await manager.attach_session(hold["id"], "cs_1")
+        await manager.release(hold["id"])
+        await manager.hold(slot["id"], "junior_swim", "r2")
+        await manager.confirm(["cs_1"])
+        return await slot_doc(manager, slot["id"]), await manager.holds.find_one({"id": hold["id"]})
+
+    slot, hold = asyncio.run(scenario())
+    assert slot["available"] == 0
+    assert hold["status"] == "overbooked"
+
+
+def test_confirm_keeps_the_seat_and_stops_tracking_the_hold(database):
+    async def scenario():
+        manager = SlotManager(database)
+        slot = await manager.create_slot("junior_swim", "Mon 10:00", capacity=1)
+        hold = await manager.hold(slot["id"], "junior_swim", "r1")
+        await manager.attach_session(hold["id"], "cs_1")
+        await manager.confirm(["cs_1"])
+        await expire_hold(manager, hold["id"])
+        released = await manager.release_expired()
+        return released, await slot_doc(manager, slot["id"]), await manager.holds.find_one({"id": hold["id"]})
+
+    released, slot, hold = asyncio.run(scenario())
+    assert released == 0
+    assert (slot["available"], slot["hold_ids"]) == (0, [])
+    assert hold["status"] == "confirmed"
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from status_cache import StatusCache
+
+
+def test_concurrent_gets_share_one_load():
+    async def scenario():
+        cache = StatusCache(ttl=10)
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"status": "open"}
+
+        results = await asyncio.gather(*(cache.get("cs", loader) for _ in range(5)))
+        return cache, calls, results
+
+    cache, calls, results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert results == [{"status": "open"}] * 5
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_hit_within_ttl_and_reload_after_expiry():
+    async def scenario():
+        cache = StatusCache(ttl=0.05)
+        loads = iter([{"n": 1}, {"n": 2}])
+
+        async def loader():
+            return next(loads)
+
+        first = await cache.get("cs", loader)
+        cached = await cache.get("cs", loader)
+        await asyncio.sleep(0.06)
+        reloaded = await cache.get("cs", loader)
+        return cache, first, cached, reloaded
+
+    cache, first, cached, reloaded = asyncio.run(scenario())
+    assert (first, cached, reloaded) == ({"n": 1}, {"n": 1}, {"n": 2})
+    assert cache.hits == 1
+
+
+def test_lru_eviction():
+    async def scenario():
+        cache = StatusCache(ttl=10, max_entries=2)
+        for session_id in ("a", "b", "c"):
+            await cache.get(session_id, lambda: asyncio.sleep(0, result={"id": session_id}))
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert cache.evictions == 1
+    assert cache.stats()["entries"] == 2
+
+
+def test_invalidation_during_load_discards_stale_result():
+    async def scenario():
+        cache = StatusCache(ttl=10)
+        release = asyncio.Event()
+
+        async def slow_loader():
+            await release.wait()
+            return {"status": "open"}
+
+        task = asyncio.create_task(cache.get("cs", slow_loader))
+        await asyncio.sleep(0)
+        cache.invalidate("cs")
+        release.set()
+        await task
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert cache.stats()["entries"] == 0
+
+
+def test_failed_load_is_not_cached():
+    async def scenario():
+        cache = StatusCache(ttl=10)
+
+        async def failing():
+            raise RuntimeError("stripe down")
+
+        with pytest.raises(RuntimeError):
+            await cache.get("cs", failing)
+        return await cache.get("cs", lambda: asyncio.sleep(0, result={"status": "open"}))
+
+    assert asyncio.run(scenario()) == {"status": "open"}
@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from indexes import ensure_indexes
+from webhook_queue import WebhookQueue
+
+
+class RecordingStateMachine:
+    """Records applied batches; any batch containing a poison session raises."""
+
+    def __init__(self, poison=()):
+        self.poison = set(poison)
+        self.batches = []
+
+    async def apply_webhook_events(self, events):
+        self.batches.append([e["session_id"] for e in events])
+        if self.poison & {e["session_id"] for e in events}:
+            raise RuntimeError("bulk write failed")
+
+
+def webhook_event(n, event_type="checkout.session.completed"):
+    return SimpleNamespace(event_id=f"evt_{n}", event_type=event_type, session_id=f"cs_{n}",
+                           payment_status="paid", metadata={})
+
+
+async def make_queue(database, state_machine, **options):
+    await ensure_indexes(database.db)
+    return WebhookQueue(database, state_machine, **options)
+
+
+async def statuses(queue):
+    return {doc["event_id"]: doc async for doc in queue.collection.find({}, {"_id": 0})}
+
+
+def test_duplicate_delivery_is_queued_once(database):
+    async def scenario():
+        queue = await make_queue(database, RecordingStateMachine())
+        first = await queue.enqueue(webhook_event(1), b"{}")
+        again = await queue.enqueue(webhook_event(1), b"{}")
+        return first, again, await queue.collection.count_documents({})
+
+    assert asyncio.run(scenario()) == (True, False, 1)
+
+
+def test_batch_is_applied_and_marked_processed(database):
+    async def scenario():
+        state_machine = RecordingStateMachine()
+        queue = await make_queue(database, state_machine)
+        for n in range(3):
+            await queue.enqueue(webhook_event(n), b"{}")
+        await queue.enqueue(webhook_event(9, event_type="payment_intent.created"), b"{}")
+        drained = await queue.drain_once()
+        return drained, state_machine.batches, await statuses(queue)
+
+    drained, batches, events = asyncio.run(scenario())
+    assert drained == 4
+    # Unhandled event types are acknowledged without reaching the state machine
+    assert batches == [["cs_0", "cs_1", "cs_2"]]
+    assert {event["status"] for event in events.values()} == {"processed"}
+
+
+def test_expired_lease_is_reclaimed(database):
+    async def scenario():
+        state_machine = RecordingStateMachine()
+        queue = await make_queue(database, state_machine)
+        await queue.enqueue(webhook_event(1), b"{}")
+        # A worker claimed the event and died
+        await queue.collection.update_one({"event_id": "evt_1"}, {"$set": {
+            "status": "processing", "lock_token": "dead", "attempts": 1,
+            "locked_until": datetime.utcnow() - timedelta(seconds=1),
+        }})
+        await queue.drain_once()
+        return state_machine.batches, await statuses(queue)
+
+    batches, events = asyncio.run(scenario())
+    assert batches == [["cs_1"]]
+    assert events["evt_1"]["status"] == "processed"
+    assert events["evt_1"]["attempts"] == 2
+
+
+def test_bulk_failure_falls_back_to_single_events(database):
+    async def scenario():
+        state_machine = RecordingStateMachine(poison={"cs_1"})
+        queue = await make_queue(database, state_machine)
+        for n in range(3):
+            await queue.enqueue(webhook_event(n), b"{}")
+        await queue.drain_once()
+        return state_machine.batches, await statuses(queue)
+
+    batches, events = asyncio.run(scenario())
+    assert batches == [["cs_0", "cs_1", "cs_2"], ["cs_0"], ["cs_1"], ["cs_2"]]
+    assert events["evt_0"]["status"] == events["evt_2"]["status"] == "processed"
+    # The poison event waits for its lease to run out before the next attempt
+    assert events["evt_1"]["status"] == "processing"
+    assert "bulk write failed" in events["evt_1"]["last_error"]
+
+
+def test_poison_event_ends_failed_after_max_attempts(database):
+    async def scenario():
+        state_machine = RecordingStateMachine(poison={"cs_1"})
+        queue = await make_queue(database, state_machine, lease_seconds=-1, max_attempts=2)
+        await queue.enqueue(webhook_event(1), b"{}")
+        # lease_seconds=-1 makes every claim immediately reclaimable
+        for _ in range(3):
+            await queue.drain_once()
+        return state_machine.batches, await statuses(queue)
+
+    batches, events = asyncio.run(scenario())
+    assert len(batches) == 4
+    assert events["evt_1"]["status"] == "failed"
+    assert events["evt_1"]["attempts"] == 2
+    assert "bulk write failed" in events["evt_1"]["last_error"]
+    assert "lock_token" not in events["evt_1"]